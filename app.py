@@ -1,25 +1,332 @@
-from flask import Flask, jsonify, request, abort
-from database.models import setup_db, Movie, Actor, GenderType
+import click
+from flask import Flask, Response, current_app, request, abort, g, \
+    stream_with_context
+from database.models import setup_db, db, Movie, Actor, GenderType
+from database.queries import format_movies, paginate, \
+    get_by_ids, find_missing_ids, resolve_actors, insert_rows, \
+    insert_links, update_returning, row_exists, replace_cast, \
+    filter_actors, filter_movies, columns, rows_to_dicts, expand_movies, \
+    expand_actors, load_by_ids, link_actors, unlink_actors, cast_size, \
+    catalogue_stamp, MOVIE_FIELDS, ACTOR_FIELDS, DEFAULT_PAGE_SIZE, \
+    MAX_PAGE_SIZE
+from database.validation import validate_movie, validate_actor, \
+    validate_cast, parse_date
+from database.revisions import revisions
+from database.graph import init_cast_index
+from database.stats import compute_stats, init_stats
+from database.changes import changes_since, encode_token, decode_token
+from database.pool import pool_status
+from database.routing import WRITE_TOKEN_HEADER
+from database.export import iter_movies, iter_actors, to_ndjson, to_csv, \
+    MOVIE_EXPORT_FIELDS, ACTOR_EXPORT_FIELDS
+from cache.response_cache import ResponseCache, content_etag
+from serialization.json_provider import init_json, jsonify
+from middleware.compression import init_compression
+from middleware.instrumentation import init_instrumentation
+from middleware.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
 from flask_cors import CORS
+from config import get_profile
+from sqlalchemy import text
 from auth.auth import AuthError, requires_auth
-import sys
 
 
-def create_app(test_config=None):
+def get_page_args():
+    """
+    get_page_args()
+        reads the limit and cursor query parameters of a list request,
+        aborting with 400 when limit is not in 1..MAX_PAGE_SIZE
+    """
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        abort(400)
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        abort(400)
+    return limit, request.args.get('cursor')
+
+
+# actors.movies also lists the movies of every cast member, the full
+# shape these endpoints returned before sparse fieldsets.
+MOVIE_EXPANSIONS = ('actors', 'actors.movies')
+ACTOR_EXPANSIONS = ('movies',)
+
+
+def get_shape_args(allowed_fields, allowed_expansions):
+    """
+    get_shape_args(allowed_fields, allowed_expansions)
+        reads the fields and expand query parameters, aborting with 400
+        on an unknown field or expansion. id is always selected.
+    """
+    fields = allowed_fields
+    if 'fields' in request.args:
+        requested = [field.strip() for field in
+                     request.args['fields'].split(',') if field.strip()]
+        if not set(requested) <= set(allowed_fields):
+            abort(400)
+        fields = tuple(field for field in allowed_fields
+                       if field == 'id' or field in requested)
+
+    expand = request.args.get('expand')
+    if expand is not None and expand not in allowed_expansions:
+        abort(400)
+    return fields, expand
+
+
+def get_actor_filters():
+    """
+    get_actor_filters()
+        reads the gender, age_min, age_max and not_in_movie query
+        parameters, aborting with 400 when one is malformed
+    """
+    filters = {}
+    try:
+        if 'gender' in request.args:
+            filters['gender'] = GenderType(request.args['gender'])
+        for key in ('age_min', 'age_max', 'not_in_movie'):
+            if key in request.args:
+                filters[key] = int(request.args[key])
+    except ValueError:
+        abort(400)
+    return filters
+
+
+def get_movie_filters():
+    """
+    get_movie_filters()
+        reads the title_prefix, released_after and released_before query
+        parameters, aborting with 400 when a date is malformed
+    """
+    filters = {'title_prefix': request.args.get('title_prefix')}
+    try:
+        for key in ('released_after', 'released_before'):
+            if key in request.args:
+                filters[key] = parse_date(request.args[key])
+    except ValueError:
+        abort(400)
+    return filters
+
+
+DEFAULT_MAX_BULK_SIZE = 500
+
+
+def get_bulk_items(key):
+    """
+    get_bulk_items(key)
+        returns the items of a bulk request, sent either as a JSON array or
+        as an object holding the array under key, aborting with 400 when
+        there are none or more than the MAX_BULK_SIZE setting
+    """
+    max_size = int(current_app.config.get('MAX_BULK_SIZE',
+                                          DEFAULT_MAX_BULK_SIZE))
+    body = request.get_json()
+    items = body.get(key) if isinstance(body, dict) else body
+    if not isinstance(items, list) or not 1 <= len(items) <= max_size:
+        abort(400)
+    return items
+
+
+def is_partial_request():
+    return request.args.get('partial', '').lower() in ('1', 'true', 'yes')
+
+
+def get_cast(body):
+    """
+    get_cast(body)
+        returns the actor ids listed under 'actors' in a movie payload,
+        aborting with 400 when they are not a list of integers
+    """
+    actor_ids = body['actors']
+    if not isinstance(actor_ids, list) or not all(
+            isinstance(actor_id, int) and not isinstance(actor_id, bool)
+            for actor_id in actor_ids):
+        abort(400)
+    return actor_ids
+
+
+def actors_not_found(missing):
+    return jsonify({
+        'success': False,
+        'error': 404,
+        'message': 'Not found',
+        'missing_actors': missing
+    }), 404
+
+
+def get_cast_args(movie_id):
+    """
+    get_cast_args(movie_id)
+        reads the actor ids of a cast request body, aborting with 400
+        without a JSON body and with 404 when the movie does not exist
+    """
+    body = request.get_json()
+    if body is None:
+        abort(400)
+    actor_ids, errors = validate_cast(body)
+    if not errors and not row_exists(Movie, movie_id):
+        abort(404)
+    return actor_ids, errors
+
+
+def commit_cast_change(movie_id, changed):
+    """
+    commit_cast_change(movie_id, changed)
+        commits a link or unlink and returns the movie's version, bumped
+        when its cast changed. If-Match is checked either way, aborting
+        with 412 when stale and with 404 when the movie is gone.
+    """
+    expected_versions = get_expected_versions()
+    if changed:
+        row = update_returning(Movie, movie_id, {}, expected_versions)
+        if row is None:
+            db.session.rollback()
+            abort(412 if row_exists(Movie, movie_id) else 404)
+        version = row.version
+    else:
+        version = db.session.query(Movie.version) \
+            .filter(Movie.id == movie_id).scalar()
+        if version is None:
+            abort(404)
+        if expected_versions is not None and \
+                version not in expected_versions:
+            abort(412)
+    db.session.commit()
+    return version
+
+
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+
+def export_response(rows, fields, name):
+    """
+    export_response(rows, fields, name)
+        streams rows as NDJSON or, with ?format=csv, as CSV without
+        building the body in memory
+    """
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        abort(400)
+
+    body = to_csv(rows, fields) if export_format == 'csv' \
+        else to_ndjson(rows)
+    response = Response(stream_with_context(body),
+                        mimetype=EXPORT_FORMATS[export_format])
+    response.headers['Content-Disposition'] = \
+        'attachment; filename={}.{}'.format(name, export_format)
+    return response
+
+
+def get_expected_versions():
+    """
+    get_expected_versions()
+        returns the versions named by the ETags in If-Match, None when
+        the header is missing or '*', aborting with 412 when no tag names
+        a version. Weak tags count too: the compressor weakens the ETags
+        it sends, and the version prefix names the row whatever the
+        encoding of the body.
+    """
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    versions = set()
+    for tag in request.if_match.as_set(include_weak=True):
+        try:
+            versions.add(int(tag.split('-', 1)[0]))
+        except ValueError:
+            continue
+    if not versions:
+        abort(412)
+    return versions
+
+
+def version_etag(version, body=None):
+    """
+    version_etag(version, body)
+        returns the ETag of a single movie or actor: its version, which
+        If-Match is checked against. Expanded representations embed
+        other rows and also carry a digest of their body.
+    """
+    if body is None:
+        return str(version)
+    return '{}-{}'.format(version, content_etag(body)[:16])
+
+
+def unprocessable(errors):
+    return jsonify({
+        'success': False,
+        'error': 422,
+        'message': 'Unprocessable entity',
+        'errors': errors
+    }), 422
+
+
+def create_app(config=None, **settings):
+    """
+    create_app(config, **settings)
+        builds the app for a profile of config.PROFILES. config is either
+        the profile name ('development', 'test' or 'production', default
+        APP_PROFILE) or a mapping of settings applied on top of it;
+        keyword settings are applied last.
+    """
     app = Flask(__name__)
-    app.debug = True
+    if isinstance(config, str):
+        app.config.from_object(get_profile(config))
+    else:
+        app.config.from_object(get_profile())
+        if config is not None:
+            app.config.from_mapping(config)
+    app.config.from_mapping(settings)
     CORS(app)
-    setup_db(app)
+    setup_db(app, app.config['DATABASE_URL'])
+    init_json(app)
+    instrumentation = init_instrumentation(app)
+    init_compression(app)
+
+    response_cache = ResponseCache.from_config(app.config,
+                                               stamp=catalogue_stamp)
+    revisions.add_listener(response_cache.invalidate)
+    app.extensions['response_cache'] = response_cache
+    cast_index = init_cast_index(app)
+    stats_summary = init_stats(app)
+
+    @app.cli.command('refresh-stats')
+    def refresh_stats():
+        """Fills or brings the StatsSummary table up to date."""
+        summary = app.extensions.get('stats_summary')
+        if summary is None:
+            raise click.ClickException(
+                'STATS_SUMMARY_ENABLED is off, nothing to refresh')
+        summary.refresh(fill=True)
 
     # CORS Headers
     @app.after_request
     def after_request(response):
         response.headers.add(
-            "Access-Control-Allow-Headers", "Content-Type,Authorization,true"
+            "Access-Control-Allow-Headers",
+            "Content-Type,Authorization,If-None-Match,If-Match,"
+            + WRITE_TOKEN_HEADER + ",true"
         )
         response.headers.add(
             "Access-Control-Allow-Methods", "GET,PUT,POST,DELETE,OPTIONS"
         )
+        response.headers.add("Access-Control-Expose-Headers",
+                             "ETag," + WRITE_TOKEN_HEADER)
+
+        etag = g.get('etag')
+        if etag is not None and response.status_code in (200, 304):
+            if 'ETag' not in response.headers:
+                response.set_etag(etag, weak=g.get('etag_weak', False))
+            response.headers['Cache-Control'] = 'private, no-cache'
+        elif 'Cache-Control' not in response.headers:
+            response.headers['Cache-Control'] = 'no-store'
+
+        router = app.extensions.get('replica_router')
+        if router is not None and request.method in WRITE_METHODS \
+                and response.status_code < 400:
+            router.add_write_token(response)
         return response
 
     @app.route('/')
@@ -28,20 +335,261 @@ def create_app(test_config=None):
             'success': True
         })
 
+    if instrumentation is not None:
+        instrumentation.registry.gauge(
+            'db_pool_connections', 'Primary pool connections by state.',
+            lambda: [({'state': state}, pool_status(db.engine).get(state, 0))
+                     for state in ('checked_out', 'idle', 'overflow')])
+        instrumentation.registry.gauge(
+            'response_cache_hit_ratio', 'Response cache hit ratio.',
+            lambda: [({}, response_cache.stats()['hit_ratio'])])
+
+    @app.route('/metrics')
+    def get_metrics():
+        if instrumentation is None:
+            abort(404)
+        return Response(instrumentation.registry.render(),
+                        content_type=METRICS_CONTENT_TYPE)
+
+    # Profiles hold stack traces and request paths, so unlike the
+    # counters above they need a token.
+    @app.route('/metrics/profiles')
+    @requires_auth('read:metrics')
+    def get_profiles():
+        if instrumentation is None:
+            abort(404)
+        return jsonify({
+            'success': True,
+            'profiles': instrumentation.profiles()
+        })
+
+    @app.route('/metrics/cache')
+    def get_cache_metrics():
+        return jsonify({
+            'success': True,
+            'response_cache': response_cache.stats()
+        })
+
+    # Replica URLs show the database user, host and name.
+    @app.route('/metrics/pool')
+    @requires_auth('read:metrics')
+    def get_pool_metrics():
+        router = app.extensions.get('replica_router')
+        return jsonify({
+            'success': True,
+            'pool': pool_status(db.engine),
+            'replicas': [dict(replica, pool=pool_status(engine))
+                         for replica, engine in
+                         zip(router.status(), router.engines)]
+            if router is not None else []
+        })
+
+    @app.route('/health/db')
+    def get_database_health():
+        g.use_primary = True
+        try:
+            db.session.execute(text('SELECT 1'))
+        except Exception:
+            db.session.rollback()
+            app.logger.exception('Database health check failed')
+            return jsonify({
+                'success': False,
+                'error': 503,
+                'message': 'Database unavailable',
+                'pool': pool_status(db.engine)
+            }), 503
+
+        return jsonify({
+            'success': True,
+            'pool': pool_status(db.engine)
+        })
+
     @app.route('/movies')
     @requires_auth('read:movies')
+    @response_cache.conditional
+    @response_cache.cached
     def get_all_movies():
+        limit, cursor = get_page_args()
+        fields, expand = get_shape_args(MOVIE_FIELDS, MOVIE_EXPANSIONS)
+        query = filter_movies(db.session.query(*columns(Movie, fields)),
+                              **get_movie_filters())
+        try:
+            rows, next_cursor = paginate(query, Movie.id, limit, cursor)
+        except ValueError:
+            abort(400)
+
+        movies = rows_to_dicts(rows, fields)
+        if expand is not None:
+            expand_movies(movies, nested=expand == 'actors.movies')
+
         return jsonify({
             'success': True,
-            'movies': [movie.format() for movie in Movie.query.all()]
+            'movies': movies,
+            'next_cursor': next_cursor
         })
 
     @app.route('/actors')
     @requires_auth('read:actors')
+    @response_cache.conditional
+    @response_cache.cached
     def get_all_actors():
+        limit, cursor = get_page_args()
+        fields, expand = get_shape_args(ACTOR_FIELDS, ACTOR_EXPANSIONS)
+        query = filter_actors(db.session.query(*columns(Actor, fields)),
+                              **get_actor_filters())
+        try:
+            rows, next_cursor = paginate(query, Actor.id, limit, cursor)
+        except ValueError:
+            abort(400)
+
+        actors = rows_to_dicts(rows, fields)
+        if expand is not None:
+            expand_actors(actors)
+
+        return jsonify({
+            'success': True,
+            'actors': actors,
+            'next_cursor': next_cursor
+        })
+
+    @app.route('/movies/<int:movie_id>')
+    @requires_auth('read:movies')
+    @response_cache.conditional
+    @response_cache.cached
+    def get_movie_by_id(movie_id):
+        fields, expand = get_shape_args(MOVIE_FIELDS, MOVIE_EXPANSIONS)
+        row = db.session.query(*columns(Movie, fields), Movie.version) \
+            .filter(Movie.id == movie_id).first()
+        if row is None:
+            abort(404)
+
+        movies = rows_to_dicts([row], fields)
+        if expand is not None:
+            expand_movies(movies, nested=expand == 'actors.movies')
+
+        response = jsonify({
+            'success': True,
+            'movie': movies[0]
+        })
+        g.etag = version_etag(row[-1], response.get_data()
+                              if expand is not None else None)
+        return response
+
+    @app.route('/actors/<int:actor_id>')
+    @requires_auth('read:actors')
+    @response_cache.conditional
+    @response_cache.cached
+    def get_actor_by_id(actor_id):
+        fields, expand = get_shape_args(ACTOR_FIELDS, ACTOR_EXPANSIONS)
+        row = db.session.query(*columns(Actor, fields), Actor.version) \
+            .filter(Actor.id == actor_id).first()
+        if row is None:
+            abort(404)
+
+        actors = rows_to_dicts([row], fields)
+        if expand is not None:
+            expand_actors(actors)
+
+        response = jsonify({
+            'success': True,
+            'actor': actors[0]
+        })
+        g.etag = version_etag(row[-1], response.get_data()
+                              if expand is not None else None)
+        return response
+
+    @app.route('/actors/<int:actor_id>/costars')
+    @requires_auth('read:actors')
+    @response_cache.conditional
+    @response_cache.cached
+    def get_costars(actor_id):
+        limit, cursor = get_page_args()
+        if cursor is not None:
+            # costars are ranked by shared movies, not by id, so the
+            # keyset cursor used by the list endpoints does not apply
+            abort(400)
+        if not row_exists(Actor, actor_id):
+            abort(404)
+
+        costars = cast_index.graph().costars(actor_id)
+        shared = dict(costars[:limit])
+        actors = load_by_ids(Actor, ACTOR_FIELDS, list(shared))
+        for actor in actors:
+            actor['shared_movies'] = shared[actor['id']]
+
+        return jsonify({
+            'success': True,
+            'costars': actors,
+            'total': len(costars)
+        })
+
+    @app.route('/actors/<int:source_id>/path/<int:target_id>')
+    @requires_auth('read:movies', 'read:actors')
+    @response_cache.conditional
+    @response_cache.cached
+    def get_collaboration_path(source_id, target_id):
+        if not row_exists(Actor, source_id) or \
+                not row_exists(Actor, target_id):
+            abort(404)
+
+        path = cast_index.graph().shortest_path(source_id, target_id)
+        actor_ids, movie_ids = path if path is not None else ([], [])
+        return jsonify({
+            'success': True,
+            'degrees': len(movie_ids) if path is not None else None,
+            'actors': load_by_ids(Actor, ACTOR_FIELDS, actor_ids),
+            'movies': load_by_ids(Movie, MOVIE_FIELDS, movie_ids)
+        })
+
+    @app.route('/stats')
+    @requires_auth('read:movies', 'read:actors')
+    @response_cache.conditional
+    @response_cache.cached
+    def get_stats():
+        if stats_summary is None:
+            stats = compute_stats()
+        else:
+            # Refreshing the summary writes, so it has to use the primary.
+            g.use_primary = True
+            stats = stats_summary.read()
+
+        return jsonify({
+            'success': True,
+            **stats
+        })
+
+    @app.route('/export/movies')
+    @requires_auth('read:movies')
+    def export_movies():
+        return export_response(iter_movies(), MOVIE_EXPORT_FIELDS,
+                               'movies')
+
+    @app.route('/export/actors')
+    @requires_auth('read:actors')
+    def export_actors():
+        return export_response(iter_actors(), ACTOR_EXPORT_FIELDS,
+                               'actors')
+
+    @app.route('/changes')
+    @requires_auth('read:movies', 'read:actors')
+    def get_changes():
+        limit, _ = get_page_args()
+        try:
+            cursors = decode_token(request.args['since']) \
+                if 'since' in request.args else {}
+        except ValueError:
+            abort(400)
+
+        # A lagging replica could hide rows older than the settle window
+        # that the returned token already moves past.
+        g.use_primary = True
+        changes, next_cursors, has_more = changes_since(
+            cursors, limit, float(app.config['CHANGES_SETTLE_SECONDS']))
         return jsonify({
             'success': True,
-            'actors': [actor.format() for actor in Actor.query.all()]
+            **changes,
+            'next': encode_token(next_cursors),
+            'has_more': has_more
         })
 
     @app.route('/movies', methods=['POST'])
@@ -54,13 +602,12 @@ def create_app(test_config=None):
 
         actors = []
         if 'actors' in body:
-            actor_ids = body['actors']
-            for id in actor_ids:
-                actors.append(Actor.query.get_or_404(id))
+            actors, missing = resolve_actors(get_cast(body))
+            if missing:
+                return actors_not_found(missing)
 
         try:
-            title, release_date = body['title'], body['release_date']
-            movie = Movie(title, release_date)
+            movie = Movie(body['title'], parse_date(body['release_date']))
             movie.actors = actors
             movie.insert()
 
@@ -69,7 +616,7 @@ def create_app(test_config=None):
                 'created': movie.format()
             }), 201
         except:
-            print(sys.exc_info())
+            app.logger.exception('Could not insert %s', request.path)
             abort(422)
 
     @app.route('/actors', methods=['POST'])
@@ -91,55 +638,214 @@ def create_app(test_config=None):
                 'created': actor.format()
             }), 201
         except:
-            print(sys.exc_info())
+            app.logger.exception('Could not insert %s', request.path)
+            abort(422)
+
+    @app.route('/movies/bulk', methods=['POST'])
+    @requires_auth('create:movies')
+    def add_movies_in_bulk():
+        items = get_bulk_items('movies')
+
+        movies, errors = [], []
+        for index, item in enumerate(items):
+            values, actor_ids, item_errors = validate_movie(item)
+            if item_errors:
+                errors.append({'index': index, 'errors': item_errors})
+            else:
+                movies.append((index, values, actor_ids))
+
+        missing = set(find_missing_ids(Actor.id, {
+            actor_id for _, _, actor_ids in movies for actor_id in actor_ids
+        }))
+        if missing:
+            resolved = []
+            for index, values, actor_ids in movies:
+                not_found = [actor_id for actor_id in actor_ids
+                             if actor_id in missing]
+                if not_found:
+                    errors.append({'index': index, 'errors': {
+                        'actors': 'Actors not found: {}.'.format(
+                            ', '.join(map(str, not_found)))
+                    }})
+                else:
+                    resolved.append((index, values, actor_ids))
+            movies = resolved
+            errors.sort(key=lambda error: error['index'])
+
+        if not movies or (errors and not is_partial_request()):
+            return unprocessable(errors)
+
+        try:
+            movie_ids = insert_rows(Movie, [values for _, values, _ in movies])
+            insert_links([(movie_id, actor_id) for movie_id, (_, _, actor_ids)
+                          in zip(movie_ids, movies)
+                          for actor_id in actor_ids])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            app.logger.exception('Could not insert %s', request.path)
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            'created': format_movies(get_by_ids(Movie, movie_ids)),
+            'errors': errors
+        }), 201
+
+    @app.route('/actors/bulk', methods=['POST'])
+    @requires_auth('create:actors')
+    def add_actors_in_bulk():
+        items = get_bulk_items('actors')
+
+        actors, errors = [], []
+        for index, item in enumerate(items):
+            values, item_errors = validate_actor(item)
+            if item_errors:
+                errors.append({'index': index, 'errors': item_errors})
+            else:
+                actors.append(values)
+
+        if not actors or (errors and not is_partial_request()):
+            return unprocessable(errors)
+
+        try:
+            actor_ids = insert_rows(Actor, actors)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            app.logger.exception('Could not insert %s', request.path)
             abort(422)
 
+        return jsonify({
+            'success': True,
+            # New actors have no movies yet.
+            'created': [dict(actor.format_without_movies(), movies=[])
+                        for actor in get_by_ids(Actor, actor_ids)],
+            'errors': errors
+        }), 201
+
     @app.route('/movies/<int:movie_id>', methods=['PATCH'])
     @requires_auth('update:movies')
     def update_movie_by_id(movie_id):
-        movie = Movie.query.get_or_404(movie_id)
         body = request.get_json()
 
         if body is None:
             abort(400)
 
-        if 'title' in body:
-            movie.title = body['title']
+        values, actor_ids, errors = validate_movie(body, partial=True)
+        if errors:
+            return unprocessable(errors)
+
+        actors = None
+        if actor_ids is not None:
+            actors, missing = resolve_actors(actor_ids)
+            if missing:
+                return actors_not_found(missing)
+
+        row = update_returning(Movie, movie_id, values,
+                               get_expected_versions())
+        if row is None:
+            db.session.rollback()
+            abort(412 if row_exists(Movie, movie_id) else 404)
+
+        if actors is not None:
+            replace_cast(movie_id, [actor.id for actor in actors])
+        db.session.commit()
+
+        updated = {
+            'id': row.id,
+            'title': row.title,
+            'release_date': row.release_date,
+            'version': row.version
+        }
+        if actors is not None:
+            updated['actors'] = [actor.format_without_movies()
+                                 for actor in actors]
+
+        response = jsonify({
+            'success': True,
+            'updated': updated
+        })
+        response.set_etag(str(row.version))
+        return response
 
-        if 'release_date' in body:
-            movie.release_date = body['release_date']
+    @app.route('/movies/<int:movie_id>/actors', methods=['POST'])
+    @requires_auth('update:movies')
+    def link_movie_actors(movie_id):
+        actor_ids, errors = get_cast_args(movie_id)
+        if errors:
+            return unprocessable(errors)
 
-        movie.update()
+        missing = find_missing_ids(Actor.id, actor_ids)
+        if missing:
+            return actors_not_found(missing)
 
-        return jsonify({
+        linked = link_actors(movie_id, actor_ids)
+        size = cast_size(movie_id)
+        version = commit_cast_change(movie_id, linked)
+
+        response = jsonify({
+            'success': True,
+            'movie': movie_id,
+            'version': version,
+            'linked': len(linked),
+            'cast_size': size
+        })
+        response.set_etag(str(version))
+        return response
+
+    @app.route('/movies/<int:movie_id>/actors', methods=['DELETE'])
+    @requires_auth('update:movies')
+    def unlink_movie_actors(movie_id):
+        actor_ids, errors = get_cast_args(movie_id)
+        if errors:
+            return unprocessable(errors)
+
+        unlinked = unlink_actors(movie_id, actor_ids)
+        size = cast_size(movie_id)
+        version = commit_cast_change(movie_id, unlinked)
+
+        response = jsonify({
             'success': True,
-            'updated': movie.format()
+            'movie': movie_id,
+            'version': version,
+            'unlinked': len(unlinked),
+            'cast_size': size
         })
+        response.set_etag(str(version))
+        return response
 
     @app.route('/actors/<int:actor_id>', methods=['PATCH'])
     @requires_auth('update:actors')
     def update_actor_by_id(actor_id):
-        actor = Actor.query.get_or_404(actor_id)
         body = request.get_json()
 
         if body is None:
             abort(400)
 
-        if 'name' in body:
-            actor.name = body['name']
-
-        if 'age' in body:
-            actor.age = body['age']
+        values, errors = validate_actor(body, partial=True)
+        if errors:
+            return unprocessable(errors)
 
-        if 'gender' in body:
-            actor.gender = body['gender']
+        row = update_returning(Actor, actor_id, values,
+                               get_expected_versions())
+        if row is None:
+            db.session.rollback()
+            abort(412 if row_exists(Actor, actor_id) else 404)
+        db.session.commit()
 
-        actor.update()
-
-        return jsonify({
+        response = jsonify({
             'success': True,
-            'updated': actor.format()
+            'updated': {
+                'id': row.id,
+                'name': row.name,
+                'age': row.age,
+                'gender': row.gender.value,
+                'version': row.version
+            }
         })
+        response.set_etag(str(row.version))
+        return response
 
     @app.route('/movies/<int:movie_id>', methods=['DELETE'])
     @requires_auth('delete:movies')
@@ -192,6 +898,16 @@ def create_app(test_config=None):
             }
         ), 404
 
+    @app.errorhandler(412)
+    def precondition_failed(error):
+        return jsonify(
+            {
+                'success': False,
+                'error': 412,
+                'message': 'Precondition failed'
+            }
+        ), 412
+
     @app.errorhandler(422)
     def unprocessable_entity(error):
         return jsonify(
@@ -216,7 +932,5 @@ def create_app(test_config=None):
     return app
 
 
-app = create_app()
-
 if __name__ == '__main__':
-    app.run()
+    create_app('development').run()
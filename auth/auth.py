@@ -1,13 +1,23 @@
-import json
-from flask import request
+from flask import g, request
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
 import os
+import time
+
+from auth.jwks import JWKSKeyStore
+from auth.token_cache import VerifiedTokenCache
 
 AUTH0_DOMAIN = os.environ['AUTH_DOMAIN']
 ALGORITHMS = ['RS256']
 API_AUDIENCE = os.environ['AUTH_API_AUDIENCE']
+JWKS_SOURCE = os.environ.get(
+    'AUTH_JWKS_URL', f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+JWKS_TTL = int(os.environ.get('AUTH_JWKS_TTL', 600))
+
+TOKEN_CACHE_SIZE = int(os.environ.get('AUTH_TOKEN_CACHE_SIZE', 1024))
+
+jwks_store = JWKSKeyStore(JWKS_SOURCE, ttl=JWKS_TTL)
+token_cache = VerifiedTokenCache(maxsize=TOKEN_CACHE_SIZE)
 
 # AuthError Exception
 '''
@@ -77,10 +87,7 @@ def check_permissions(permission, payload):
 
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if 'kid' not in unverified_header:
         raise AuthError(
             {
@@ -88,15 +95,7 @@ def verify_decode_jwt(token):
                 'description': 'Authorization malformed.'
             }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    rsa_key = jwks_store.get_key(unverified_header['kid'])
     if rsa_key:
         try:
             payload = jwt.decode(token,
@@ -135,13 +134,26 @@ def verify_decode_jwt(token):
         }, 400)
 
 
-def requires_auth(permission=''):
+def requires_auth(permission='', *permissions):
+    permissions = (permission,) + permissions
+
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
             token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
+            payload = token_cache.get(token)
+            g.token_cache_hit = payload is not None
+            if payload is None:
+                start = time.perf_counter()
+                try:
+                    payload = verify_decode_jwt(token)
+                finally:
+                    g.jwt_verify_seconds = time.perf_counter() - start
+                token_cache.set(token, payload)
+            for required in permissions:
+                check_permissions(required, payload)
+            g.auth_permission = ' '.join(permissions)
+            g.auth_payload = payload
             return f(*args, **kwargs)
 
         return wrapper
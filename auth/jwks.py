@@ -0,0 +1,113 @@
+import json
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+from urllib.request import urlopen
+
+logger = logging.getLogger(__name__)
+
+
+class JWKSKeyStore:
+    """
+    JWKSKeyStore
+    Keeps the signing keys of a JWKS document in memory, keyed by kid.
+
+    source may be an http(s) URL, a file:// URL or a local file path, so
+    that the store can be pointed at a stand-in JWKS when running offline.
+    Keys older than ttl seconds are refreshed in a background thread while
+    the current keys keep being served. An unknown kid triggers one
+    synchronous refetch, at most once every min_refetch_interval seconds.
+    """
+
+    def __init__(self, source, ttl=600, min_refetch_interval=30,
+                 timeout=5):
+        self.source = source
+        self.ttl = ttl
+        self.min_refetch_interval = min_refetch_interval
+        self.timeout = timeout
+        self._keys = {}
+        self._fetched_at = None
+        self._last_forced_refetch = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _read_source(self):
+        parsed = urlparse(self.source)
+        if parsed.scheme in ('http', 'https'):
+            with urlopen(self.source, timeout=self.timeout) as response:
+                return json.loads(response.read())
+
+        path = parsed.path if parsed.scheme == 'file' else self.source
+        with open(path) as jwks_file:
+            return json.load(jwks_file)
+
+    def refresh(self):
+        jwks = self._read_source()
+        keys = {}
+        for key in jwks.get('keys', []):
+            if 'kid' not in key:
+                continue
+            keys[key['kid']] = {
+                'kty': key['kty'],
+                'kid': key['kid'],
+                'use': key.get('use'),
+                'n': key['n'],
+                'e': key['e']
+            }
+        with self._lock:
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+        return keys
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception('Unable to refresh JWKS from %s', self.source)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        thread = threading.Thread(target=self._background_refresh,
+                                  name='jwks-refresh', daemon=True)
+        thread.start()
+
+    def _is_stale(self):
+        return time.monotonic() - self._fetched_at > self.ttl
+
+    def _may_force_refetch(self):
+        now = time.monotonic()
+        with self._lock:
+            last = self._last_forced_refetch
+            if last is not None and now - last < self.min_refetch_interval:
+                return False
+            self._last_forced_refetch = now
+            return True
+
+    def get_key(self, kid):
+        """
+        get_key(kid)
+            returns the RSA key for kid, or None if the JWKS does not
+            contain it even after a forced refetch
+        """
+        if self._fetched_at is None:
+            self.refresh()
+        elif self._is_stale():
+            self._refresh_in_background()
+
+        key = self._keys.get(kid)
+        if key is None and self._may_force_refetch():
+            key = self.refresh().get(kid)
+        return key
+
+    def clear(self):
+        with self._lock:
+            self._keys = {}
+            self._fetched_at = None
+            self._last_forced_refetch = None
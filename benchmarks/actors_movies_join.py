@@ -0,0 +1,126 @@
+"""
+Join latency over ActorsMovies before and after migration a02eb1f4ed34.
+
+Seeds the same random cast graph into the original heap table (no primary
+key, no indexes) and into the indexed table, then times the lookups done
+by Actor.movies and Movie.actors.
+
+    python -m benchmarks.actors_movies_join --movies 20000 --actors 20000
+    python -m benchmarks.actors_movies_join --url postgresql://.../bench
+"""
+import argparse
+import random
+import statistics
+import time
+
+import sqlalchemy as sa
+
+
+def build_schema(indexed):
+    metadata = sa.MetaData()
+    sa.Table('Actor', metadata,
+             sa.Column('id', sa.Integer, primary_key=True),
+             sa.Column('name', sa.String, nullable=False))
+    sa.Table('Movie', metadata,
+             sa.Column('id', sa.Integer, primary_key=True),
+             sa.Column('title', sa.String, nullable=False))
+    if indexed:
+        sa.Table('ActorsMovies', metadata,
+                 sa.Column('movie_id', sa.Integer,
+                           sa.ForeignKey('Movie.id', ondelete='CASCADE'),
+                           primary_key=True),
+                 sa.Column('actor_id', sa.Integer,
+                           sa.ForeignKey('Actor.id', ondelete='CASCADE'),
+                           primary_key=True),
+                 sa.Index('ix_ActorsMovies_actor_id_movie_id',
+                          'actor_id', 'movie_id'))
+    else:
+        sa.Table('ActorsMovies', metadata,
+                 sa.Column('actor_id', sa.Integer,
+                           sa.ForeignKey('Actor.id')),
+                 sa.Column('movie_id', sa.Integer,
+                           sa.ForeignKey('Movie.id')))
+    return metadata
+
+
+def seed(connection, metadata, movies, actors, cast_size, rng):
+    tables = metadata.tables
+    connection.execute(tables['Actor'].insert(), [
+        {'id': i, 'name': 'Actor %d' % i} for i in range(1, actors + 1)])
+    connection.execute(tables['Movie'].insert(), [
+        {'id': i, 'title': 'Movie %d' % i} for i in range(1, movies + 1)])
+    links = [{'movie_id': movie_id, 'actor_id': actor_id}
+             for movie_id in range(1, movies + 1)
+             for actor_id in rng.sample(range(1, actors + 1), cast_size)]
+    connection.execute(tables['ActorsMovies'].insert(), links)
+    return len(links)
+
+
+def time_query(connection, statement, params, repeat):
+    timings = []
+    for value in params[:repeat]:
+        start = time.perf_counter()
+        connection.execute(statement, {'id': value}).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), max(timings)
+
+
+def run(url, movies, actors, cast_size, repeat, seed_value):
+    results = {}
+    for indexed in (False, True):
+        rng = random.Random(seed_value)
+        engine = sa.create_engine(url)
+        metadata = build_schema(indexed)
+        with engine.begin() as connection:
+            metadata.drop_all(connection)
+            metadata.create_all(connection)
+            links = seed(connection, metadata, movies, actors, cast_size,
+                         rng)
+
+        link_table = metadata.tables['ActorsMovies']
+        movie_table = metadata.tables['Movie']
+        actor_table = metadata.tables['Actor']
+        queries = {
+            'Actor.movies': sa.select(movie_table.c.id, movie_table.c.title)
+            .select_from(movie_table.join(
+                link_table, link_table.c.movie_id == movie_table.c.id))
+            .where(link_table.c.actor_id == sa.bindparam('id')),
+            'Movie.actors': sa.select(actor_table.c.id, actor_table.c.name)
+            .select_from(actor_table.join(
+                link_table, link_table.c.actor_id == actor_table.c.id))
+            .where(link_table.c.movie_id == sa.bindparam('id')),
+        }
+        ids = [rng.randint(1, min(movies, actors)) for _ in range(repeat)]
+        with engine.connect() as connection:
+            for name, statement in queries.items():
+                results[(name, indexed)] = time_query(
+                    connection, statement, ids, repeat)
+
+        with engine.begin() as connection:
+            metadata.drop_all(connection)
+        engine.dispose()
+
+    print('%d movies, %d actors, %d links' % (movies, actors, links))
+    print('%-14s %12s %12s %12s %12s' % (
+        'lookup', 'before p50', 'before max', 'after p50', 'after max'))
+    for name in ('Actor.movies', 'Movie.actors'):
+        before, after = results[(name, False)], results[(name, True)]
+        print('%-14s %10.3fms %10.3fms %10.3fms %10.3fms' % (
+            name, before[0], before[1], after[0], after[1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--url', default='sqlite://')
+    parser.add_argument('--movies', type=int, default=20000)
+    parser.add_argument('--actors', type=int, default=20000)
+    parser.add_argument('--cast-size', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    run(args.url, args.movies, args.actors, args.cast_size, args.repeat,
+        args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Offline stand-in for Auth0: a local RSA signing key, a JWKS server that
+publishes it and tokens for the three roles of the API.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from jose import jwk, jwt
+
+KID = 'benchmark'
+DOMAIN = 'benchmark.local'
+AUDIENCE = 'casting-agency-benchmark'
+
+ROLES = {
+    'Casting Assistant': ('read:movies', 'read:actors'),
+    'Casting Director': ('read:movies', 'read:actors', 'create:actors',
+                         'update:actors', 'update:movies',
+                         'delete:actors'),
+    'Executive Producer': ('read:movies', 'read:actors', 'create:actors',
+                           'create:movies', 'update:actors',
+                           'update:movies', 'delete:actors',
+                           'delete:movies'),
+}
+
+
+def generate_key():
+    """
+    generate_key()
+        returns a new 2048 bit RSA key as (private PEM, public JWK)
+    """
+    try:
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+    except ImportError:
+        raise RuntimeError('The cryptography package is required to mint '
+                           'benchmark tokens')
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()).decode()
+    public_pem = key.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+    public_jwk = jwk.construct(public_pem, 'RS256').to_dict()
+    public_jwk.update(kid=KID, use='sig')
+    return private_pem, public_jwk
+
+
+def mint_token(private_pem, permissions, subject='benchmark',
+               lifetime=3600):
+    now = int(time.time())
+    return jwt.encode({
+        'iss': 'https://{}/'.format(DOMAIN),
+        'aud': AUDIENCE,
+        'sub': subject,
+        'iat': now,
+        'exp': now + lifetime,
+        'permissions': list(permissions),
+    }, private_pem, algorithm='RS256', headers={'kid': KID})
+
+
+def role_tokens(private_pem):
+    return {role: mint_token(private_pem, permissions,
+                             subject=role.lower().replace(' ', '-'))
+            for role, permissions in ROLES.items()}
+
+
+class JWKSServer:
+    """
+    JWKSServer
+    Serves a JWKS document on 127.0.0.1 from a background thread
+    """
+
+    def __init__(self, keys, port=0):
+        body = json.dumps({'keys': keys}).encode('utf-8')
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.url = 'http://127.0.0.1:{}/.well-known/jwks.json'.format(
+            self.server.server_address[1])
+        self._thread = threading.Thread(target=self.server.serve_forever,
+                                        daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def auth_environment(self):
+        """
+        auth_environment()
+            returns the environment variables that point auth.auth at
+            this server
+        """
+        return {
+            'AUTH_DOMAIN': DOMAIN,
+            'AUTH_API_AUDIENCE': AUDIENCE,
+            'AUTH_JWKS_URL': self.url,
+        }
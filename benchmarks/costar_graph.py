@@ -0,0 +1,198 @@
+"""
+Co-star and collaboration path lookups on a synthetic cast graph.
+
+Builds a CastGraph from a random graph of about --edges ActorsMovies
+rows, where a few actors appear in many movies as in real catalogues.
+Then times co-star lookups and shortest paths between random actors
+against the same queries run in SQL. Shortest paths are also compared
+with a one-sided BFS over the same index.
+
+    python -m benchmarks.costar_graph
+    python -m benchmarks.costar_graph --edges 100000 --url sqlite:///b.db
+"""
+import argparse
+import itertools
+import random
+import statistics
+import time
+from collections import Counter
+
+import sqlalchemy as sa
+
+from database.graph import CastGraph
+
+
+def generate_links(edges, cast_size, actors, rng):
+    # Actor popularity follows a power law: weight 1 / rank ** 0.8.
+    cum_weights = list(itertools.accumulate(
+        1.0 / rank ** 0.8 for rank in range(1, actors + 1)))
+    population = range(1, actors + 1)
+    links = []
+    for movie_id in range(1, edges // cast_size + 1):
+        cast = set(rng.choices(population, cum_weights=cum_weights,
+                               k=cast_size))
+        links.extend((movie_id, actor_id) for actor_id in cast)
+    return links
+
+
+def seed(engine, links):
+    metadata = sa.MetaData()
+    table = sa.Table('ActorsMovies', metadata,
+                     sa.Column('movie_id', sa.Integer, primary_key=True),
+                     sa.Column('actor_id', sa.Integer, primary_key=True),
+                     sa.Index('ix_ActorsMovies_actor_id_movie_id',
+                              'actor_id', 'movie_id'))
+    with engine.begin() as connection:
+        metadata.drop_all(connection)
+        metadata.create_all(connection)
+        for start in range(0, len(links), 50000):
+            connection.execute(table.insert(), [
+                {'movie_id': movie_id, 'actor_id': actor_id}
+                for movie_id, actor_id in links[start:start + 50000]])
+    return metadata, table
+
+
+def sql_costars(connection, table, actor_id):
+    own, other = table.alias('own'), table.alias('other')
+    return connection.execute(
+        sa.select(other.c.actor_id, sa.func.count())
+        .select_from(own.join(other, own.c.movie_id == other.c.movie_id))
+        .where(own.c.actor_id == actor_id,
+               other.c.actor_id != actor_id)
+        .group_by(other.c.actor_id)).fetchall()
+
+
+def sql_path_length(connection, table, source, target):
+    # Walks Actor.movies -> Movie.actors one level at a time, which is
+    # what the API would have to do without the index.
+    seen, frontier, depth = {source}, {source}, 0
+    while frontier:
+        depth += 1
+        movies = [row[0] for row in connection.execute(
+            sa.select(table.c.movie_id).distinct()
+            .where(table.c.actor_id.in_(frontier)))]
+        if not movies:
+            return None
+        cast = {row[0] for row in connection.execute(
+            sa.select(table.c.actor_id).distinct()
+            .where(table.c.movie_id.in_(movies)))}
+        if target in cast:
+            return depth
+        frontier = cast - seen
+        seen |= frontier
+    return None
+
+
+def one_sided_path_length(graph, source, target):
+    seen, frontier, depth = {source}, [source], 0
+    seen_movies = set()
+    while frontier:
+        depth += 1
+        next_frontier = []
+        for actor_id in frontier:
+            for movie_id in graph.movies_of.get(actor_id, ()):
+                if movie_id in seen_movies:
+                    continue
+                seen_movies.add(movie_id)
+                for other in graph.cast_of[movie_id]:
+                    if other == target:
+                        return depth
+                    if other not in seen:
+                        seen.add(other)
+                        next_frontier.append(other)
+        frontier = next_frontier
+    return None
+
+
+def time_calls(function, arguments):
+    timings, results = [], []
+    for args in arguments:
+        start = time.perf_counter()
+        results.append(function(*args))
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return results, (statistics.median(timings),
+                     timings[int(len(timings) * 0.99)])
+
+
+def run(url, edges, cast_size, actors, repeat, sql_repeat, seed_value):
+    rng = random.Random(seed_value)
+    links = generate_links(edges, cast_size, actors, rng)
+    engine = sa.create_engine(url)
+    metadata, table = seed(engine, links)
+
+    start = time.perf_counter()
+    with engine.connect() as connection:
+        graph = CastGraph(connection.execute(
+            sa.select(table.c.movie_id, table.c.actor_id))
+            .yield_per(10000))
+    build_seconds = time.perf_counter() - start
+
+    actor_ids = list(graph.movies_of)
+    pairs = [(rng.choice(actor_ids), rng.choice(actor_ids))
+             for _ in range(repeat)]
+    singles = [(source,) for source, _ in pairs]
+    rows = []
+
+    _, timing = time_calls(graph.costars, singles)
+    rows.append(('costars, index', timing))
+    paths, timing = time_calls(graph.shortest_path, pairs)
+    rows.append(('path, bidirectional BFS', timing))
+    lengths, timing = time_calls(
+        lambda source, target: one_sided_path_length(graph, source, target),
+        pairs)
+    rows.append(('path, one-sided BFS', timing))
+    for path, length in zip(paths, lengths):
+        assert (len(path[1]) if path is not None else None) == length
+
+    with engine.connect() as connection:
+        _, timing = time_calls(
+            lambda actor_id: sql_costars(connection, table, actor_id),
+            singles[:sql_repeat])
+        rows.append(('costars, SQL', timing))
+        _, timing = time_calls(
+            lambda source, target: sql_path_length(connection, table,
+                                                   source, target),
+            pairs[:sql_repeat])
+        rows.append(('path, SQL level by level', timing))
+
+    movie_ids = list(graph.cast_of)
+    updates = [(rng.choice(movie_ids),
+                rng.sample(actor_ids, cast_size)) for _ in range(repeat)]
+    _, timing = time_calls(graph.set_cast, updates)
+    rows.append(('set_cast', timing))
+
+    with engine.begin() as connection:
+        metadata.drop_all(connection)
+    engine.dispose()
+
+    degrees = Counter(len(path[1]) if path is not None else None
+                      for path in paths)
+    print('%d links, %d movies, %d actors, built in %.2fs' % (
+        len(graph), len(graph.cast_of), len(graph.movies_of),
+        build_seconds))
+    print('path lengths: %s' % ', '.join(
+        '%s: %d' % (length, count) for length, count in
+        sorted(degrees.items(), key=lambda item: (item[0] is None,
+                                                  item[0] or 0))))
+    print('%-26s %12s %12s' % ('lookup', 'p50', 'p99'))
+    for name, (p50, p99) in rows:
+        print('%-26s %10.3fms %10.3fms' % (name, p50, p99))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--url', default='sqlite://')
+    parser.add_argument('--edges', type=int, default=1000000)
+    parser.add_argument('--cast-size', type=int, default=10)
+    parser.add_argument('--actors', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--sql-repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    run(args.url, args.edges, args.cast_size, args.actors, args.repeat,
+        args.sql_repeat, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Encoding throughput of a GET /movies response.
+
+Builds --movies movie rows in memory and times turning them into a
+response body: the Movie.format() dicts through flask.jsonify that the
+endpoint used to return, and the column tuples of the list query through
+each JSON provider.
+
+    python -m benchmarks.json_encoding --movies 10000
+"""
+import argparse
+import datetime
+import statistics
+import time
+
+from flask import Flask, jsonify
+
+from serialization.json_provider import PROVIDERS, orjson
+
+FIELDS = ('id', 'title', 'release_date', 'version')
+
+
+def build_rows(count):
+    first_day = datetime.date(1950, 1, 1)
+    return [(i, 'Movie %d' % i,
+             first_day + datetime.timedelta(days=i % 25000), 1)
+            for i in range(1, count + 1)]
+
+
+def timed(encode, repeat):
+    encode()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = encode()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--movies', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rows = build_rows(args.movies)
+    app = Flask(__name__)
+    cases = [('flask.jsonify, format() dicts', lambda: jsonify({
+        'success': True,
+        'movies': [{'id': row[0], 'title': row[1], 'release_date': row[2],
+                    'version': row[3]} for row in rows]
+    }).get_data())]
+    for name, provider_class in sorted(PROVIDERS.items()):
+        if name == 'orjson' and orjson is None:
+            continue
+        for date_format in ('http', 'iso'):
+            provider = provider_class(date_format=date_format)
+            cases.append(('{} provider, {} dates'.format(name, date_format),
+                          lambda provider=provider: provider.dumps({
+                              'success': True,
+                              'movies': [dict(zip(FIELDS, row))
+                                         for row in rows]
+                          })))
+
+    print('{} movies, median of {} runs'.format(args.movies, args.repeat))
+    with app.app_context():
+        for name, encode in cases:
+            seconds, size = timed(encode, args.repeat)
+            print('{:36} {:8.1f} ms {:10.0f} movies/s {:9d} bytes'.format(
+                name, seconds * 1000, args.movies / seconds, size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,364 @@
+"""
+Offline load test of the API under gunicorn.
+
+Mints tokens with a local RSA key served by a stand-in JWKS server,
+seeds --movies movies and --actors actors, starts gunicorn on the app
+factory and replays the requests of CastingAgency.postman_collection.json
+from --concurrency threads for --duration seconds. Reports p50/p99
+latency and throughput per endpoint; --output saves the report and
+--baseline compares against a saved one.
+
+    python -m benchmarks.load --movies 10000 --actors 20000
+    python -m benchmarks.load --output before.json
+    python -m benchmarks.load --baseline before.json
+    python -m benchmarks.load --database-url postgresql://.../bench
+"""
+import argparse
+import datetime
+import http.client
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from urllib.parse import urlparse
+
+from benchmarks.auth_stub import JWKSServer, generate_key, role_tokens
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COLLECTION = os.path.join(ROOT, 'CastingAgency.postman_collection.json')
+CHUNK_SIZE = 10000
+ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+
+def seed(database_url, movies, actors, cast_size, rng):
+    """
+    seed(database_url, movies, actors, cast_size, rng)
+        creates the schema and inserts the catalogue, giving every movie
+        cast_size random actors
+    """
+    os.environ['DATABASE_URL'] = database_url
+    from sqlalchemy import create_engine
+    from database.models import db, actors_movies, Actor, Movie, GenderType
+
+    engine = create_engine(database_url)
+    db.Model.metadata.drop_all(engine)
+    db.Model.metadata.create_all(engine)
+    first_day = datetime.date(1950, 1, 1)
+    with engine.begin() as connection:
+        for start in range(1, actors + 1, CHUNK_SIZE):
+            connection.execute(Actor.__table__.insert(), [{
+                'id': i, 'name': 'Actor %d' % i, 'age': rng.randint(5, 90),
+                'gender': rng.choice(list(GenderType))
+            } for i in range(start, min(start + CHUNK_SIZE, actors + 1))])
+        for start in range(1, movies + 1, CHUNK_SIZE):
+            stop = min(start + CHUNK_SIZE, movies + 1)
+            connection.execute(Movie.__table__.insert(), [{
+                'id': i, 'title': 'Movie %d' % i,
+                'release_date': first_day + datetime.timedelta(
+                    days=rng.randrange(25000))
+            } for i in range(start, stop)])
+            connection.execute(actors_movies.insert(), [{
+                'movie_id': i, 'actor_id': actor_id
+            } for i in range(start, stop)
+                for actor_id in rng.sample(range(1, actors + 1),
+                                           min(cast_size, actors))])
+    engine.dispose()
+
+
+def load_scenarios(path):
+    """
+    load_scenarios(path)
+        returns the requests of a postman collection as dicts of role,
+        method, path and body. The role is the top level folder.
+    """
+    with open(path) as collection_file:
+        collection = json.load(collection_file)
+
+    scenarios = []
+
+    def walk(items, role):
+        for item in items:
+            if 'item' in item:
+                walk(item['item'], role or item['name'])
+                continue
+            request = item['request']
+            url = request['url']
+            raw = url if isinstance(url, str) else url['raw']
+            body = (request.get('body') or {}).get('raw') or None
+            scenarios.append({
+                'role': role,
+                'method': request['method'],
+                'path': raw.replace('{{host}}', '') or '/',
+                'body': json.loads(body) if body else None
+            })
+
+    walk(collection['item'], None)
+    return scenarios
+
+
+class Replay:
+    """
+    Replay
+    Sends scenarios against a running server. Ids in PATCH paths are
+    replaced by random seeded rows; DELETE paths take ids created by the
+    POSTs of the same run so the seeded catalogue stays intact.
+    """
+
+    def __init__(self, base_url, scenarios, tokens, movies, actors, seed):
+        parsed = urlparse(base_url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.scenarios = scenarios
+        self.tokens = tokens
+        self.seeded = {'movies': movies, 'actors': actors}
+        self.created = defaultdict(deque)
+        self.samples = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.skipped = 0
+        self.seed = seed
+        self._lock = threading.Lock()
+
+    def _prepare(self, scenario, rng):
+        path = scenario['path']
+        resource = path.strip('/').split('/')[0]
+        if scenario['method'] == 'PATCH' and ID_SEGMENT.search(path):
+            path = ID_SEGMENT.sub(
+                '/%d' % rng.randint(1, self.seeded[resource]), path, 1)
+        elif scenario['method'] == 'DELETE' and ID_SEGMENT.search(path):
+            try:
+                path = ID_SEGMENT.sub(
+                    '/%d' % self.created[resource].popleft(), path, 1)
+            except IndexError:
+                return None
+        return path
+
+    def _send(self, connection, scenario, path):
+        headers = {'Authorization': 'Bearer ' +
+                   self.tokens[scenario['role']]}
+        body = None
+        if scenario['body'] is not None:
+            body = json.dumps(scenario['body'])
+            headers['Content-Type'] = 'application/json'
+        connection.request(scenario['method'], path, body, headers)
+        response = connection.getresponse()
+        data = response.read()
+        return response.status, data
+
+    def _record_created(self, scenario, status, data):
+        if scenario['method'] != 'POST' or status != 201:
+            return
+        created = json.loads(data).get('created') or {}
+        if 'id' in created:
+            self.created[scenario['path'].strip('/')].append(created['id'])
+
+    def worker(self, index, deadline, record):
+        rng = random.Random(self.seed + index)
+        connection = http.client.HTTPConnection(self.host, self.port,
+                                                timeout=30)
+        order = list(self.scenarios)
+        while time.monotonic() < deadline:
+            rng.shuffle(order)
+            for scenario in order:
+                if time.monotonic() >= deadline:
+                    break
+                path = self._prepare(scenario, rng)
+                if path is None:
+                    with self._lock:
+                        self.skipped += record
+                    continue
+                start = time.perf_counter()
+                try:
+                    status, data = self._send(connection, scenario, path)
+                except (OSError, http.client.HTTPException):
+                    connection.close()
+                    status, data = 'error', b''
+                elapsed = time.perf_counter() - start
+                self._record_created(scenario, status, data)
+                if not record:
+                    continue
+                label = '{} {} ({})'.format(
+                    scenario['method'], ID_SEGMENT.sub('/{id}', path),
+                    scenario['role'])
+                with self._lock:
+                    self.samples[label].append(elapsed)
+                    self.statuses[label][status] += 1
+        connection.close()
+
+    def run(self, concurrency, duration, record=True):
+        deadline = time.monotonic() + duration
+        threads = [threading.Thread(target=self.worker,
+                                    args=(index, deadline, record))
+                   for index in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(replay, wall_seconds):
+    endpoints = {}
+    everything = []
+    for label, samples in sorted(replay.samples.items()):
+        everything.extend(samples)
+        endpoints[label] = {
+            'requests': len(samples),
+            'statuses': {str(status): count for status, count
+                         in sorted(replay.statuses[label].items(),
+                                   key=lambda item: str(item[0]))},
+            'p50_ms': percentile(samples, 0.50) * 1000,
+            'p99_ms': percentile(samples, 0.99) * 1000,
+            'requests_per_second': len(samples) / wall_seconds,
+        }
+    if everything:
+        endpoints['TOTAL'] = {
+            'requests': len(everything),
+            'statuses': {},
+            'p50_ms': percentile(everything, 0.50) * 1000,
+            'p99_ms': percentile(everything, 0.99) * 1000,
+            'requests_per_second': len(everything) / wall_seconds,
+        }
+    return endpoints
+
+
+def _change(current, previous):
+    if not previous:
+        return '      -'
+    return '{:+6.1f}%'.format((current - previous) / previous * 100)
+
+
+def print_report(endpoints, baseline=None):
+    width = max([len(label) for label in endpoints] + [8])
+    header = '{:{w}} {:>8} {:>9} {:>9} {:>9}  statuses'.format(
+        'endpoint', 'requests', 'p50 ms', 'p99 ms', 'req/s', w=width)
+    if baseline:
+        header += '   d p50   d p99  d req/s'
+    print(header)
+    for label, row in endpoints.items():
+        line = '{:{w}} {:8d} {:9.2f} {:9.2f} {:9.1f}  {}'.format(
+            label, row['requests'], row['p50_ms'], row['p99_ms'],
+            row['requests_per_second'],
+            ' '.join('{}:{}'.format(status, count)
+                     for status, count in row['statuses'].items()),
+            w=width)
+        if baseline:
+            before = baseline.get(label, {})
+            line += '  ' + ' '.join((
+                _change(row['p50_ms'], before.get('p50_ms')),
+                _change(row['p99_ms'], before.get('p99_ms')),
+                _change(row['requests_per_second'],
+                        before.get('requests_per_second'))))
+        print(line)
+
+
+def wait_until_ready(base_url, process, timeout=30):
+    parsed = urlparse(base_url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError('gunicorn exited with {}'.format(
+                process.returncode))
+        try:
+            connection = http.client.HTTPConnection(
+                parsed.hostname, parsed.port, timeout=1)
+            connection.request('GET', '/')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('{} did not come up within {}s'.format(
+        base_url, timeout))
+
+
+def start_gunicorn(port, workers, threads, environment):
+    command = [sys.executable, '-m', 'gunicorn', '--workers', str(workers),
+               '--threads', str(threads), '--bind',
+               '127.0.0.1:{}'.format(port), '--log-level', 'warning',
+               'app:create_app()']
+    return subprocess.Popen(command, cwd=ROOT,
+                            env=dict(os.environ, **environment))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--database-url')
+    parser.add_argument('--movies', type=int, default=1000)
+    parser.add_argument('--actors', type=int, default=2000)
+    parser.add_argument('--cast-size', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=5)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--collection', default=COLLECTION)
+    parser.add_argument('--methods', default='GET,POST,PATCH,DELETE',
+                        help='comma separated methods to replay')
+    parser.add_argument('--profile', default='production')
+    parser.add_argument('--output', help='write the report as JSON')
+    parser.add_argument('--baseline', help='compare with a saved report')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix='casting-load-')
+    database_url = args.database_url or 'sqlite:///{}'.format(
+        os.path.join(workdir, 'load.sqlite'))
+    seed(database_url, args.movies, args.actors, args.cast_size, rng)
+
+    methods = set(args.methods.upper().split(','))
+    scenarios = [scenario for scenario in load_scenarios(args.collection)
+                 if scenario['method'] in methods]
+    private_pem, public_jwk = generate_key()
+    tokens = role_tokens(private_pem)
+
+    with JWKSServer([public_jwk]) as jwks:
+        environment = dict(jwks.auth_environment(),
+                           DATABASE_URL=database_url,
+                           APP_PROFILE=args.profile)
+        base_url = 'http://127.0.0.1:{}'.format(args.port)
+        process = start_gunicorn(args.port, args.workers, args.threads,
+                                 environment)
+        try:
+            wait_until_ready(base_url, process)
+            replay = Replay(base_url, scenarios, tokens, args.movies,
+                            args.actors, args.seed)
+            if args.warmup:
+                replay.run(args.concurrency, args.warmup, record=False)
+            wall_seconds = replay.run(args.concurrency, args.duration)
+        finally:
+            process.terminate()
+            process.wait()
+
+    endpoints = summarize(replay, wall_seconds)
+    print('{} movies, {} actors, {} threads for {:.0f}s against {} '
+          'gunicorn workers'.format(args.movies, args.actors,
+                                    args.concurrency, args.duration,
+                                    args.workers))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['endpoints']
+    print_report(endpoints, baseline)
+    if replay.skipped:
+        print('{} DELETE requests skipped, nothing created to delete yet'
+              .format(replay.skipped))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'arguments': vars(args), 'endpoints': endpoints},
+                      output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
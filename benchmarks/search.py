@@ -0,0 +1,147 @@
+"""
+Filtered search latency with and without the indexes of migration
+38c3a8ea4993.
+
+Seeds --rows actors and movies, times the queries behind GET /actors and
+GET /movies filters, then creates the indexes and times them again.
+
+    python -m benchmarks.search --rows 1000000
+    python -m benchmarks.search --url postgresql://.../bench
+"""
+import argparse
+import datetime
+import random
+import statistics
+import time
+
+import sqlalchemy as sa
+
+CHUNK_SIZE = 50000
+PAGE_SIZE = 100
+
+
+def build_schema():
+    metadata = sa.MetaData()
+    actor = sa.Table('Actor', metadata,
+                     sa.Column('id', sa.Integer, primary_key=True),
+                     sa.Column('name', sa.String, nullable=False),
+                     sa.Column('age', sa.Integer, nullable=False),
+                     sa.Column('gender', sa.String, nullable=False))
+    movie = sa.Table('Movie', metadata,
+                     sa.Column('id', sa.Integer, primary_key=True),
+                     sa.Column('title', sa.String, nullable=False),
+                     sa.Column('release_date', sa.Date))
+    link = sa.Table('ActorsMovies', metadata,
+                    sa.Column('movie_id', sa.Integer, primary_key=True),
+                    sa.Column('actor_id', sa.Integer, primary_key=True))
+    indexes = [
+        sa.Index('ix_Actor_gender_age', actor.c.gender, actor.c.age),
+        sa.Index('ix_Movie_release_date', movie.c.release_date),
+        sa.Index('ix_Movie_lower_title',
+                 sa.func.lower(movie.c.title).label('lower_title'),
+                 postgresql_ops={'lower_title': 'text_pattern_ops'}),
+    ]
+    return metadata, actor, movie, link, indexes
+
+
+def seed(connection, actor, movie, link, rows, rng):
+    words = ['star', 'night', 'river', 'storm', 'garden', 'empire', 'echo',
+             'harbor', 'silver', 'winter', 'summer', 'ghost', 'city']
+    first_day = datetime.date(1950, 1, 1)
+    for start in range(1, rows + 1, CHUNK_SIZE):
+        stop = min(start + CHUNK_SIZE, rows + 1)
+        connection.execute(actor.insert(), [{
+            'id': i, 'name': 'Actor %d' % i, 'age': rng.randint(5, 90),
+            'gender': rng.choice(('male', 'female'))
+        } for i in range(start, stop)])
+        connection.execute(movie.insert(), [{
+            'id': i,
+            'title': '%s %s %d' % (rng.choice(words).title(),
+                                   rng.choice(words), i),
+            'release_date': first_day + datetime.timedelta(
+                days=rng.randint(0, 365 * 75))
+        } for i in range(start, stop)])
+    connection.execute(link.insert(), [
+        {'movie_id': 1, 'actor_id': actor_id}
+        for actor_id in rng.sample(range(1, rows + 1), min(rows, 200))])
+
+
+def queries(actor, movie, link):
+    not_in_movie = ~sa.exists().where(sa.and_(
+        link.c.movie_id == 1, link.c.actor_id == actor.c.id))
+    return {
+        'actors gender+age+not_in_movie':
+            sa.select(actor.c.id).where(
+                actor.c.gender == 'female', actor.c.age.between(25, 35),
+                not_in_movie).order_by(actor.c.id).limit(PAGE_SIZE),
+        'actors narrow age band':
+            sa.select(actor.c.id).where(
+                actor.c.gender == 'male', actor.c.age == 89)
+            .order_by(actor.c.id).limit(PAGE_SIZE),
+        'movies released between':
+            sa.select(movie.c.id).where(
+                movie.c.release_date.between(datetime.date(1999, 1, 1),
+                                             datetime.date(1999, 1, 15)))
+            .order_by(movie.c.id).limit(PAGE_SIZE),
+        'movies title prefix':
+            sa.select(movie.c.id).where(
+                sa.func.lower(movie.c.title).like('ghost harbor 12%'))
+            .order_by(movie.c.id).limit(PAGE_SIZE),
+    }
+
+
+def time_queries(connection, statements, repeat):
+    results = {}
+    for name, statement in statements.items():
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            connection.execute(statement).fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+        results[name] = statistics.median(timings)
+    return results
+
+
+def run(url, rows, repeat, seed_value):
+    engine = sa.create_engine(url)
+    metadata, actor, movie, link, indexes = build_schema()
+    with engine.begin() as connection:
+        metadata.drop_all(connection)
+        metadata.create_all(connection)
+        for index in indexes:
+            index.drop(connection)
+        start = time.perf_counter()
+        seed(connection, actor, movie, link, rows, random.Random(seed_value))
+        print('seeded %d actors and %d movies in %.1fs' % (
+            rows, rows, time.perf_counter() - start))
+
+    statements = queries(actor, movie, link)
+    with engine.connect() as connection:
+        before = time_queries(connection, statements, repeat)
+    with engine.begin() as connection:
+        for index in indexes:
+            index.create(connection)
+        connection.execute(sa.text('ANALYZE'))
+    with engine.connect() as connection:
+        after = time_queries(connection, statements, repeat)
+    with engine.begin() as connection:
+        metadata.drop_all(connection)
+    engine.dispose()
+
+    print('%-32s %12s %12s' % ('query', 'before p50', 'after p50'))
+    for name in statements:
+        print('%-32s %10.3fms %10.3fms' % (name, before[name], after[name]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--url', default='sqlite://')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    run(args.url, args.rows, args.repeat, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+import hashlib
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, make_response, request
+
+from cache.backends import LRUBackend, RedisBackend
+
+
+def content_etag(body):
+    """
+    content_etag(body)
+        returns the ETag of a response body, a digest of its bytes
+    """
+    return hashlib.sha256(body).hexdigest()
+
+
+class ResponseCache:
+    """
+    ResponseCache
+    Caches the body of successful GET responses, keyed by route, query
+    parameters and the permission the route was authorized with. Entries
+    are invalidated by bumping a generation counter that is part of every
+    key, so stale entries are simply never read again.
+    """
+
+    def __init__(self, backend=None, enabled=True, stamp=None):
+        self.backend = backend if backend is not None else LRUBackend()
+        self.enabled = enabled
+        self.stamp = stamp
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, stamp=None):
+        """
+        from_config(config, stamp)
+            builds the cache from RESPONSE_CACHE_BACKEND ('memory',
+            'redis' or 'none'), RESPONSE_CACHE_URL, RESPONSE_CACHE_SIZE
+            and RESPONSE_CACHE_TTL. stamp() returns a cheap value that
+            changes whenever the data behind the cached views does.
+        """
+        kind = config.get('RESPONSE_CACHE_BACKEND', 'memory')
+        ttl = int(config.get('RESPONSE_CACHE_TTL', 30))
+        if kind == 'none':
+            return cls(enabled=False, stamp=stamp)
+        if kind == 'redis':
+            return cls(RedisBackend.from_url(
+                config.get('RESPONSE_CACHE_URL', 'local://'), ttl=ttl),
+                stamp=stamp)
+        return cls(LRUBackend(
+            maxsize=int(config.get('RESPONSE_CACHE_SIZE', 512)), ttl=ttl),
+            stamp=stamp)
+
+    def invalidate(self, tables=None):
+        self.backend.incr('generation')
+        self.backend.set('invalidated_at', time.time())
+
+    def invalidated_within(self, seconds):
+        """
+        invalidated_within(seconds)
+            tells whether a write invalidated the cache in the last
+            seconds. With a shared backend that covers the writes of
+            every worker.
+        """
+        invalidated_at = self.backend.get('invalidated_at')
+        return invalidated_at is not None and \
+            time.time() - invalidated_at < seconds
+
+    def version(self):
+        """
+        version()
+            returns a stamp that changes whenever the catalogue is written
+        """
+        generation = self.backend.counter('generation')
+        if self.backend.shared:
+            return generation,
+        # A per-worker generation only sees the writes of this worker, so
+        # it is trusted for no longer than cache entries live.
+        return generation, int(time.time() // self.backend.ttl)
+
+    def key(self):
+        args = sorted(request.args.items(multi=True))
+        raw = '{}|{}|{}|{}'.format(
+            self.version(), request.path, args,
+            g.get('auth_permission', ''))
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def request_etag(self):
+        """
+        request_etag()
+            returns the ETag of the current request derived from stamp()
+            and the route, query parameters and permission, or None
+            without a stamp. Computed at most once per request and before
+            the view runs, so it never names newer data than the body.
+        """
+        if self.stamp is None:
+            return None
+        if 'request_etag' not in g:
+            args = sorted(request.args.items(multi=True))
+            raw = '{}|{}|{}|{}'.format(
+                self.stamp(), request.path, args,
+                g.get('auth_permission', ''))
+            g.request_etag = hashlib.sha256(raw.encode('utf-8')).hexdigest()
+        return g.request_etag
+
+    @staticmethod
+    def _response_etag(response):
+        # The ETag set by the view, else the stamp ETag, which is weak as
+        # it names the data rather than the bytes, else a body digest.
+        if 'etag' in g:
+            return g.etag, g.get('etag_weak', False)
+        if g.get('request_etag') is not None:
+            return g.request_etag, True
+        return content_etag(response.get_data()), False
+
+    def conditional(self, f):
+        """
+        conditional(f)
+            answers 304 Not Modified when the request's If-None-Match
+            holds the ETag of the response f would send. A stamp ETag is
+            checked before f runs, so an unchanged resource costs only
+            the stamp query. Unless the view set g.etag itself, the ETag
+            is the stamp ETag, or a digest of the body without a stamp.
+        """
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return f(*args, **kwargs)
+
+            for name in ('etag', 'etag_weak', 'request_etag'):
+                g.pop(name, None)
+            if request.if_none_match and self.stamp is not None:
+                etag = self.request_etag()
+                if request.if_none_match.contains_weak(etag):
+                    g.etag, g.etag_weak = etag, True
+                    return self._not_modified()
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+            g.etag, g.etag_weak = self._response_etag(response)
+            if request.if_none_match.contains_weak(g.etag):
+                return self._not_modified(response)
+            return response
+
+        return wrapper
+
+    @staticmethod
+    def _not_modified(response=None):
+        # A 304 carries the ETag, Vary and Cache-Control the full
+        # response would have had (RFC 9110, section 15.4.5). The app's
+        # after_request adds Cache-Control. Without the response, as when
+        # the stamp ETag matched, it is taken to be compressible JSON.
+        not_modified = current_app.response_class(status=304)
+        compressor = current_app.extensions.get('compressor')
+        weak = g.get('etag_weak', False)
+        if response is None:
+            if compressor is not None:
+                not_modified.vary.add('Accept-Encoding')
+            not_modified.set_etag(g.etag, weak=weak)
+            return not_modified
+        for header in ('Vary', 'Cache-Control', 'Content-Location',
+                       'Expires'):
+            if header in response.headers:
+                not_modified.headers[header] = response.headers[header]
+        if compressor is not None and compressor.is_compressible(response):
+            not_modified.vary.add('Accept-Encoding')
+            weak = weak or 'Content-Encoding' in response.headers or \
+                compressor.choose(len(response.get_data())) is not None
+        not_modified.set_etag(g.etag, weak=weak)
+        return not_modified
+
+    def cached(self, f):
+        """
+        cached(f)
+            serves f from the cache when possible. Must be applied below
+            requires_auth so that authorization always runs first.
+            Responses are not stored when f sets g.skip_cache_store. When
+            the app compresses responses, each encoding of a body is
+            compressed once and kept next to it in the entry.
+        """
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return f(*args, **kwargs)
+            if not self.enabled:
+                self.request_etag()
+                return f(*args, **kwargs)
+
+            compressor = current_app.extensions.get('compressor')
+            key = self.key()
+            entry = self.backend.get(key)
+            if entry is not None:
+                with self._lock:
+                    self.hits += 1
+                    self.saved_seconds += entry['elapsed']
+                g.etag = entry.get('etag') or content_etag(entry['body'])
+                g.etag_weak = entry.get('etag_weak', False)
+                response = current_app.response_class(
+                    entry['body'], mimetype=entry['mimetype'])
+                if compressor is not None and \
+                        compressor.is_compressible(response):
+                    self._encode(compressor, response, key, entry)
+                response.headers['X-Cache'] = 'HIT'
+                return response
+
+            with self._lock:
+                self.misses += 1
+            g.pop('skip_cache_store', None)
+            start = time.perf_counter()
+            self.request_etag()
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed \
+                    and not g.get('skip_cache_store'):
+                g.etag, g.etag_weak = self._response_etag(response)
+                entry = {
+                    'body': response.get_data(),
+                    'etag': g.etag,
+                    'etag_weak': g.etag_weak,
+                    'mimetype': response.mimetype,
+                    'elapsed': time.perf_counter() - start,
+                    'encoded': {}
+                }
+                if compressor is not None and \
+                        compressor.is_compressible(response):
+                    self._encode(compressor, response, None, entry)
+                self.backend.set(key, entry)
+            response.headers['X-Cache'] = 'MISS'
+            return response
+
+        return wrapper
+
+    def _encode(self, compressor, response, key, entry):
+        encoding = compressor.choose(len(entry['body']))
+        if encoding is None:
+            return
+        body = entry['encoded'].get(encoding)
+        if body is None:
+            body = entry['encoded'][encoding] = \
+                compressor.compress(entry['body'], encoding)
+            if key is not None:
+                self.backend.set(key, entry)
+        response.set_data(body)
+        compressor.mark(response, encoding)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'saved_seconds': self.saved_seconds
+            }
@@ -0,0 +1,104 @@
+import os
+
+
+def _env(key, default=None):
+    return os.environ.get(key, default)
+
+
+class Config:
+    """
+    Config
+    Settings shared by every profile. Each value can be overridden with
+    an environment variable of the same name.
+    """
+
+    DEBUG = False
+    TESTING = False
+    DATABASE_URL = _env('DATABASE_URL')
+    # Signs the read-your-writes tokens, so it must be the same on every
+    # worker
+    SECRET_KEY = _env('SECRET_KEY')
+
+    MAX_BULK_SIZE = _env('MAX_BULK_SIZE', 500)
+
+    RESPONSE_CACHE_BACKEND = _env('RESPONSE_CACHE_BACKEND', 'memory')
+    RESPONSE_CACHE_URL = _env('RESPONSE_CACHE_URL', 'local://')
+    RESPONSE_CACHE_SIZE = _env('RESPONSE_CACHE_SIZE', 512)
+    RESPONSE_CACHE_TTL = _env('RESPONSE_CACHE_TTL', 30)
+
+    JSON_PROVIDER = _env('JSON_PROVIDER', 'auto')
+    JSON_DATE_FORMAT = _env('JSON_DATE_FORMAT', 'http')
+
+    COMPRESS_ENABLED = _env('COMPRESS_ENABLED', True)
+    COMPRESS_MIN_SIZE = _env('COMPRESS_MIN_SIZE', 1024)
+    COMPRESS_LEVEL = _env('COMPRESS_LEVEL', 6)
+    COMPRESS_BROTLI_LEVEL = _env('COMPRESS_BROTLI_LEVEL', 4)
+    COMPRESS_ENCODINGS = _env('COMPRESS_ENCODINGS', 'br,gzip')
+
+    INSTRUMENTATION_ENABLED = _env('INSTRUMENTATION_ENABLED', True)
+    PROFILE_SLOW_SECONDS = _env('PROFILE_SLOW_SECONDS')
+    PROFILE_SAMPLE_RATE = _env('PROFILE_SAMPLE_RATE', 1.0)
+
+    CHANGES_SETTLE_SECONDS = _env('CHANGES_SETTLE_SECONDS', 5)
+    CAST_INDEX_ENABLED = _env('CAST_INDEX_ENABLED', True)
+    CAST_INDEX_REFRESH_SECONDS = _env('CAST_INDEX_REFRESH_SECONDS', 1.0)
+    STATS_SUMMARY_ENABLED = _env('STATS_SUMMARY_ENABLED', False)
+    STATS_SUMMARY_REFRESH_SECONDS = _env('STATS_SUMMARY_REFRESH_SECONDS',
+                                         1.0)
+
+
+class DevelopmentConfig(Config):
+    """
+    DevelopmentConfig
+    Debug mode, no response cache so edits show up at once, a small pool
+    and the slow request profiler on
+    """
+
+    DEBUG = True
+    RESPONSE_CACHE_BACKEND = _env('RESPONSE_CACHE_BACKEND', 'none')
+    DB_POOL_SIZE = _env('DB_POOL_SIZE', 2)
+    DB_MAX_OVERFLOW = _env('DB_MAX_OVERFLOW', 2)
+    PROFILE_SLOW_SECONDS = _env('PROFILE_SLOW_SECONDS', 1.0)
+
+
+class TestConfig(Config):
+    """
+    TestConfig
+    Runs against TEST_DATABASE_URL, an in-memory SQLite database unless
+    set, with a small pool and no settle window on /changes
+    """
+
+    TESTING = True
+    DATABASE_URL = _env('TEST_DATABASE_URL', 'sqlite://')
+    DB_POOL_SIZE = _env('DB_POOL_SIZE', 2)
+    DB_MAX_OVERFLOW = _env('DB_MAX_OVERFLOW', 2)
+    DB_POOL_PRE_PING = _env('DB_POOL_PRE_PING', False)
+    CHANGES_SETTLE_SECONDS = _env('CHANGES_SETTLE_SECONDS', 0)
+
+
+class ProductionConfig(Config):
+    """
+    ProductionConfig
+    No debug mode and the pool settings of database.pool
+    """
+
+
+PROFILES = {
+    'development': DevelopmentConfig,
+    'test': TestConfig,
+    'production': ProductionConfig,
+}
+
+
+def get_profile(name=None):
+    """
+    get_profile(name)
+        returns the config class of a profile, defaulting to the
+        APP_PROFILE environment variable and then to production
+    """
+    name = name or _env('APP_PROFILE', 'production')
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise ValueError('Unknown profile {!r}, expected one of: {}'.format(
+            name, ', '.join(PROFILES)))
@@ -0,0 +1,126 @@
+import base64
+import binascii
+import datetime
+import json
+from collections import defaultdict
+
+from database.models import db, actors_movies, utcnow, Actor, Movie, \
+    Tombstone
+from database.queries import columns, rows_to_dicts, fetch_links, \
+    MOVIE_FIELDS, ACTOR_FIELDS
+
+# Writes are timestamped by the app servers before they commit, so a row
+# can become visible with an updated_at slightly in the past. Sync tokens
+# never move past now - CHANGES_SETTLE_SECONDS, and rows changed within
+# that window are sent again on the next call.
+DEFAULT_SETTLE_SECONDS = 5
+
+STREAMS = ('movies', 'actors', 'deleted')
+
+
+def encode_token(cursors):
+    """
+    encode_token(cursors)
+        returns an opaque sync token for a dict of stream name to the
+        (updated_at, id) of the last row sent on that stream
+    """
+    payload = json.dumps({
+        stream: [timestamp.isoformat(), row_id]
+        for stream, (timestamp, row_id) in cursors.items()
+    }).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def decode_token(token):
+    """
+    decode_token(token)
+        returns the cursors of a token produced by encode_token, raising
+        ValueError when it is malformed
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded))
+        cursors = {
+            stream: (datetime.datetime.fromisoformat(payload[stream][0]),
+                     int(payload[stream][1]))
+            for stream in payload
+        }
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError,
+            KeyError, IndexError):
+        raise ValueError('Invalid token')
+    if not set(cursors) <= set(STREAMS):
+        raise ValueError('Invalid token')
+    return cursors
+
+
+def _after(query, timestamp_column, id_column, cursor, until, limit):
+    query = query.filter(timestamp_column <= until)
+    if cursor is not None:
+        timestamp, row_id = cursor
+        query = query.filter(db.or_(
+            timestamp_column > timestamp,
+            db.and_(timestamp_column == timestamp, id_column > row_id)))
+    return query.order_by(timestamp_column, id_column).limit(limit + 1).all()
+
+
+def _changed(model, fields, cursor, until, limit):
+    rows = _after(db.session.query(model.updated_at, *columns(model, fields)),
+                  model.updated_at, model.id, cursor, until, limit)
+    more = len(rows) > limit
+    rows = rows[:limit]
+    last = (rows[-1][0], rows[-1][1]) if rows else cursor
+    return rows_to_dicts([row[1:] for row in rows], fields), last, more
+
+
+def changes_since(cursors, limit, settle_seconds=DEFAULT_SETTLE_SECONDS):
+    """
+    changes_since(cursors, limit, settle_seconds)
+        returns the movies and actors inserted or updated and the ids
+        deleted after cursors, at most limit of each, with the cursors to
+        continue from and whether more changes are waiting. Each query is
+        a range scan of an (updated_at, id) index.
+    """
+    until = utcnow() - datetime.timedelta(seconds=settle_seconds)
+    movies, movie_cursor, more_movies = _changed(
+        Movie, MOVIE_FIELDS, cursors.get('movies'), until, limit)
+    actors, actor_cursor, more_actors = _changed(
+        Actor, ACTOR_FIELDS, cursors.get('actors'), until, limit)
+
+    tombstones = _after(
+        db.session.query(Tombstone.deleted_at, Tombstone.id,
+                         Tombstone.table_name, Tombstone.row_id),
+        Tombstone.deleted_at, Tombstone.id, cursors.get('deleted'), until,
+        limit)
+    more_deleted = len(tombstones) > limit
+    tombstones = tombstones[:limit]
+    deleted = {Movie.__tablename__: [], Actor.__tablename__: []}
+    for _, _, table_name, row_id in tombstones:
+        deleted[table_name].append(row_id)
+
+    cast, filmography = defaultdict(list), defaultdict(list)
+    for movie_id, actor_id in fetch_links(actors_movies.c.movie_id,
+                                          [movie['id'] for movie in movies]):
+        cast[movie_id].append(actor_id)
+    for movie_id, actor_id in fetch_links(actors_movies.c.actor_id,
+                                          [actor['id'] for actor in actors]):
+        filmography[actor_id].append(movie_id)
+    for movie in movies:
+        movie['actors'] = cast[movie['id']]
+    for actor in actors:
+        actor['movies'] = filmography[actor['id']]
+
+    next_cursors = dict(cursors)
+    for stream, cursor in (('movies', movie_cursor),
+                           ('actors', actor_cursor),
+                           ('deleted', (tombstones[-1][0], tombstones[-1][1])
+                            if tombstones else cursors.get('deleted'))):
+        if cursor is not None:
+            next_cursors[stream] = cursor
+    return {
+        'movies': movies,
+        'actors': actors,
+        'deleted': {
+            'movies': deleted[Movie.__tablename__],
+            'actors': deleted[Actor.__tablename__],
+        },
+    }, next_cursors, more_movies or more_actors or more_deleted
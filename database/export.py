@@ -0,0 +1,88 @@
+import csv
+import io
+import json
+from itertools import groupby
+
+from database.models import db, actors_movies, Actor, Movie
+
+EXPORT_BATCH_SIZE = 1000
+
+MOVIE_EXPORT_FIELDS = ('id', 'title', 'release_date', 'actors')
+ACTOR_EXPORT_FIELDS = ('id', 'name', 'age', 'gender', 'movies')
+
+
+def _stream(query):
+    return query.execution_options(stream_results=True) \
+        .yield_per(EXPORT_BATCH_SIZE)
+
+
+def iter_movies():
+    """
+    iter_movies()
+        yields every movie with the ids of its cast, reading one outer
+        join over ActorsMovies through a server-side cursor
+    """
+    query = db.session.query(Movie.id, Movie.title, Movie.release_date,
+                             actors_movies.c.actor_id) \
+        .outerjoin(actors_movies, actors_movies.c.movie_id == Movie.id) \
+        .order_by(Movie.id, actors_movies.c.actor_id)
+    for movie_id, rows in groupby(_stream(query), key=lambda row: row[0]):
+        rows = list(rows)
+        _, title, release_date, _ = rows[0]
+        yield {
+            'id': movie_id,
+            'title': title,
+            'release_date': release_date.isoformat()
+            if release_date else None,
+            'actors': [row[3] for row in rows if row[3] is not None]
+        }
+
+
+def iter_actors():
+    """
+    iter_actors()
+        yields every actor with the ids of their movies, reading one outer
+        join over ActorsMovies through a server-side cursor
+    """
+    query = db.session.query(Actor.id, Actor.name, Actor.age, Actor.gender,
+                             actors_movies.c.movie_id) \
+        .outerjoin(actors_movies, actors_movies.c.actor_id == Actor.id) \
+        .order_by(Actor.id, actors_movies.c.movie_id)
+    for actor_id, rows in groupby(_stream(query), key=lambda row: row[0]):
+        rows = list(rows)
+        _, name, age, gender, _ = rows[0]
+        yield {
+            'id': actor_id,
+            'name': name,
+            'age': age,
+            'gender': gender.value,
+            'movies': [row[4] for row in rows if row[4] is not None]
+        }
+
+
+def to_ndjson(rows):
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+
+def to_csv(rows, fields):
+    """
+    to_csv(rows, fields)
+        yields a header line and then one CSV line per row; list fields
+        are written as space separated ids
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def line(values):
+        writer.writerow(values)
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return text
+
+    yield line(fields)
+    for row in rows:
+        yield line([' '.join(map(str, row[field]))
+                    if isinstance(row[field], list) else row[field]
+                    for field in fields])
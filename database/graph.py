@@ -0,0 +1,250 @@
+import datetime
+import threading
+import time
+from collections import Counter
+
+from database.models import db, actors_movies, utcnow, Movie, Tombstone
+from database.queries import fetch_in
+from database.revisions import revisions
+
+# Rows read per round trip while scanning ActorsMovies.
+SCAN_BATCH_SIZE = 10000
+
+
+class CastGraph:
+    """
+    CastGraph
+    The bipartite actor/movie graph of ActorsMovies held as two adjacency
+    maps, so that co-stars and collaboration paths are found without
+    touching the database
+    """
+
+    def __init__(self, links=()):
+        self.movies_of = {}
+        self.cast_of = {}
+        self._lock = threading.RLock()
+        for movie_id, actor_id in links:
+            self.cast_of.setdefault(movie_id, set()).add(actor_id)
+            self.movies_of.setdefault(actor_id, set()).add(movie_id)
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(cast) for cast in self.cast_of.values())
+
+    def set_cast(self, movie_id, actor_ids):
+        """
+        set_cast(movie_id, actor_ids)
+            replaces the cast of a movie, dropping actors left without
+            any movie
+        """
+        actor_ids = set(actor_ids)
+        with self._lock:
+            old = self.cast_of.pop(movie_id, set())
+            for actor_id in old - actor_ids:
+                movies = self.movies_of.get(actor_id)
+                if movies is not None:
+                    movies.discard(movie_id)
+                    if not movies:
+                        del self.movies_of[actor_id]
+            for actor_id in actor_ids - old:
+                self.movies_of.setdefault(actor_id, set()).add(movie_id)
+            if actor_ids:
+                self.cast_of[movie_id] = actor_ids
+
+    def remove_movie(self, movie_id):
+        self.set_cast(movie_id, ())
+
+    def costars(self, actor_id):
+        """
+        costars(actor_id)
+            returns (actor_id, shared movie count) pairs for everyone who
+            worked with actor_id, most shared movies first
+        """
+        with self._lock:
+            counts = Counter()
+            for movie_id in self.movies_of.get(actor_id, ()):
+                counts.update(self.cast_of[movie_id])
+        counts.pop(actor_id, None)
+        return sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+
+    def _expand(self, frontier, parents, other_parents, seen_movies):
+        # Visits every actor one movie away from frontier and stops at the
+        # first one the other side has reached. Every such meeting point
+        # lies on a path of the same length, since a shorter one would
+        # have met on an earlier level. Movies already expanded from this
+        # side only lead to actors that have a parent already.
+        next_frontier = []
+        for actor_id in frontier:
+            for movie_id in self.movies_of.get(actor_id, ()):
+                if movie_id in seen_movies:
+                    continue
+                seen_movies.add(movie_id)
+                for other in self.cast_of[movie_id]:
+                    if other in parents:
+                        continue
+                    parents[other] = (actor_id, movie_id)
+                    if other in other_parents:
+                        return next_frontier, other
+                    next_frontier.append(other)
+        return next_frontier, None
+
+    def _cost(self, frontier):
+        return sum(len(self.movies_of[actor_id]) for actor_id in frontier)
+
+    @staticmethod
+    def _walk(parents, actor_id):
+        actors, movies = [actor_id], []
+        while parents[actor_id][0] is not None:
+            actor_id, movie_id = parents[actor_id]
+            movies.append(movie_id)
+            actors.append(actor_id)
+        return actors, movies
+
+    def shortest_path(self, source, target):
+        """
+        shortest_path(source, target)
+            returns the actor ids and the movie ids linking them on a
+            shortest collaboration path from source to target, or None
+            when they are not connected. Searches from both ends at once,
+            always growing the frontier with fewer movies to expand.
+        """
+        if source == target:
+            return [source], []
+        with self._lock:
+            if source not in self.movies_of or target not in self.movies_of:
+                return None
+            forward = {source: (None, None)}
+            backward = {target: (None, None)}
+            frontiers = ([source], [target])
+            seen_movies = (set(), set())
+            while frontiers[0] and frontiers[1]:
+                side = 0 if self._cost(frontiers[0]) <= \
+                    self._cost(frontiers[1]) else 1
+                parents, other_parents = (forward, backward) if side == 0 \
+                    else (backward, forward)
+                frontier, meeting = self._expand(
+                    frontiers[side], parents, other_parents,
+                    seen_movies[side])
+                frontiers = (frontier, frontiers[1]) if side == 0 \
+                    else (frontiers[0], frontier)
+                if meeting is not None:
+                    head, head_movies = self._walk(forward, meeting)
+                    tail, tail_movies = self._walk(backward, meeting)
+                    return (head[::-1] + tail[1:],
+                            head_movies[::-1] + tail_movies)
+        return None
+
+
+class CastIndex:
+    """
+    CastIndex
+    Keeps a CastGraph of the catalogue in memory. It is built with one
+    scan of ActorsMovies on first use. Afterwards only the casts of the
+    movies whose updated_at moved are reloaded. That happens at once
+    after a write in this process, and at most refresh_seconds later
+    for writes made by other workers.
+    """
+
+    def __init__(self, refresh_seconds=1.0, settle_seconds=5.0,
+                 enabled=True):
+        self.refresh_seconds = refresh_seconds
+        self.settle_seconds = settle_seconds
+        self.enabled = enabled
+        self._graph = None
+        self._watermark = None
+        self._checked = 0.0
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        from_config(config)
+            builds the index from CAST_INDEX_ENABLED,
+            CAST_INDEX_REFRESH_SECONDS and CHANGES_SETTLE_SECONDS
+        """
+        return cls(
+            refresh_seconds=float(config.get('CAST_INDEX_REFRESH_SECONDS',
+                                             1.0)),
+            settle_seconds=float(config.get('CHANGES_SETTLE_SECONDS', 5)),
+            enabled=str(config.get('CAST_INDEX_ENABLED', True)).lower()
+            not in ('0', 'false', 'no', 'off'))
+
+    def invalidate(self, tables=None):
+        """
+        invalidate(tables)
+            makes the next lookup pick up the writes just committed.
+            Registered as a revisions listener.
+        """
+        if tables is None or actors_movies.name in tables:
+            self._dirty = True
+
+    def reset(self):
+        with self._lock:
+            self._graph = None
+
+    def _since(self):
+        return utcnow() - datetime.timedelta(seconds=self.settle_seconds)
+
+    def _build(self):
+        watermark = self._since()
+        query = db.session.query(actors_movies.c.movie_id,
+                                 actors_movies.c.actor_id) \
+            .yield_per(SCAN_BATCH_SIZE)
+        return CastGraph(query), watermark
+
+    def _refresh(self):
+        # Every cast change bumps the movie's updated_at and every movie
+        # delete leaves a Tombstone, so the changed movies are one range
+        # scan of each (timestamp, id) index. The settle window is read
+        # again each time, as set_cast is idempotent.
+        watermark = self._since()
+        changed = [row[0] for row in db.session.query(Movie.id)
+                   .filter(Movie.updated_at >= self._watermark)]
+        deleted = [row[0] for row in db.session.query(Tombstone.row_id)
+                   .filter(Tombstone.deleted_at >= self._watermark,
+                           Tombstone.table_name == Movie.__tablename__)]
+        cast = {movie_id: [] for movie_id in changed}
+        query = db.session.query(actors_movies.c.movie_id,
+                                 actors_movies.c.actor_id)
+        for movie_id, actor_id in fetch_in(query, actors_movies.c.movie_id,
+                                           changed):
+            cast[movie_id].append(actor_id)
+        for movie_id, actor_ids in cast.items():
+            self._graph.set_cast(movie_id, actor_ids)
+        for movie_id in deleted:
+            self._graph.remove_movie(movie_id)
+        self._watermark = watermark
+
+    def graph(self):
+        """
+        graph()
+            returns the current CastGraph, building or refreshing it
+            first when needed. Without the index, a graph is built from a
+            fresh scan on every call.
+        """
+        if not self.enabled:
+            return self._build()[0]
+        with self._lock:
+            now = time.monotonic()
+            if self._graph is None:
+                self._dirty = False
+                self._graph, self._watermark = self._build()
+                self._checked = now
+            elif self._dirty or now - self._checked >= self.refresh_seconds:
+                self._dirty = False
+                self._refresh()
+                self._checked = now
+            return self._graph
+
+
+def init_cast_index(app):
+    """
+    init_cast_index(app)
+        registers the app's CastIndex and keeps it informed of the writes
+        committed in this process
+    """
+    index = CastIndex.from_config(app.config)
+    revisions.add_listener(index.invalidate)
+    app.extensions['cast_index'] = index
+    return index
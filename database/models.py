@@ -1,41 +1,77 @@
 import os
 # from sqlalchemy import Column, String, Integer, Enum, Date
-from flask_sqlalchemy import SQLAlchemy
+import datetime
 import enum
 
-database_path = os.environ['DATABASE_URL']
+from database.pool import engine_options
+from database.routing import RoutingSQLAlchemy, ReplicaRouter
 
-db = SQLAlchemy()
+database_path = os.environ.get('DATABASE_URL')
+
+db = RoutingSQLAlchemy()
 
 
 def setup_db(app, database=database_path):
     """
     setup_db(app)
-        binds a flask application and a SQLAlchemy service
+        binds a flask application and a SQLAlchemy service, sizing the
+        connection pool from the DB_POOL_* config keys or environment
+        variables
     """
     app.config["SQLALCHEMY_DATABASE_URI"] = database
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config,
+                                                             database)
     db.app = app
     db.init_app(app)
 
+    replica_urls = app.config.get(
+        "DATABASE_REPLICA_URLS", os.environ.get("DATABASE_REPLICA_URLS"))
+    if isinstance(replica_urls, str):
+        replica_urls = [url.strip() for url in replica_urls.split(",")
+                        if url.strip()]
+    if replica_urls:
+        app.extensions["replica_router"] = ReplicaRouter(
+            replica_urls,
+            engine_options=engine_options(app.config, replica_urls[0]),
+            read_your_writes=float(app.config.get(
+                "READ_YOUR_WRITES_SECONDS",
+                os.environ.get("READ_YOUR_WRITES_SECONDS", 5))),
+            secret_key=app.config.get("SECRET_KEY",
+                                      os.environ.get("SECRET_KEY")))
+
+
+def utcnow():
+    return datetime.datetime.utcnow()
+
 
 class DatabaseTransactions:
     def insert(self):
         db.session.add(self)
+        db.session.flush()
+        touch_linked(type(self), self.id)
         db.session.commit()
 
     def update(self):
         db.session.commit()
 
     def delete(self):
+        touch_linked(type(self), self.id)
+        db.session.add(Tombstone(table_name=self.__tablename__,
+                                 row_id=self.id))
         db.session.delete(self)
         db.session.commit()
 
 
 actors_movies = db.Table(
     'ActorsMovies',
-    db.Column('actor_id', db.Integer, db.ForeignKey('Actor.id')),
-    db.Column('movie_id', db.Integer, db.ForeignKey('Movie.id')),
+    db.Column('movie_id', db.Integer,
+              db.ForeignKey('Movie.id', ondelete='CASCADE'),
+              primary_key=True),
+    db.Column('actor_id', db.Integer,
+              db.ForeignKey('Actor.id', ondelete='CASCADE'),
+              primary_key=True),
+    db.Index('ix_ActorsMovies_actor_id_movie_id', 'actor_id', 'movie_id'),
 )
 
 
@@ -59,20 +95,39 @@ class Actor(db.Model, DatabaseTransactions):
     name = db.Column(db.String, nullable=False)
     age = db.Column(db.Integer, nullable=False)
     gender = db.Column(db.Enum(GenderType), nullable=False)
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow,
+                           onupdate=utcnow)
     movies = db.relationship('Movie', secondary=actors_movies,
                              backref=db.backref('actors', lazy='dynamic'))
 
+    __table_args__ = (
+        db.Index('ix_Actor_gender_age', 'gender', 'age'),
+        db.Index('ix_Actor_updated_at_id', 'updated_at', 'id'),
+    )
+    __mapper_args__ = {'version_id_col': version}
+
     def __init__(self, name, age, gender=GenderType.male):
         self.name = name
         self.age = age
         self.gender = gender
 
+    def format_without_movies(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'age': self.age,
+            'gender': self.gender.value,
+            'version': self.version,
+        }
+
     def format(self):
         return {
             'id': self.id,
             'name': self.name,
             'age': self.age,
             'gender': self.gender.value,
+            'version': self.version,
             'movies': [movie.format_without_actors() for movie in
                        self.movies]
         }
@@ -88,6 +143,19 @@ class Movie(db.Model, DatabaseTransactions):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String, nullable=False)
     release_date = db.Column(db.Date)
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow,
+                           onupdate=utcnow)
+
+    __table_args__ = (
+        db.Index('ix_Movie_release_date', 'release_date'),
+        db.Index('ix_Movie_updated_at_id', 'updated_at', 'id'),
+        # Serves case-insensitive title prefix searches (LIKE 'abc%').
+        db.Index('ix_Movie_lower_title',
+                 db.func.lower(db.column('title')).label('lower_title'),
+                 postgresql_ops={'lower_title': 'text_pattern_ops'}),
+    )
+    __mapper_args__ = {'version_id_col': version}
 
     def __init__(self, title, release_date):
         self.title = title
@@ -98,6 +166,7 @@ class Movie(db.Model, DatabaseTransactions):
             'id': self.id,
             'title': self.title,
             'release_date': self.release_date,
+            'version': self.version,
         }
 
     def format(self):
@@ -105,9 +174,76 @@ class Movie(db.Model, DatabaseTransactions):
             'id': self.id,
             'title': self.title,
             'release_date': self.release_date,
+            'version': self.version,
             'actors': [actor.format() for actor in self.actors]
         }
 
+
+class Tombstone(db.Model):
+    """
+    Tombstone
+    Records the id of a deleted Movie or Actor so GET /changes can report
+    the deletion
+    """
+    __tablename__ = 'Tombstone'
+
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String, nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+    __table_args__ = (
+        db.Index('ix_Tombstone_deleted_at_id', 'deleted_at', 'id'),
+    )
+
+
+class StatsContribution(db.Model):
+    """
+    StatsContribution
+    What one Movie or Actor last added to StatsSummary: its cast size or
+    movie count, and its release year or gender
+    """
+    __tablename__ = 'StatsContribution'
+
+    table_name = db.Column(db.String, primary_key=True)
+    row_id = db.Column(db.Integer, primary_key=True)
+    size = db.Column(db.Integer, nullable=False)
+    release_year = db.Column(db.Integer)
+    gender = db.Column(db.Enum(GenderType))
+
+
+class StatsSummary(db.Model):
+    """
+    StatsSummary
+    Materialized GET /stats: one counter per metric and bucket
+    """
+    __tablename__ = 'StatsSummary'
+
+    metric = db.Column(db.String, primary_key=True)
+    bucket = db.Column(db.String, primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False)
+
+
+# (column of the row itself, column of the linked row, linked model)
+LINKS = {
+    Movie: (actors_movies.c.movie_id, actors_movies.c.actor_id, Actor),
+    Actor: (actors_movies.c.actor_id, actors_movies.c.movie_id, Movie),
+}
+
+
+def touch_linked(model, row_id):
+    """
+    touch_linked(model, row_id)
+        bumps updated_at of the actors or movies linked to a movie or
+        actor, whose filmography or cast lists it, with one UPDATE
+    """
+    own, other, linked = LINKS[model]
+    db.session.execute(
+        linked.__table__.update()
+        .where(linked.id.in_(db.session.query(other).filter(own == row_id)))
+        .values(updated_at=utcnow()))
+
+
 # class MovieActor(db.Model, DatabaseTransactions):
 #     """
 #     MovieActor
@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool, StaticPool
+
+
+def _as_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+
+# (config/environment key, create_engine argument, parser, queue pools only)
+POOL_SETTINGS = (
+    ('DB_POOL_SIZE', 'pool_size', int, True),
+    ('DB_MAX_OVERFLOW', 'max_overflow', int, True),
+    ('DB_POOL_TIMEOUT', 'pool_timeout', float, True),
+    ('DB_POOL_RECYCLE', 'pool_recycle', int, False),
+    ('DB_POOL_PRE_PING', 'pool_pre_ping', _as_bool, False),
+)
+
+IN_MEMORY_SQLITE = ('sqlite://', 'sqlite:///:memory:')
+
+POOL_DEFAULTS = {
+    'DB_POOL_RECYCLE': 1800,
+    'DB_POOL_PRE_PING': True,
+}
+
+
+class TimedQueuePool(QueuePool):
+    """
+    TimedQueuePool
+    QueuePool that records how many checkouts had to wait for a
+    connection, for how long, and how many timed out.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self._stats_lock = threading.Lock()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_seconds_total += waited
+                self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.checkouts = self.checkouts
+        pool.timeouts = self.timeouts
+        pool.wait_seconds_total = self.wait_seconds_total
+        pool.wait_seconds_max = self.wait_seconds_max
+        return pool
+
+
+def engine_options(config, database):
+    """
+    engine_options(config, database)
+        builds the create_engine pool arguments from the DB_POOL_* keys of
+        config, falling back to environment variables and POOL_DEFAULTS.
+        Sizing options are skipped for SQLite, which does not use a queue
+        pool. An in-memory SQLite database lives in a single connection
+        that every thread shares and that is never recycled.
+    """
+    queue_pool = not database.startswith('sqlite')
+    in_memory = database in IN_MEMORY_SQLITE
+    options = {'poolclass': TimedQueuePool} if queue_pool else {}
+    if in_memory:
+        options = {'poolclass': StaticPool,
+                   'connect_args': {'check_same_thread': False}}
+    for key, argument, parse, queue_pool_only in POOL_SETTINGS:
+        value = config.get(key, os.environ.get(key, POOL_DEFAULTS.get(key)))
+        if value is None or (queue_pool_only and not queue_pool) or \
+                (in_memory and argument == 'pool_recycle'):
+            continue
+        options[argument] = parse(value)
+    return options
+
+
+def pool_status(engine):
+    """
+    pool_status(engine)
+        returns gauges and wait time counters of the connection pool
+    """
+    pool = engine.pool
+    status = {'class': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'idle': pool.checkedin(),
+            'overflow': pool.overflow(),
+        })
+    if isinstance(pool, TimedQueuePool):
+        status.update({
+            'checkouts': pool.checkouts,
+            'timeouts': pool.timeouts,
+            'wait_seconds_total': pool.wait_seconds_total,
+            'wait_seconds_max': pool.wait_seconds_max,
+        })
+    return status
@@ -0,0 +1,466 @@
+import base64
+import binascii
+import json
+from collections import defaultdict
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database.models import db, actors_movies, Actor, Movie, Tombstone, \
+    utcnow, touch_linked
+from database.revisions import mark_changed
+
+# Keeps IN (...) lists well below the bound parameter limits of the
+# supported backends.
+IN_CLAUSE_CHUNK_SIZE = 500
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def chunks(ids, size=IN_CLAUSE_CHUNK_SIZE):
+    """
+    chunks(ids, size)
+        splits ids into lists of at most size, so that no IN (...) list
+        grows past IN_CLAUSE_CHUNK_SIZE parameters
+    """
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def fetch_in(query, column, ids):
+    """
+    fetch_in(query, column, ids)
+        returns the rows of query whose column value is in ids, with one
+        round trip per chunk of ids
+    """
+    rows = []
+    for chunk in chunks(ids):
+        rows.extend(query.filter(column.in_(chunk)).all())
+    return rows
+
+
+def _supports_returning(statement='insert'):
+    dialect = db.engine.dialect
+    return getattr(dialect, statement + '_returning',
+                   getattr(dialect, 'full_returning',
+                           dialect.implicit_returning))
+
+
+def get_by_ids(model, ids):
+    """
+    get_by_ids(model, ids)
+        returns the rows of model with the given ids, in the order of ids,
+        skipping ids that have no row
+    """
+    rows = {row.id: row for row in fetch_in(model.query, model.id, set(ids))}
+    return [rows[row_id] for row_id in ids if row_id in rows]
+
+
+def find_missing_ids(column, ids):
+    """
+    find_missing_ids(column, ids)
+        returns the ids that have no row, looked up with one IN query per
+        IN_CLAUSE_CHUNK_SIZE ids
+    """
+    ids = set(ids)
+    found = {row[0] for row in
+             fetch_in(db.session.query(column), column, ids)}
+    return sorted(ids - found)
+
+
+def resolve_actors(actor_ids):
+    """
+    resolve_actors(actor_ids)
+        loads the actors of a cast with one IN query and returns them
+        together with the sorted list of ids that do not exist
+    """
+    actor_ids = list(dict.fromkeys(actor_ids))
+    actors = get_by_ids(Actor, actor_ids)
+    found = {actor.id for actor in actors}
+    return actors, sorted(set(actor_ids) - found)
+
+
+def insert_rows(model, rows):
+    """
+    insert_rows(model, rows)
+        inserts rows into the table of model inside the current
+        transaction and returns their ids in order. Uses a single
+        multi-row INSERT ... RETURNING where the backend supports it.
+    """
+    if not rows:
+        return []
+    table = model.__table__
+    mark_changed(db.session, table.name)
+    if _supports_returning():
+        # RETURNING is not guaranteed to list rows in VALUES order, but
+        # the ids are drawn from the sequence in that order, so sorting
+        # them maps each id back to its input row.
+        result = db.session.execute(
+            table.insert().values(rows).returning(table.c.id))
+        return sorted(row[0] for row in result)
+    return [db.session.execute(table.insert().values(**row))
+            .inserted_primary_key[0] for row in rows]
+
+
+def update_returning(model, row_id, values, expected_versions=None):
+    """
+    update_returning(model, row_id, values, expected_versions)
+        updates one row and bumps its version with a single UPDATE ...
+        RETURNING where the backend supports it. Returns the updated row,
+        or None when no row has that id (and one of those versions, when
+        expected_versions is given).
+    """
+    table = model.__table__
+    mark_changed(db.session, table.name)
+    statement = table.update() \
+        .where(table.c.id == row_id) \
+        .values(version=table.c.version + 1, **values)
+    if expected_versions is not None:
+        statement = statement.where(
+            table.c.version.in_(sorted(expected_versions)))
+
+    if _supports_returning('update'):
+        return db.session.execute(statement.returning(*table.c)).first()
+    if db.session.execute(statement).rowcount == 0:
+        return None
+    return db.session.execute(
+        table.select().where(table.c.id == row_id)).first()
+
+
+def row_exists(model, row_id):
+    return db.session.query(
+        db.session.query(model.id).filter(model.id == row_id).exists()
+    ).scalar()
+
+
+def touch(model, ids):
+    """
+    touch(model, ids)
+        bumps updated_at of rows whose representation changed without an
+        UPDATE of their own, such as a changed cast, so that GET /changes
+        reports them
+    """
+    for chunk in chunks(sorted(set(ids))):
+        db.session.execute(model.__table__.update()
+                           .where(model.id.in_(chunk))
+                           .values(updated_at=utcnow()))
+
+
+def replace_cast(movie_id, actor_ids):
+    """
+    replace_cast(movie_id, actor_ids)
+        replaces the cast of a movie with one DELETE and one batched
+        INSERT into ActorsMovies inside the current transaction, and
+        bumps updated_at of the movie and of its old and new cast
+    """
+    mark_changed(db.session, actors_movies.name)
+    touch_linked(Movie, movie_id)
+    db.session.execute(actors_movies.delete()
+                       .where(actors_movies.c.movie_id == movie_id))
+    insert_links([(movie_id, actor_id) for actor_id in actor_ids])
+    touch(Movie, [movie_id])
+
+
+def insert_links(links):
+    """
+    insert_links(links)
+        inserts (movie_id, actor_id) pairs into ActorsMovies with a single
+        executemany inside the current transaction, and bumps updated_at
+        of the linked movies and actors
+    """
+    if links:
+        mark_changed(db.session, actors_movies.name)
+        db.session.execute(actors_movies.insert(), [
+            {'movie_id': movie_id, 'actor_id': actor_id}
+            for movie_id, actor_id in links])
+        touch(Movie, [movie_id for movie_id, _ in links])
+        touch(Actor, [actor_id for _, actor_id in links])
+
+
+def _insert_ignoring_conflicts(table):
+    dialect = db.engine.dialect.name
+    insert = {'postgresql': postgresql.insert,
+              'sqlite': sqlite.insert}[dialect]
+    return insert(table).on_conflict_do_nothing()
+
+
+def _linked_ids(movie_id, actor_ids):
+    # The ids among actor_ids already in the cast of movie_id, for
+    # backends without RETURNING.
+    query = db.session.query(actors_movies.c.actor_id) \
+        .filter(actors_movies.c.movie_id == movie_id)
+    return {row[0] for row in
+            fetch_in(query, actors_movies.c.actor_id, actor_ids)}
+
+
+def link_actors(movie_id, actor_ids):
+    """
+    link_actors(movie_id, actor_ids)
+        adds actors to the cast of a movie with a single INSERT ... ON
+        CONFLICT DO NOTHING RETURNING actor_id per IN_CLAUSE_CHUNK_SIZE
+        ids, inside the current transaction, and bumps updated_at of the
+        actors it linked. Returns the sorted ids of those actors. The
+        caller bumps the movie's version when any were linked.
+    """
+    linked = []
+    for chunk in chunks(actor_ids):
+        statement = _insert_ignoring_conflicts(actors_movies)
+        if _supports_returning():
+            rows = [{'movie_id': movie_id, 'actor_id': actor_id}
+                    for actor_id in chunk]
+            linked.extend(row[0] for row in db.session.execute(
+                statement.values(rows)
+                .returning(actors_movies.c.actor_id)))
+            continue
+        existing = _linked_ids(movie_id, chunk)
+        new = [actor_id for actor_id in chunk if actor_id not in existing]
+        if new:
+            db.session.execute(statement.values([
+                {'movie_id': movie_id, 'actor_id': actor_id}
+                for actor_id in new]))
+            linked.extend(new)
+    if linked:
+        mark_changed(db.session, actors_movies.name)
+        touch(Actor, linked)
+    return sorted(linked)
+
+
+def unlink_actors(movie_id, actor_ids):
+    """
+    unlink_actors(movie_id, actor_ids)
+        removes actors from the cast of a movie with a single DELETE ...
+        WHERE actor_id IN (...) RETURNING actor_id per
+        IN_CLAUSE_CHUNK_SIZE ids, inside the current transaction, and
+        bumps updated_at of the actors it unlinked. Returns the sorted ids
+        of those actors. The caller bumps the movie's version when any
+        were unlinked.
+    """
+    unlinked = []
+    for chunk in chunks(actor_ids):
+        statement = actors_movies.delete().where(
+            (actors_movies.c.movie_id == movie_id) &
+            actors_movies.c.actor_id.in_(chunk))
+        if _supports_returning('delete'):
+            unlinked.extend(row[0] for row in db.session.execute(
+                statement.returning(actors_movies.c.actor_id)))
+            continue
+        gone = _linked_ids(movie_id, chunk)
+        if gone:
+            db.session.execute(statement)
+            unlinked.extend(gone)
+    if unlinked:
+        mark_changed(db.session, actors_movies.name)
+        touch(Actor, unlinked)
+    return sorted(unlinked)
+
+
+def catalogue_stamp():
+    """
+    catalogue_stamp()
+        returns the row count and latest updated_at of movies and actors
+        and the latest Tombstone id, read with one query off the
+        (updated_at, id) indexes. Every insert, update, delete and cast
+        change moves one of them, so it names the state of the catalogue
+        without reading it.
+    """
+    return tuple(db.session.query(
+        *(db.session.query(aggregate).scalar_subquery() for aggregate in (
+            db.func.count(Movie.id), db.func.max(Movie.updated_at),
+            db.func.count(Actor.id), db.func.max(Actor.updated_at),
+            db.func.max(Tombstone.id)))).one())
+
+
+def cast_size(movie_id):
+    """
+    cast_size(movie_id)
+        counts the cast of a movie on the ActorsMovies primary key
+        without loading it
+    """
+    return db.session.query(db.func.count()).select_from(actors_movies) \
+        .filter(actors_movies.c.movie_id == movie_id).scalar()
+
+
+def fetch_links(column, ids):
+    """
+    fetch_links(column, ids)
+        returns the (movie_id, actor_id) pairs of ActorsMovies whose
+        column value is in ids
+    """
+    query = db.session.query(actors_movies.c.movie_id,
+                             actors_movies.c.actor_id) \
+        .order_by(actors_movies.c.movie_id, actors_movies.c.actor_id)
+    return fetch_in(query, column, ids)
+
+
+MOVIE_FIELDS = ('id', 'title', 'release_date', 'version')
+ACTOR_FIELDS = ('id', 'name', 'age', 'gender', 'version')
+
+
+def columns(model, fields):
+    return [getattr(model, field) for field in fields]
+
+
+def rows_to_dicts(rows, fields):
+    """
+    rows_to_dicts(rows, fields)
+        turns column rows selected with columns(model, fields) into the
+        dicts used in responses. Dates and genders are left as they are
+        for the JSON provider to encode.
+    """
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def _load(model, fields, ids):
+    query = db.session.query(*columns(model, fields))
+    return {item['id']: item for item in
+            rows_to_dicts(fetch_in(query, model.id, ids), fields)}
+
+
+def load_by_ids(model, fields, ids):
+    """
+    load_by_ids(model, fields, ids)
+        returns the rows of model with the given ids as response dicts,
+        in the order of ids, skipping ids that have no row
+    """
+    rows = _load(model, fields, ids)
+    return [rows[row_id] for row_id in ids if row_id in rows]
+
+
+def expand_movies(movies, nested=False):
+    """
+    expand_movies(movies, nested)
+        adds the cast to movie dicts with a fixed number of queries. With
+        nested=True every actor also lists their movies, which is the
+        shape of Movie.format().
+    """
+    cast = defaultdict(list)
+    for movie_id, actor_id in fetch_links(actors_movies.c.movie_id,
+                                     [movie['id'] for movie in movies]):
+        cast[movie_id].append(actor_id)
+
+    actor_ids = {actor_id for ids in cast.values() for actor_id in ids}
+    actors_by_id = _load(Actor, ACTOR_FIELDS, actor_ids)
+    if nested:
+        expand_actors(list(actors_by_id.values()))
+
+    for movie in movies:
+        movie['actors'] = [actors_by_id[actor_id]
+                           for actor_id in cast[movie['id']]
+                           if actor_id in actors_by_id]
+    return movies
+
+
+def expand_actors(actors):
+    """
+    expand_actors(actors)
+        adds the movies of actor dicts with a fixed number of queries
+    """
+    filmography = defaultdict(list)
+    for movie_id, actor_id in fetch_links(actors_movies.c.actor_id,
+                                     [actor['id'] for actor in actors]):
+        filmography[actor_id].append(movie_id)
+
+    movie_ids = {movie_id for ids in filmography.values()
+                 for movie_id in ids}
+    movies_by_id = _load(Movie, MOVIE_FIELDS, movie_ids)
+
+    for actor in actors:
+        actor['movies'] = [movies_by_id[movie_id]
+                           for movie_id in filmography[actor['id']]
+                           if movie_id in movies_by_id]
+    return actors
+
+
+def format_movies(movies):
+    """
+    format_movies(movies)
+        serialises movies like Movie.format() does, but loads the whole
+        cast graph with a fixed number of queries instead of walking the
+        relationships of every movie and actor
+    """
+    return expand_movies([movie.format_without_actors()
+                          for movie in movies], nested=True)
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%') \
+        .replace('_', '\\_')
+
+
+def filter_actors(query, gender=None, age_min=None, age_max=None,
+                  not_in_movie=None):
+    """
+    filter_actors(query, gender, age_min, age_max, not_in_movie)
+        narrows an Actor query in SQL. gender and age use the
+        (gender, age) index, not_in_movie an anti-join on the
+        ActorsMovies primary key.
+    """
+    if gender is not None:
+        query = query.filter(Actor.gender == gender)
+    if age_min is not None:
+        query = query.filter(Actor.age >= age_min)
+    if age_max is not None:
+        query = query.filter(Actor.age <= age_max)
+    if not_in_movie is not None:
+        query = query.filter(~db.session.query(actors_movies).filter(
+            actors_movies.c.movie_id == not_in_movie,
+            actors_movies.c.actor_id == Actor.id
+        ).exists())
+    return query
+
+
+def filter_movies(query, title_prefix=None, released_after=None,
+                  released_before=None):
+    """
+    filter_movies(query, title_prefix, released_after, released_before)
+        narrows a Movie query in SQL. The title prefix match is case
+        insensitive and uses the lower(title) index, the inclusive date
+        bounds use the release_date index.
+    """
+    if title_prefix:
+        query = query.filter(db.func.lower(Movie.title).like(
+            _escape_like(title_prefix.lower()) + '%', escape='\\'))
+    if released_after is not None:
+        query = query.filter(Movie.release_date >= released_after)
+    if released_before is not None:
+        query = query.filter(Movie.release_date <= released_before)
+    return query
+
+
+def encode_cursor(last_id):
+    payload = json.dumps({'id': last_id}).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    decode_cursor(cursor)
+        returns the last seen id stored in an opaque cursor, raising
+        ValueError when the cursor was not produced by encode_cursor
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        last_id = json.loads(base64.urlsafe_b64decode(padded))['id']
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError,
+            KeyError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(last_id, int) or isinstance(last_id, bool):
+        raise ValueError('Invalid cursor')
+    return last_id
+
+
+def paginate(query, column, limit=DEFAULT_PAGE_SIZE, cursor=None):
+    """
+    paginate(query, column, limit, cursor)
+        returns one keyset page of query ordered by column, the id column
+        of the model, and the cursor of the next page (None on the last
+        page). Page cost does not depend on how deep the page is.
+    """
+    if cursor is not None:
+        query = query.filter(column > decode_cursor(cursor))
+    rows = query.order_by(column).limit(limit + 1).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1].id)
+    return rows, None
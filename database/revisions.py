@@ -0,0 +1,103 @@
+import threading
+import weakref
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from database.models import actors_movies, Actor, Movie
+
+
+class RevisionCounter:
+    """
+    RevisionCounter
+    Per-table revision numbers, bumped once for every committed
+    transaction that wrote to the table. Listeners are called with the set
+    of changed table names after each such commit.
+    """
+
+    def __init__(self):
+        self._revisions = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def get(self, *tables):
+        with self._lock:
+            return tuple(self._revisions.get(table, 0) for table in tables)
+
+    def bump(self, tables):
+        with self._lock:
+            for table in tables:
+                self._revisions[table] = self._revisions.get(table, 0) + 1
+            listeners = list(self._listeners)
+        for listener in listeners:
+            callback = listener()
+            if callback is not None:
+                callback(tables)
+
+    def add_listener(self, callback):
+        """
+        add_listener(callback)
+            calls callback(tables) after every committed write. Bound
+            methods are held weakly so that discarded apps and caches do
+            not keep receiving notifications.
+        """
+        if hasattr(callback, '__self__'):
+            reference = weakref.WeakMethod(callback)
+        else:
+            def reference():
+                return callback
+        with self._lock:
+            self._listeners = [listener for listener in self._listeners
+                               if listener() is not None]
+            self._listeners.append(reference)
+
+
+revisions = RevisionCounter()
+
+
+def mark_changed(session, *tables):
+    """
+    mark_changed(session, *tables)
+        records that the current transaction of session wrote to tables.
+        Needed for Core statements, which bypass the mapper events.
+    """
+    session.info.setdefault('changed_tables', set()).update(tables)
+
+
+def _cast_changed(mapper, target):
+    state = inspect(target)
+    return any(state.attrs[relationship.key].history.has_changes()
+               for relationship in mapper.relationships
+               if relationship.secondary is actors_movies)
+
+
+def _record_write(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        mark_changed(session, mapper.local_table.name)
+        if _cast_changed(mapper, target):
+            mark_changed(session, actors_movies.name)
+
+
+def _record_delete(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        mark_changed(session, mapper.local_table.name, actors_movies.name)
+
+
+for _model in (Movie, Actor):
+    event.listen(_model, 'after_insert', _record_write)
+    event.listen(_model, 'after_update', _record_write)
+    event.listen(_model, 'after_delete', _record_delete)
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_changes(session):
+    tables = session.info.pop('changed_tables', None)
+    if tables:
+        revisions.bump(tables)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('changed_tables', None)
@@ -0,0 +1,175 @@
+import itertools
+import logging
+import os
+import threading
+import time
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from itsdangerous import BadSignature, TimestampSigner
+from sqlalchemy import create_engine, event, orm, text
+
+logger = logging.getLogger(__name__)
+
+READ_METHODS = ('GET', 'HEAD')
+
+WRITE_TOKEN_HEADER = 'X-Last-Write'
+WRITE_TOKEN_COOKIE = 'last_write'
+
+
+class ReplicaRouter:
+    """
+    ReplicaRouter
+    Round-robin over read replicas. A replica that errors is taken out of
+    rotation for retry_interval seconds and only comes back after a
+    successful SELECT 1. A successful write hands the client a signed,
+    timestamped token. Requests that send it back within read_your_writes
+    seconds keep reading from the primary so they see their own writes,
+    whichever worker serves them.
+    """
+
+    def __init__(self, urls, engine_options=None, read_your_writes=5,
+                 retry_interval=30, secret_key=None):
+        self.engines = [create_engine(url, **(engine_options or {}))
+                        for url in urls]
+        self.read_your_writes = read_your_writes
+        self.retry_interval = retry_interval
+        if secret_key is None:
+            logger.warning('SECRET_KEY is not set, so read-your-writes '
+                           'tokens only work on the worker that issued them')
+            secret_key = os.urandom(32)
+        self._signer = TimestampSigner(secret_key, salt='read-your-writes')
+        self._down_until = {engine: 0.0 for engine in self.engines}
+        self._cycle = itertools.cycle(self.engines)
+        self._lock = threading.Lock()
+        for engine in self.engines:
+            event.listen(engine, 'handle_error', self._on_error)
+
+    def _on_error(self, context):
+        engine = context.engine
+        if engine in self._down_until and (
+                context.is_disconnect or
+                context.connection is None or
+                context.connection.invalidated):
+            self.mark_down(engine)
+
+    def mark_down(self, engine):
+        logger.warning('Taking replica %s out of rotation', engine.url)
+        with self._lock:
+            self._down_until[engine] = time.monotonic() + self.retry_interval
+
+    def _is_healthy(self, engine):
+        with self._lock:
+            down_until = self._down_until[engine]
+        if not down_until:
+            return True
+        if down_until > time.monotonic():
+            return False
+        try:
+            with engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+        except Exception:
+            self.mark_down(engine)
+            return False
+        with self._lock:
+            self._down_until[engine] = 0.0
+        return True
+
+    def choose(self):
+        """
+        choose()
+            returns the next healthy replica engine, or None when every
+            replica is down and reads have to go to the primary
+        """
+        for _ in range(len(self.engines)):
+            with self._lock:
+                engine = next(self._cycle)
+            if self._is_healthy(engine):
+                return engine
+        return None
+
+    def write_token(self):
+        """
+        write_token()
+            returns a token recording that the client wrote just now
+        """
+        return self._signer.sign('write').decode('ascii')
+
+    def add_write_token(self, response):
+        """
+        add_write_token(response)
+            hands a fresh write token to the client of a successful
+            write, as a cookie and as the X-Last-Write header for clients
+            that do not keep cookies
+        """
+        token = self.write_token()
+        response.headers[WRITE_TOKEN_HEADER] = token
+        response.set_cookie(WRITE_TOKEN_COOKIE, token,
+                            max_age=max(1, int(self.read_your_writes)),
+                            httponly=True, samesite='Lax')
+
+    def must_read_primary(self, token):
+        """
+        must_read_primary(token)
+            tells whether token is a genuine write token issued within
+            the last read_your_writes seconds
+        """
+        if not token:
+            return False
+        try:
+            self._signer.unsign(token, max_age=self.read_your_writes)
+        except BadSignature:
+            return False
+        return True
+
+    def status(self):
+        now = time.monotonic()
+        with self._lock:
+            return [{
+                'url': engine.url.render_as_string(hide_password=True),
+                'healthy': self._down_until[engine] <= now
+            } for engine in self.engines]
+
+
+def request_write_token():
+    return request.headers.get(WRITE_TOKEN_HEADER) or \
+        request.cookies.get(WRITE_TOKEN_COOKIE)
+
+
+class RoutingSession(SignallingSession):
+    """
+    RoutingSession
+    Sends the queries of GET and HEAD requests to a read replica chosen
+    once per request. Flushes, writes and every other request keep using
+    the primary engine.
+    """
+
+    def _replica(self):
+        if self._flushing or not has_request_context() or \
+                request.method not in READ_METHODS or g.get('use_primary'):
+            return None
+        router = self.app.extensions.get('replica_router')
+        if router is None:
+            return None
+        if 'replica_engine' not in g:
+            g.replica_engine = None \
+                if router.must_read_primary(request_write_token()) \
+                else router.choose()
+            # A recent write bumped the cache generation, but the replica
+            # may not have it yet: don't cache its rows as current.
+            cache = self.app.extensions.get('response_cache')
+            if g.replica_engine is not None and cache is not None and \
+                    cache.invalidated_within(router.read_your_writes):
+                g.skip_cache_store = True
+        return g.replica_engine
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        replica = self._replica()
+        if replica is not None:
+            return replica
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
@@ -0,0 +1,310 @@
+import datetime
+import threading
+import time
+from collections import Counter
+
+from database.models import db, actors_movies, utcnow, Actor, Movie, \
+    GenderType, StatsContribution, StatsSummary, Tombstone
+from database.queries import chunks
+from database.revisions import revisions
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# StatsSummary row holding the updated_at up to which it is current, in
+# microseconds since EPOCH. The migration seeds it with NEVER_FILLED, and
+# every refresh locks it first.
+WATERMARK = ('watermark', '')
+NEVER_FILLED = 0
+
+
+def _link_counts(model, link_column):
+    # One row per movie (or actor) with its number of links, zero for
+    # those without any.
+    return db.session.query(
+        model.id.label('id'),
+        db.func.count(link_column).label('size')
+    ).outerjoin(actors_movies, link_column == model.id).group_by(model.id)
+
+
+def _release_year():
+    return db.extract('year', Movie.release_date)
+
+
+def _format(totals, cast_sizes, movies_per_actor, genders, years):
+    gender_counts = {gender.name: 0 for gender in GenderType}
+    for gender, count in genders:
+        gender_counts[gender.name if isinstance(gender, GenderType)
+                      else gender] = count
+    return {
+        'totals': totals,
+        'cast_sizes': [{'actors': size, 'movies': count}
+                       for size, count in sorted(cast_sizes)],
+        'movies_per_actor': [{'movies': size, 'actors': count}
+                             for size, count in sorted(movies_per_actor)],
+        'genders': gender_counts,
+        'releases_per_year': [
+            {'year': year, 'movies': count} for year, count in
+            sorted(years, key=lambda item: (item[0] is None, item[0] or 0))],
+    }
+
+
+def compute_stats():
+    """
+    compute_stats()
+        returns the totals, the cast size and movies per actor
+        distributions, the gender split and the releases per year, each
+        computed with one GROUP BY query
+    """
+    totals = db.session.query(
+        db.session.query(db.func.count(Movie.id)).scalar_subquery(),
+        db.session.query(db.func.count(Actor.id)).scalar_subquery(),
+        db.session.query(db.func.count()).select_from(actors_movies)
+        .scalar_subquery()).one()
+
+    distributions = []
+    for model, link_column in ((Movie, actors_movies.c.movie_id),
+                               (Actor, actors_movies.c.actor_id)):
+        counts = _link_counts(model, link_column).subquery()
+        distributions.append(
+            db.session.query(counts.c.size, db.func.count())
+            .group_by(counts.c.size).all())
+
+    genders = db.session.query(Actor.gender, db.func.count()) \
+        .group_by(Actor.gender).all()
+    year = _release_year()
+    years = db.session.query(year, db.func.count()).group_by(year).all()
+
+    return _format(dict(zip(('movies', 'actors', 'links'), totals)),
+                   *distributions, genders,
+                   [(None if year is None else int(year), count)
+                    for year, count in years])
+
+
+def _metrics(contribution):
+    # The StatsSummary counters one contribution adds to.
+    table_name, size, release_year, gender = contribution
+    if table_name == Movie.__tablename__:
+        return (('totals', 'movies', 1), ('totals', 'links', size),
+                ('cast_sizes', str(size), 1),
+                ('releases_per_year',
+                 '' if release_year is None else str(release_year), 1))
+    return (('totals', 'actors', 1), ('movies_per_actor', str(size), 1),
+            ('genders', gender.name, 1))
+
+
+class MaterializedStats:
+    """
+    MaterializedStats
+    Serves GET /stats from the StatsSummary table, which is kept current
+    incrementally. A refresh re-counts only the movies and actors whose
+    updated_at moved or that left a Tombstone. It compares them with
+    their previous StatsContribution and applies the difference, so
+    re-reading rows from the settle window changes nothing.
+    """
+
+    def __init__(self, refresh_seconds=1.0, settle_seconds=5.0):
+        self.refresh_seconds = refresh_seconds
+        self.settle_seconds = settle_seconds
+        self._checked = None
+        self._filled = False
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        from_config(config)
+            builds the summary from STATS_SUMMARY_REFRESH_SECONDS and
+            CHANGES_SETTLE_SECONDS
+        """
+        return cls(
+            refresh_seconds=float(config.get('STATS_SUMMARY_REFRESH_SECONDS',
+                                             1.0)),
+            settle_seconds=float(config.get('CHANGES_SETTLE_SECONDS', 5)))
+
+    def invalidate(self, tables=None):
+        self._dirty = True
+
+    def reset(self):
+        with self._lock:
+            self._checked = None
+
+    def _contributions(self, model, ids):
+        if model is Movie:
+            query = db.session.query(
+                Movie.id, db.func.count(actors_movies.c.actor_id),
+                _release_year(), db.null()) \
+                .outerjoin(actors_movies,
+                           actors_movies.c.movie_id == Movie.id) \
+                .group_by(Movie.id, Movie.release_date)
+        else:
+            query = db.session.query(
+                Actor.id, db.func.count(actors_movies.c.movie_id),
+                db.null(), Actor.gender) \
+                .outerjoin(actors_movies,
+                           actors_movies.c.actor_id == Actor.id) \
+                .group_by(Actor.id, Actor.gender)
+        if ids is not None:
+            query = query.filter(model.id.in_(ids))
+        return {row[0]: (model.__tablename__, row[1],
+                         None if row[2] is None else int(row[2]), row[3])
+                for row in query}
+
+    def _changed_ids(self, model, since):
+        changed = {row[0] for row in db.session.query(model.id)
+                   .filter(model.updated_at >= since)}
+        changed.update(row[0] for row in db.session.query(Tombstone.row_id)
+                       .filter(Tombstone.deleted_at >= since,
+                               Tombstone.table_name == model.__tablename__))
+        return changed
+
+    def _apply(self, model, ids, deltas):
+        # Replaces the contributions of ids (of every row when ids is
+        # None) with freshly counted ones and adds the difference to
+        # deltas.
+        contribution = StatsContribution.__table__
+        old = db.session.query(
+            StatsContribution.row_id, StatsContribution.table_name,
+            StatsContribution.size, StatsContribution.release_year,
+            StatsContribution.gender
+        ).filter(StatsContribution.table_name == model.__tablename__)
+        if ids is not None:
+            old = old.filter(StatsContribution.row_id.in_(ids))
+        old = {row[0]: tuple(row[1:]) for row in old}
+        new = self._contributions(model, ids)
+
+        changed = [row_id for row_id in set(old) | set(new)
+                   if old.get(row_id) != new.get(row_id)]
+        for row_id in changed:
+            for sign, current in ((-1, old.get(row_id)),
+                                  (1, new.get(row_id))):
+                if current is not None:
+                    for metric, bucket, amount in _metrics(current):
+                        deltas[metric, bucket] += sign * amount
+
+        stale = [row_id for row_id in changed if row_id in old]
+        if stale:
+            db.session.execute(contribution.delete().where(
+                (contribution.c.table_name == model.__tablename__) &
+                contribution.c.row_id.in_(stale)))
+        fresh = [row_id for row_id in changed if row_id in new]
+        if fresh:
+            db.session.execute(contribution.insert(), [
+                dict(zip(('table_name', 'size', 'release_year', 'gender'),
+                         new[row_id]), row_id=row_id)
+                for row_id in fresh])
+
+    def _add(self, metric, bucket, value, increment=True):
+        summary = StatsSummary.__table__
+        statement = summary.update().where(
+            (summary.c.metric == metric) & (summary.c.bucket == bucket)
+        ).values(value=summary.c.value + value if increment else value)
+        if db.session.execute(statement).rowcount == 0:
+            db.session.execute(summary.insert().values(
+                metric=metric, bucket=bucket, value=value))
+
+    def _lock_watermark(self, fill):
+        # SELECT ... FOR UPDATE on the watermark row serializes refreshes
+        # across workers. When it is missing, as in a database created
+        # without the migrations, only a fill inserts it.
+        current = db.session.query(StatsSummary.value).filter(
+            StatsSummary.metric == WATERMARK[0],
+            StatsSummary.bucket == WATERMARK[1]
+        ).with_for_update().scalar()
+        if current is None and fill:
+            db.session.execute(StatsSummary.__table__.insert().values(
+                metric=WATERMARK[0], bucket=WATERMARK[1],
+                value=NEVER_FILLED))
+            current = NEVER_FILLED
+        return current
+
+    def refresh(self, fill=False):
+        """
+        refresh(fill)
+            brings StatsSummary up to date in one transaction, holding
+            the lock on the watermark row so that two workers never apply
+            the same changes. A summary that was never filled is built
+            from scratch only with fill, as flask refresh-stats does.
+            Returns whether the summary is filled.
+        """
+        watermark = utcnow() - datetime.timedelta(
+            seconds=self.settle_seconds)
+        current = self._lock_watermark(fill)
+        if current in (None, NEVER_FILLED) and not fill:
+            db.session.rollback()
+            return False
+
+        deltas = Counter()
+        if current == NEVER_FILLED:
+            summary = StatsSummary.__table__
+            db.session.execute(StatsContribution.__table__.delete())
+            db.session.execute(summary.delete().where(
+                summary.c.metric != WATERMARK[0]))
+            for model in (Movie, Actor):
+                self._apply(model, None, deltas)
+        else:
+            since = EPOCH + datetime.timedelta(microseconds=current)
+            for model in (Movie, Actor):
+                for chunk in chunks(sorted(self._changed_ids(model, since))):
+                    self._apply(model, chunk, deltas)
+        for (metric, bucket), delta in deltas.items():
+            if delta:
+                self._add(metric, bucket, delta)
+        self._add(*WATERMARK, (watermark - EPOCH) //
+                  datetime.timedelta(microseconds=1), increment=False)
+        db.session.commit()
+        return True
+
+    def read(self):
+        """
+        read()
+            returns the stats in the shape of compute_stats(), refreshing
+            the summary first after a local write or once refresh_seconds
+            have passed. Until flask refresh-stats has filled the
+            summary, they come from compute_stats().
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._checked is None or self._dirty or \
+                    now - self._checked >= self.refresh_seconds:
+                self._dirty = False
+                self._filled = self.refresh()
+                self._checked = now
+            filled = self._filled
+        if not filled:
+            return compute_stats()
+
+        values = {}
+        for metric, bucket, value in db.session.query(
+                StatsSummary.metric, StatsSummary.bucket,
+                StatsSummary.value):
+            if value or metric == 'totals':
+                values.setdefault(metric, []).append((bucket, value))
+
+        totals = {'movies': 0, 'actors': 0, 'links': 0}
+        totals.update(values.get('totals', ()))
+        return _format(
+            totals,
+            [(int(size), count) for size, count in values.get(
+                'cast_sizes', ())],
+            [(int(size), count) for size, count in values.get(
+                'movies_per_actor', ())],
+            values.get('genders', ()),
+            [(int(year) if year else None, count) for year, count in
+             values.get('releases_per_year', ())])
+
+
+def init_stats(app):
+    """
+    init_stats(app)
+        registers the materialized summary when STATS_SUMMARY_ENABLED is
+        on and returns it, or returns None so that GET /stats runs its
+        GROUP BY queries on every cache miss
+    """
+    if str(app.config.get('STATS_SUMMARY_ENABLED', False)).lower() in \
+            ('0', 'false', 'no', 'off'):
+        return None
+    stats = MaterializedStats.from_config(app.config)
+    revisions.add_listener(stats.invalidate)
+    app.extensions['stats_summary'] = stats
+    return stats
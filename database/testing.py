@@ -0,0 +1,111 @@
+from sqlalchemy import event, orm
+
+from database.models import db
+from database.routing import RoutingSession
+
+
+def _enable_sqlite_savepoints(engine):
+    # pysqlite manages transactions itself and breaks SAVEPOINT; let
+    # SQLAlchemy emit BEGIN instead, and enforce foreign keys like
+    # Postgres does.
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+    @event.listens_for(engine, 'begin')
+    def begin(connection):
+        connection.exec_driver_sql('BEGIN')
+
+
+class SavepointSession(RoutingSession):
+    """
+    SavepointSession
+    A session that keeps its work in a SAVEPOINT of the test's
+    transaction, opening a new one whenever it commits or rolls back.
+    close() rolls the SAVEPOINT back, as closing a real session discards
+    what it did not commit, but leaves the test's transaction alone.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._closing = False
+        event.listen(self, 'after_transaction_end', self._restart_savepoint)
+        self.begin_nested()
+
+    def _restart_savepoint(self, session, transaction):
+        if transaction.nested and not transaction._parent.nested and \
+                not self._closing:
+            self.expire_all()
+            self.begin_nested()
+
+    def close(self):
+        self._closing = True
+        try:
+            nested = self.get_nested_transaction()
+            if nested is not None and nested.is_active:
+                nested.rollback()
+            super().close()
+        finally:
+            self._closing = False
+
+
+class TestDatabase:
+    """
+    TestDatabase
+    Creates the schema once and runs every test inside a transaction that
+    is rolled back afterwards. The app's sessions work in a SAVEPOINT, so
+    their commits and rollbacks behave as usual without ever reaching the
+    database. Rows inserted through begin()'s connection before the test
+    body runs survive the test's own rollbacks. No app context is kept
+    between calls, so every test-client request gets its own, as it
+    would when served.
+    """
+
+    __test__ = False
+
+    def __init__(self, app):
+        self.app = app
+        self.connection = None
+        self._transaction = None
+        self._session = None
+        with app.app_context():
+            if db.engine.dialect.name == 'sqlite':
+                _enable_sqlite_savepoints(db.engine)
+            db.create_all()
+
+    def begin(self, seed=None):
+        """
+        begin(seed)
+            starts the test's transaction. seed(connection) is called
+            first, inside an app context, to insert fixture rows that the
+            test's own rollbacks leave in place.
+        """
+        with self.app.app_context():
+            self.connection = db.engine.connect()
+            self._transaction = self.connection.begin()
+            if seed is not None:
+                seed(self.connection)
+
+        self._session = db.session
+        db.session = orm.scoped_session(
+            orm.sessionmaker(class_=SavepointSession, db=db,
+                             bind=self.connection, binds={},
+                             query_cls=db.Query),
+            scopefunc=self._session.registry.scopefunc)
+
+        response_cache = self.app.extensions.get('response_cache')
+        if response_cache is not None:
+            response_cache.backend.clear()
+        for name in ('cast_index', 'stats_summary'):
+            extension = self.app.extensions.get(name)
+            if extension is not None:
+                extension.reset()
+
+    def end(self):
+        db.session.remove()
+        db.session = self._session
+        self._transaction.rollback()
+        self.connection.close()
@@ -0,0 +1,120 @@
+import datetime
+
+from database.models import GenderType
+
+# The formats Postgres accepts for a Date column under the default MDY
+# DateStyle, so rows validated here are not rejected later on insert.
+DATE_FORMATS = ('%Y-%m-%d', '%m.%d.%Y', '%m/%d/%Y', '%m-%d-%Y')
+
+
+def parse_date(value):
+    """
+    parse_date(value)
+        returns value as a datetime.date, raising ValueError when it is
+        not a date string in one of DATE_FORMATS
+    """
+    if isinstance(value, datetime.date):
+        return value
+    if not isinstance(value, str):
+        raise ValueError('Invalid date')
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+    raise ValueError('Invalid date')
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def validate_movie(item, partial=False):
+    """
+    validate_movie(item, partial)
+        returns the column values and actor ids of a movie payload plus a
+        dict of field errors, which is empty when the payload is valid.
+        With partial=True only the fields present in item are checked and
+        returned, and actor ids are None when 'actors' is absent.
+    """
+    if not isinstance(item, dict):
+        return None, None, {'movie': 'Expected an object.'}
+
+    values, errors = {}, {}
+    if 'title' in item or not partial:
+        title = item.get('title')
+        if not isinstance(title, str) or not title.strip():
+            errors['title'] = 'Title is required.'
+        values['title'] = title
+
+    if 'release_date' in item:
+        try:
+            values['release_date'] = parse_date(item['release_date'])
+        except ValueError:
+            errors['release_date'] = 'Release date is not a valid date.'
+    elif not partial:
+        errors['release_date'] = 'Release date is required.'
+
+    actor_ids = None
+    if 'actors' in item or not partial:
+        actor_ids = _actor_ids(item.get('actors', []), errors)
+
+    return values, actor_ids, errors
+
+
+def _actor_ids(actor_ids, errors):
+    if not isinstance(actor_ids, list) or \
+            not all(_is_int(actor_id) for actor_id in actor_ids):
+        errors['actors'] = 'Actors must be a list of actor ids.'
+        return []
+    return list(dict.fromkeys(actor_ids))
+
+
+def validate_cast(item):
+    """
+    validate_cast(item)
+        returns the de-duplicated actor ids of a {"actors": [...]} payload
+        plus a dict of field errors, which is empty when it is valid
+    """
+    if not isinstance(item, dict):
+        return None, {'cast': 'Expected an object.'}
+
+    if 'actors' not in item:
+        return [], {'actors': 'Actors is required.'}
+    errors = {}
+    actor_ids = _actor_ids(item['actors'], errors)
+    return actor_ids, errors
+
+
+def validate_actor(item, partial=False):
+    """
+    validate_actor(item, partial)
+        returns the column values of an actor payload plus a dict of field
+        errors, which is empty when the payload is valid. With
+        partial=True only the fields present in item are checked and
+        returned.
+    """
+    if not isinstance(item, dict):
+        return None, {'actor': 'Expected an object.'}
+
+    values, errors = {}, {}
+    if 'name' in item or not partial:
+        name = item.get('name')
+        if not isinstance(name, str) or not name.strip():
+            errors['name'] = 'Name is required.'
+        values['name'] = name
+
+    if 'age' in item or not partial:
+        age = item.get('age')
+        if not _is_int(age) or age < 0:
+            errors['age'] = 'Age must be a non-negative integer.'
+        values['age'] = age
+
+    if 'gender' in item or not partial:
+        try:
+            values['gender'] = GenderType(item.get('gender'))
+        except ValueError:
+            errors['gender'] = 'Gender must be one of: {}.'.format(
+                ', '.join(gender_type.value for gender_type in GenderType))
+
+    return values, errors
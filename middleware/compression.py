@@ -0,0 +1,139 @@
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson',
+                          'text/csv')
+
+
+class Compressor:
+    """
+    Compressor
+    Negotiates Accept-Encoding and compresses JSON, NDJSON and CSV
+    bodies with brotli (when installed) or gzip. Bodies smaller than
+    min_size are sent as they are; streamed bodies are compressed chunk
+    by chunk as they are produced.
+    """
+
+    def __init__(self, min_size=1024, level=6, brotli_level=4,
+                 encodings=('br', 'gzip'), enabled=True):
+        self.min_size = min_size
+        self.level = level
+        self.brotli_level = brotli_level
+        self.encodings = tuple(encoding for encoding in encodings
+                               if encoding != 'br' or brotli is not None)
+        self.enabled = enabled
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        from_config(config)
+            builds the compressor from COMPRESS_ENABLED,
+            COMPRESS_MIN_SIZE, COMPRESS_LEVEL, COMPRESS_BROTLI_LEVEL and
+            COMPRESS_ENCODINGS (comma separated, in order of preference)
+        """
+        encodings = config.get('COMPRESS_ENCODINGS', 'br,gzip')
+        if isinstance(encodings, str):
+            encodings = [encoding.strip() for encoding in
+                         encodings.split(',') if encoding.strip()]
+        return cls(
+            min_size=int(config.get('COMPRESS_MIN_SIZE', 1024)),
+            level=int(config.get('COMPRESS_LEVEL', 6)),
+            brotli_level=int(config.get('COMPRESS_BROTLI_LEVEL', 4)),
+            encodings=encodings,
+            enabled=str(config.get('COMPRESS_ENABLED', True)).lower()
+            not in ('0', 'false', 'no', 'off'))
+
+    def is_compressible(self, response):
+        return self.enabled and \
+            response.mimetype in COMPRESSIBLE_MIMETYPES
+
+    def choose(self, size=None):
+        """
+        choose(size)
+            returns the encoding the request accepts that the body should
+            be sent with, or None when it should go uncompressed. size is
+            None for streamed bodies.
+        """
+        if not self.enabled or (size is not None and size < self.min_size):
+            return None
+        return request.accept_encodings.best_match(self.encodings)
+
+    def compress(self, data, encoding):
+        if encoding == 'br':
+            return brotli.compress(data, quality=self.brotli_level)
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+
+    def compress_stream(self, chunks, encoding):
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=self.brotli_level)
+            process, finish = compressor.process, compressor.finish
+        else:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+            process, finish = compressor.compress, compressor.flush
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = process(chunk)
+            if data:
+                yield data
+        yield finish()
+
+    @staticmethod
+    def mark(response, encoding):
+        """
+        mark(response, encoding)
+            labels a response whose body is encoded. The ETag is made
+            weak since it names the content, not these exact bytes.
+        """
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag(etag, weak=True)
+
+    def after_request(self, response):
+        if not self.is_compressible(response):
+            return response
+        response.vary.add('Accept-Encoding')
+        if 'Content-Encoding' in response.headers:
+            self.mark(response, response.headers['Content-Encoding'])
+            return response
+        if request.method == 'HEAD' or response.status_code < 200 or \
+                response.status_code in (204, 206, 304) or \
+                response.direct_passthrough or \
+                response.cache_control.no_transform:
+            return response
+
+        if response.is_streamed:
+            encoding = self.choose()
+            if encoding is not None:
+                response.response = self.compress_stream(
+                    response.response, encoding)
+                response.headers.pop('Content-Length', None)
+                self.mark(response, encoding)
+            return response
+
+        data = response.get_data()
+        encoding = self.choose(len(data))
+        if encoding is not None:
+            response.set_data(self.compress(data, encoding))
+            self.mark(response, encoding)
+        return response
+
+
+def init_compression(app):
+    """
+    init_compression(app)
+        registers the compressor. Call it before any other after_request
+        hook is added so it runs last, once the ETag is set.
+    """
+    compressor = Compressor.from_config(app.config)
+    app.extensions['compressor'] = compressor
+    app.after_request(compressor.after_request)
+    return compressor
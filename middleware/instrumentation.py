@@ -0,0 +1,137 @@
+import random
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from middleware.metrics import Registry, COUNT_BUCKETS
+from middleware.profiler import StackSampler
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if has_request_context() and 'request_start' in g:
+        context._query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    start = getattr(context, '_query_start', None)
+    if start is not None and has_request_context() and 'request_start' in g:
+        g.query_count += 1
+        g.query_seconds += time.perf_counter() - start
+
+
+def _listen_to_engines():
+    # Listening on the Engine class covers the primary and every replica
+    # engine; queries outside an instrumented request are ignored.
+    if not event.contains(Engine, 'before_cursor_execute',
+                          _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+class Instrumentation:
+    """
+    Instrumentation
+    Records per route latency, the number and duration of database
+    queries and the time spent verifying tokens, and optionally profiles
+    slow requests with a StackSampler.
+    """
+
+    def __init__(self, registry=None, sampler=None, sample_rate=1.0):
+        self.registry = registry if registry is not None else Registry()
+        self.sampler = sampler
+        self.sample_rate = sample_rate
+        self.request_seconds = self.registry.histogram(
+            'http_request_duration_seconds',
+            'Time spent handling requests.',
+            ('method', 'route', 'status'))
+        self.request_queries = self.registry.histogram(
+            'http_request_db_queries',
+            'Database queries run per request.',
+            ('method', 'route'), buckets=COUNT_BUCKETS)
+        self.query_seconds = self.registry.counter(
+            'db_query_seconds_total',
+            'Time spent running database queries.',
+            ('method', 'route'))
+        self.jwt_seconds = self.registry.histogram(
+            'jwt_verify_duration_seconds',
+            'Time spent in verify_decode_jwt on token cache misses.')
+        self.token_lookups = self.registry.counter(
+            'token_cache_lookups_total',
+            'Verified token cache lookups.', ('result',))
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        from_config(config)
+            builds the instrumentation. Profiling is off unless
+            PROFILE_SLOW_SECONDS is set; PROFILE_SAMPLE_RATE is the share
+            of requests that are sampled and PROFILE_INTERVAL the seconds
+            between samples.
+        """
+        sampler = None
+        slow_seconds = config.get('PROFILE_SLOW_SECONDS')
+        if slow_seconds not in (None, ''):
+            sampler = StackSampler(
+                slow_seconds=float(slow_seconds),
+                interval=float(config.get('PROFILE_INTERVAL', 0.005)),
+                keep=int(config.get('PROFILE_KEEP', 20)))
+        return cls(sampler=sampler,
+                   sample_rate=float(config.get('PROFILE_SAMPLE_RATE', 1.0)))
+
+    def init_app(self, app):
+        _listen_to_engines()
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.extensions['instrumentation'] = self
+
+    def before_request(self):
+        g.query_count = 0
+        g.query_seconds = 0.0
+        g.request_start = time.perf_counter()
+        if self.sampler is not None and random.random() < self.sample_rate:
+            self.sampler.begin()
+
+    def after_request(self, response):
+        start = g.pop('request_start', None)
+        if start is None:
+            return response
+        duration = time.perf_counter() - start
+        method = request.method
+        route = request.url_rule.rule if request.url_rule else '<unmatched>'
+
+        self.request_seconds.observe(duration, method=method, route=route,
+                                     status=str(response.status_code))
+        self.request_queries.observe(g.query_count, method=method,
+                                     route=route)
+        self.query_seconds.inc(g.query_seconds, method=method, route=route)
+        if 'token_cache_hit' in g:
+            self.token_lookups.inc(
+                result='hit' if g.token_cache_hit else 'miss')
+        if 'jwt_verify_seconds' in g:
+            self.jwt_seconds.observe(g.jwt_verify_seconds)
+        if self.sampler is not None:
+            self.sampler.end(duration, method, route)
+        return response
+
+    def profiles(self):
+        return list(self.sampler.profiles) if self.sampler is not None \
+            else []
+
+
+def init_instrumentation(app):
+    """
+    init_instrumentation(app)
+        registers request instrumentation unless INSTRUMENTATION_ENABLED
+        is off. Call it before other after_request hooks are added so the
+        recorded latency includes them.
+    """
+    if str(app.config.get('INSTRUMENTATION_ENABLED', True)).lower() in \
+            ('0', 'false', 'no', 'off'):
+        return None
+    instrumentation = Instrumentation.from_config(app.config)
+    instrumentation.init_app(app)
+    return instrumentation
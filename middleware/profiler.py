@@ -0,0 +1,98 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+logger = logging.getLogger(__name__)
+
+
+class StackSampler:
+    """
+    StackSampler
+    Statistical profiler for slow requests. A background thread samples
+    the stack of every thread serving a profiled request each interval
+    seconds. Requests that end up taking at least slow_seconds keep their
+    most frequent stacks, the rest are thrown away. Sampling costs the
+    request threads nothing beyond holding the lock while stacks are
+    collected.
+    """
+
+    def __init__(self, slow_seconds=1.0, interval=0.005, keep=20,
+                 max_depth=64, top=20):
+        self.slow_seconds = slow_seconds
+        self.interval = interval
+        self.max_depth = max_depth
+        self.top = top
+        self.profiles = deque(maxlen=keep)
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_thread(self):
+        # gunicorn forks workers after the app is created, so each worker
+        # starts its own sampling thread on its first profiled request.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name='stack-sampler', daemon=True)
+            self._thread.start()
+
+    def _collapse(self, frame):
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append('{}:{}:{}'.format(
+                os.path.basename(code.co_filename), code.co_name,
+                frame.f_lineno))
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for ident, stacks in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stacks[self._collapse(frame)] += 1
+
+    def begin(self):
+        self._ensure_thread()
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+
+    def end(self, duration, method, route):
+        """
+        end(duration, method, route)
+            stops sampling the calling thread and keeps its profile when
+            the request was slow. Returns the profile or None.
+        """
+        with self._lock:
+            stacks = self._active.pop(threading.get_ident(), None)
+        if stacks is None or duration < self.slow_seconds:
+            return None
+
+        profile = {
+            'method': method,
+            'route': route,
+            'duration_seconds': duration,
+            'samples': sum(stacks.values()),
+            'stacks': [{'stack': stack, 'samples': samples}
+                       for stack, samples in stacks.most_common(self.top)]
+        }
+        self.profiles.append(profile)
+        logger.warning('Slow request %s %s took %.3fs, hottest stack: %s',
+                       method, route, duration,
+                       profile['stacks'][0]['stack']
+                       if profile['stacks'] else '-')
+        return profile
@@ -0,0 +1,28 @@
+"""version columns for optimistic concurrency on Movie and Actor
+
+Revision ID: 2deb9ecd6a03
+Revises: a02eb1f4ed34
+Create Date: 2026-10-18 11:02:17.849213
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2deb9ecd6a03'
+down_revision = 'a02eb1f4ed34'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('Actor', sa.Column('version', sa.Integer(), nullable=False,
+                                     server_default='1'))
+    op.add_column('Movie', sa.Column('version', sa.Integer(), nullable=False,
+                                     server_default='1'))
+
+
+def downgrade():
+    op.drop_column('Movie', 'version')
+    op.drop_column('Actor', 'version')
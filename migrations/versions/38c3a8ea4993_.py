@@ -0,0 +1,31 @@
+"""search indexes on Actor and Movie
+
+Revision ID: 38c3a8ea4993
+Revises: 2deb9ecd6a03
+Create Date: 2026-10-18 11:41:05.116482
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '38c3a8ea4993'
+down_revision = '2deb9ecd6a03'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Actor_gender_age', 'Actor', ['gender', 'age'],
+                    unique=False)
+    op.create_index('ix_Movie_release_date', 'Movie', ['release_date'],
+                    unique=False)
+    op.create_index('ix_Movie_lower_title', 'Movie',
+                    [sa.text('lower(title) text_pattern_ops')], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Movie_lower_title', table_name='Movie')
+    op.drop_index('ix_Movie_release_date', table_name='Movie')
+    op.drop_index('ix_Actor_gender_age', table_name='Actor')
@@ -0,0 +1,45 @@
+"""updated_at on Actor and Movie and the Tombstone table
+
+Revision ID: 7c1e5f0b9a24
+Revises: 38c3a8ea4993
+Create Date: 2026-10-18 15:02:47.381920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c1e5f0b9a24'
+down_revision = '38c3a8ea4993'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('Actor', 'Movie'):
+        op.add_column(table, sa.Column(
+            'updated_at', sa.DateTime(), nullable=False,
+            server_default=sa.text("(now() at time zone 'utc')")))
+        op.alter_column(table, 'updated_at', server_default=None)
+        op.create_index('ix_{}_updated_at_id'.format(table), table,
+                        ['updated_at', 'id'], unique=False)
+
+    op.create_table(
+        'Tombstone',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('table_name', sa.String(), nullable=False),
+        sa.Column('row_id', sa.Integer(), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_Tombstone_deleted_at_id', 'Tombstone',
+                    ['deleted_at', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Tombstone_deleted_at_id', table_name='Tombstone')
+    op.drop_table('Tombstone')
+    for table in ('Movie', 'Actor'):
+        op.drop_index('ix_{}_updated_at_id'.format(table), table_name=table)
+        op.drop_column(table, 'updated_at')
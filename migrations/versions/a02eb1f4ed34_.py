@@ -0,0 +1,61 @@
+"""composite primary key and indexes on ActorsMovies
+
+Revision ID: a02eb1f4ed34
+Revises: da5b9069d964
+Create Date: 2026-10-18 10:12:41.503117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a02eb1f4ed34'
+down_revision = 'da5b9069d964'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Links without both ends and duplicated links would violate the new
+    # primary key, so they are dropped first.
+    op.execute('DELETE FROM "ActorsMovies" '
+               'WHERE actor_id IS NULL OR movie_id IS NULL')
+    op.execute('DELETE FROM "ActorsMovies" a USING "ActorsMovies" b '
+               'WHERE a.ctid < b.ctid '
+               'AND a.actor_id = b.actor_id AND a.movie_id = b.movie_id')
+
+    op.alter_column('ActorsMovies', 'actor_id',
+                    existing_type=sa.Integer(), nullable=False)
+    op.alter_column('ActorsMovies', 'movie_id',
+                    existing_type=sa.Integer(), nullable=False)
+    op.drop_constraint('ActorsMovies_actor_id_fkey', 'ActorsMovies',
+                       type_='foreignkey')
+    op.drop_constraint('ActorsMovies_movie_id_fkey', 'ActorsMovies',
+                       type_='foreignkey')
+    op.create_foreign_key('ActorsMovies_actor_id_fkey', 'ActorsMovies',
+                          'Actor', ['actor_id'], ['id'], ondelete='CASCADE')
+    op.create_foreign_key('ActorsMovies_movie_id_fkey', 'ActorsMovies',
+                          'Movie', ['movie_id'], ['id'], ondelete='CASCADE')
+    op.create_primary_key('ActorsMovies_pkey', 'ActorsMovies',
+                          ['movie_id', 'actor_id'])
+    op.create_index('ix_ActorsMovies_actor_id_movie_id', 'ActorsMovies',
+                    ['actor_id', 'movie_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_ActorsMovies_actor_id_movie_id',
+                  table_name='ActorsMovies')
+    op.drop_constraint('ActorsMovies_pkey', 'ActorsMovies', type_='primary')
+    op.drop_constraint('ActorsMovies_movie_id_fkey', 'ActorsMovies',
+                       type_='foreignkey')
+    op.drop_constraint('ActorsMovies_actor_id_fkey', 'ActorsMovies',
+                       type_='foreignkey')
+    op.create_foreign_key('ActorsMovies_movie_id_fkey', 'ActorsMovies',
+                          'Movie', ['movie_id'], ['id'])
+    op.create_foreign_key('ActorsMovies_actor_id_fkey', 'ActorsMovies',
+                          'Actor', ['actor_id'], ['id'])
+    op.alter_column('ActorsMovies', 'movie_id',
+                    existing_type=sa.Integer(), nullable=True)
+    op.alter_column('ActorsMovies', 'actor_id',
+                    existing_type=sa.Integer(), nullable=True)
@@ -0,0 +1,49 @@
+"""StatsSummary and StatsContribution tables
+
+Revision ID: b4d2e81c6f37
+Revises: 7c1e5f0b9a24
+Create Date: 2026-10-18 16:27:13.504218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'b4d2e81c6f37'
+down_revision = '7c1e5f0b9a24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'StatsContribution',
+        sa.Column('table_name', sa.String(), nullable=False),
+        sa.Column('row_id', sa.Integer(), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=False),
+        sa.Column('release_year', sa.Integer(), nullable=True),
+        sa.Column('gender', postgresql.ENUM('male', 'female',
+                                            name='gendertype',
+                                            create_type=False),
+                  nullable=True),
+        sa.PrimaryKeyConstraint('table_name', 'row_id')
+    )
+    summary = op.create_table(
+        'StatsSummary',
+        sa.Column('metric', sa.String(), nullable=False),
+        sa.Column('bucket', sa.String(), nullable=False),
+        sa.Column('value', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('metric', 'bucket')
+    )
+    # The watermark row every refresh locks. 0 means never filled, which
+    # flask refresh-stats does.
+    op.bulk_insert(summary, [
+        {'metric': 'watermark', 'bucket': '', 'value': 0}
+    ])
+
+
+def downgrade():
+    op.drop_table('StatsSummary')
+    op.drop_table('StatsContribution')
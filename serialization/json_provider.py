@@ -0,0 +1,167 @@
+import abc
+import datetime
+import enum
+import json
+
+from flask import current_app
+from flask.json import JSONEncoder
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+_DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+           'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def format_date(value, date_format='http'):
+    """
+    format_date(value, date_format)
+        returns a date as an ISO 8601 string, or as the HTTP date Flask's
+        encoder has always produced. Plain dates skip werkzeug's
+        http_date, which costs more than encoding the rest of a row.
+    """
+    if date_format == 'iso':
+        return value.isoformat()
+    if type(value) is datetime.date:
+        return '%s, %02d %s %04d 00:00:00 GMT' % (
+            _DAYS[value.weekday()], value.day, _MONTHS[value.month - 1],
+            value.year)
+    return http_date(value)
+
+
+class Encoder(JSONEncoder):
+    """
+    Encoder
+    Flask's encoder plus enums, with dates written in date_format
+    """
+
+    date_format = 'http'
+
+    def default(self, o):
+        if isinstance(o, datetime.date):
+            return format_date(o, self.date_format)
+        if isinstance(o, enum.Enum):
+            return o.value
+        return super().default(o)
+
+
+class JSONProvider(abc.ABC):
+    """
+    JSONProvider
+    Encodes response bodies. Values that are not plain JSON types, such
+    as dates, enums and the tuples of column queries, are converted while
+    encoding, so rows can be handed over without being copied first.
+    """
+
+    name = None
+
+    def __init__(self, sort_keys=True, date_format='http'):
+        self.sort_keys = sort_keys
+        self.date_format = date_format
+        self.encoder = type('Encoder', (Encoder,),
+                            {'date_format': date_format})
+
+    @abc.abstractmethod
+    def dumps(self, obj, indent=False):
+        """
+        dumps(obj, indent)
+            returns obj encoded as JSON bytes
+        """
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def response(self, *args, **kwargs):
+        """
+        response(*args, **kwargs)
+            same contract as flask.jsonify
+        """
+        if args and kwargs:
+            raise TypeError('jsonify() behavior undefined when passed both '
+                            'args and kwargs')
+        data = args[0] if len(args) == 1 else args or kwargs
+        indent = current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] or \
+            current_app.debug
+        return current_app.response_class(
+            self.dumps(data, indent) + b'\n',
+            mimetype=current_app.config['JSONIFY_MIMETYPE'])
+
+
+class StdlibJSONProvider(JSONProvider):
+    name = 'stdlib'
+
+    def dumps(self, obj, indent=False):
+        return json.dumps(
+            obj, cls=self.encoder, sort_keys=self.sort_keys,
+            indent=2 if indent else None,
+            separators=(', ', ': ') if indent else (',', ':')
+        ).encode('utf-8')
+
+
+class OrjsonJSONProvider(JSONProvider):
+    name = 'orjson'
+
+    def __init__(self, sort_keys=True, date_format='http'):
+        super().__init__(sort_keys, date_format)
+        self.default = self.encoder().default
+        self.options = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            self.options |= orjson.OPT_SORT_KEYS
+        if date_format != 'iso':
+            self.options |= orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps(self, obj, indent=False):
+        options = self.options | orjson.OPT_INDENT_2 if indent \
+            else self.options
+        return orjson.dumps(obj, default=self.default,
+                            option=options)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+PROVIDERS = {
+    'stdlib': StdlibJSONProvider,
+    'orjson': OrjsonJSONProvider,
+}
+
+
+def provider_from_config(config):
+    """
+    provider_from_config(config)
+        builds the provider named by JSON_PROVIDER ('auto', 'orjson' or
+        'stdlib'); 'auto' uses orjson when it is installed. JSON_SORT_KEYS
+        and JSON_DATE_FORMAT ('http' or 'iso') shape the output.
+    """
+    name = config.get('JSON_PROVIDER', 'auto')
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'stdlib'
+    if name == 'orjson' and orjson is None:
+        raise RuntimeError('The orjson package is required for '
+                           'JSON_PROVIDER=orjson')
+    return PROVIDERS[name](
+        sort_keys=config.get('JSON_SORT_KEYS', True),
+        date_format=config.get('JSON_DATE_FORMAT', 'http'))
+
+
+def init_json(app):
+    provider = provider_from_config(app.config)
+    app.extensions['json_provider'] = provider
+    app.json_encoder = provider.encoder
+    return provider
+
+
+def jsonify(*args, **kwargs):
+    """
+    jsonify(*args, **kwargs)
+        drop-in for flask.jsonify that encodes with the app's provider
+    """
+    provider = current_app.extensions.get('json_provider')
+    if provider is None:
+        provider = current_app.extensions['json_provider'] = \
+            provider_from_config(current_app.config)
+    return provider.response(*args, **kwargs)
@@ -1,36 +1,119 @@
+import datetime
+import gzip
 import os
+import tempfile
+import time
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, g
+from sqlalchemy import event
+from sqlalchemy.pool import StaticPool
 
-from app import create_app
-from database.models import setup_db
+from benchmarks.auth_stub import AUDIENCE, DOMAIN, ROLES, generate_key, \
+    mint_token
+
+# Without real Auth0 tokens in the environment the suite runs offline:
+# tokens are signed with a throwaway key published in a local JWKS file.
+# This has to happen before auth.auth reads its settings on import.
+if "CASTING_ASSISTANT" not in os.environ:
+    _private_pem, _public_jwk = generate_key()
+    with tempfile.NamedTemporaryFile("w", suffix=".json",
+                                     delete=False) as _jwks:
+        json.dump({"keys": [_public_jwk]}, _jwks)
+    os.environ.update(AUTH_DOMAIN=DOMAIN, AUTH_API_AUDIENCE=AUDIENCE,
+                      AUTH_JWKS_URL=_jwks.name)
+    for _role, _variable in (("Casting Assistant", "CASTING_ASSISTANT"),
+                             ("Casting Director", "CASTING_DIRECTOR"),
+                             ("Executive Producer", "EXECUTIVE_PRODUCER")):
+        os.environ[_variable] = mint_token(_private_pem, ROLES[_role])
+
+from app import create_app  # noqa: E402
+from auth.jwks import JWKSKeyStore  # noqa: E402
+from auth.token_cache import VerifiedTokenCache  # noqa: E402
+from cache.backends import LRUBackend, RedisBackend  # noqa: E402
+from cache.response_cache import ResponseCache  # noqa: E402
+from database.graph import CastGraph  # noqa: E402
+from database.models import db, actors_movies, Actor, Movie, \
+    GenderType  # noqa: E402
+from database.pool import engine_options, TimedQueuePool  # noqa: E402
+from database.routing import ReplicaRouter  # noqa: E402
+from database.stats import compute_stats, MaterializedStats  # noqa: E402
+from database.testing import TestDatabase  # noqa: E402
+from middleware.profiler import StackSampler  # noqa: E402
+from serialization.json_provider import StdlibJSONProvider, \
+    OrjsonJSONProvider  # noqa: E402
+
+# An id no fixture row ever gets
+MISSING_ID = 2 ** 31 - 1
+
+_test_database = None
+
+
+def get_test_database():
+    """Create the test app and its schema once per process."""
+    global _test_database
+    if _test_database is None:
+        _test_database = TestDatabase(create_app("test"))
+    return _test_database
 
 
 class CastingAgencyTestCase(unittest.TestCase):
     """This class represents the casting agency test case"""
 
     def setUp(self):
-        """Define test variables and initialize app."""
-        self.app = create_app()
+        """Define test variables and start the test's transaction."""
+        self.database = get_test_database()
+        self.app = self.database.app
         self.client = self.app.test_client
-        self.database_path = os.environ['TEST_DATABASE_URL']
-        setup_db(self.app, self.database_path)
+        self.database.begin(seed=self.seed)
 
         self.casting_assistant_jwt = os.environ['CASTING_ASSISTANT']
         self.casting_director_jwt = os.environ['CASTING_DIRECTOR']
         self.executive_producer_jwt = os.environ['EXECUTIVE_PRODUCER']
 
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
-
     def tearDown(self):
-        """Executed after each test"""
-        pass
+        """Roll back everything the test wrote"""
+        self.database.end()
+
+    def seed(self, connection):
+        self.movie_ids = [connection.execute(Movie.__table__.insert().values(
+            title="Fixture Movie {}".format(index),
+            release_date=datetime.date(2020, 7, index + 1)
+        )).inserted_primary_key[0] for index in range(2)]
+        self.actor_ids = [connection.execute(Actor.__table__.insert().values(
+            name="Fixture Actor {}".format(index), age=30 + index,
+            gender=GenderType.male
+        )).inserted_primary_key[0] for index in range(2)]
+        connection.execute(actors_movies.insert(), [
+            {"movie_id": self.movie_ids[0], "actor_id": actor_id}
+            for actor_id in self.actor_ids])
+
+    def count_queries(self, path, jwt):
+        queries = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            queries.append(statement)
+
+        engine = db.engine
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            res = self.client().get(path, headers={
+                "Authorization": "Bearer {}".format(jwt)})
+        finally:
+            event.remove(engine, 'before_cursor_execute',
+                         before_cursor_execute)
+
+        self.assertEqual(res.status_code, 200)
+        return len(queries)
+
+    def add_cast(self, size):
+        with self.app.app_context():
+            actors = [Actor("Query Count", 30, GenderType.female)
+                      for _ in range(size)]
+            movie = Movie("Query Count", datetime.date(2020, 7, 20))
+            movie.actors = actors
+            movie.insert()
+            return movie.id, [actor.id for actor in actors]
 
     def test_get_all_movies(self):
         res = self.client().get("/movies", headers={
@@ -50,6 +133,238 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(data["success"], True)
         self.assertTrue(data["actors"])
 
+    def test_list_query_count_is_constant(self):
+        self.add_cast(1)
+        movies_before = self.count_queries("/movies?expand=actors.movies",
+                                           self.casting_assistant_jwt)
+        actors_before = self.count_queries("/actors?expand=movies",
+                                           self.casting_assistant_jwt)
+        self.add_cast(5)
+        movies_after = self.count_queries("/movies?expand=actors.movies",
+                                          self.casting_assistant_jwt)
+        actors_after = self.count_queries("/actors?expand=movies",
+                                          self.casting_assistant_jwt)
+
+        self.assertEqual(movies_before, movies_after)
+        self.assertEqual(actors_before, actors_after)
+
+    def test_get_movie_with_sparse_fields(self):
+        movie_id, actor_ids = self.add_cast(1)
+        headers = {
+            "Authorization": "Bearer {}".format(self.casting_assistant_jwt)}
+        sparse = self.client().get(
+            "/movies/{}?fields=title".format(movie_id), headers=headers)
+        expanded = self.client().get(
+            "/movies/{}?expand=actors".format(movie_id), headers=headers)
+
+        self.assertEqual(sparse.status_code, 200)
+        self.assertEqual(json.loads(sparse.data)["movie"],
+                         {"id": movie_id, "title": "Query Count"})
+        self.assertEqual(expanded.status_code, 200)
+        self.assertEqual(
+            [actor["id"] for actor in json.loads(expanded.data)["movie"]
+             ["actors"]], actor_ids)
+
+    def test_400_get_movies_with_unknown_field(self):
+        res = self.client().get("/movies?fields=id,budget", headers={
+            "Authorization": "Bearer {}".format(self.casting_assistant_jwt)})
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_get_movies_by_page(self):
+        self.add_cast(0)
+        self.add_cast(0)
+        headers = {
+            "Authorization": "Bearer {}".format(self.casting_assistant_jwt)}
+        res = self.client().get("/movies?limit=1", headers=headers)
+        first_page = json.loads(res.data)
+        res = self.client().get(
+            "/movies?limit=1&cursor={}".format(first_page["next_cursor"]),
+            headers=headers)
+        second_page = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(first_page["movies"]), 1)
+        self.assertEqual(len(second_page["movies"]), 1)
+        self.assertGreater(second_page["movies"][0]["id"],
+                           first_page["movies"][0]["id"])
+
+    def test_400_get_actors_with_invalid_cursor(self):
+        res = self.client().get("/actors?cursor=not-a-cursor", headers={
+            "Authorization": "Bearer {}".format(self.casting_assistant_jwt)})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["error"], 400)
+
+    def test_get_all_movies_is_cached_until_write(self):
+        headers = {
+            "Authorization": "Bearer {}".format(self.casting_assistant_jwt)}
+        first = self.client().get("/movies", headers=headers)
+        second = self.client().get("/movies", headers=headers)
+        self.add_cast(1)
+        third = self.client().get("/movies", headers=headers)
+
+        self.assertEqual(first.headers["X-Cache"], "MISS")
+        self.assertEqual(second.headers["X-Cache"], "HIT")
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(third.headers["X-Cache"], "MISS")
+
+    def test_304_get_all_movies_not_modified(self):
+        headers = {
+            "Authorization": "Bearer {}".format(self.casting_assistant_jwt)}
+        res = self.client().get("/movies", headers=headers)
+        etag = res.headers["ETag"]
+        # The ETag names the data, not the cache generation, and is
+        # checked before the view runs: the stamp is the only query.
+        self.app.extensions["response_cache"].invalidate()
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            if statement.startswith("SELECT"):
+                statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute',
+                     before_cursor_execute)
+        try:
+            not_modified = self.client().get("/movies", headers=dict(
+                headers, **{"If-None-Match": etag}))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute',
+                         before_cursor_execute)
+        self.add_cast(1)
+        modified = self.client().get("/movies", headers=dict(
+            headers, **{"If-None-Match": etag}))
+
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(len(statements), 1)
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertEqual(not_modified.headers["ETag"], etag)
+        self.assertIn("Accept-Encoding", not_modified.headers["Vary"])
+        self.assertEqual(not_modified.headers["Cache-Control"],
+                         "private, no-cache")
+        self.assertEqual(not_modified.data, b"")
+        self.assertEqual(modified.status_code, 200)
+        self.assertNotEqual(modified.headers["ETag"], etag)
+
+    def test_get_all_movies_gzip_is_cached_compressed(self):
+        self.add_cast(30)
+        headers = {
+            "Authorization": "Bearer {}".format(self.casting_assistant_jwt)}
+        plain = self.client().get("/movies?expand=actors", headers=headers)
+        headers["Accept-Encoding"] = "gzip"
+        first = self.client().get("/movies?expand=actors", headers=headers)
+        second = self.client().get("/movies?expand=actors", headers=headers)
+        small = self.client().get("/movies?limit=1&fields=id",
+                                  headers=headers)
+        not_modified = self.client().get("/movies?expand=actors", headers=dict(
+            headers, **{"If-None-Match": first.headers["ETag"]}))
+
+        self.assertEqual(first.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", first.headers["Vary"])
+        self.assertTrue(first.headers["ETag"].startswith('W/"'))
+        self.assertEqual(gzip.decompress(first.data), plain.data)
+        self.assertEqual(second.headers["X-Cache"], "HIT")
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.headers["ETag"], first.headers["ETag"])
+        self.assertNotIn("Content-Encoding", small.headers)
+        self.assertIn("Accept-Encoding", small.headers["Vary"])
+
+    def test_export_movies_gzip_stream(self):
+        res = self.client().get("/export/movies", headers={
+            "Authorization": "Bearer {}".format(self.casting_assistant_jwt),
+            "Accept-Encoding": "gzip"})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers["Content-Encoding"], "gzip")
+        self.assertNotIn("Content-Length", res.headers)
+        gzip.decompress(res.data)
+
+    def test_get_metrics_in_prometheus_format(self):
+        self.client().get("/movies", headers={
+            "Authorization": "Bearer {}".format(self.casting_assistant_jwt)})
+        res = self.client().get("/metrics")
+        text = res.get_data(as_text=True)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, "text/plain")
+        self.assertIn("# TYPE http_request_duration_seconds histogram", text)
+        self.assertIn('http_request_duration_seconds_count{method="GET",'
+                      'route="/movies",status="200"}', text)
+        self.assertIn('http_request_db_queries_bucket{method="GET",'
+                      'route="/movies",le="+Inf"}', text)
+        self.assertIn("token_cache_lookups_total{result=", text)
+
+    def test_export_movies_as_ndjson(self):
+        movie_id, actor_ids = self.add_cast(2)
+        res = self.client().get("/export/movies", headers={
+            "Authorization": "Bearer {}".format(self.casting_assistant_jwt)})
+        rows = [json.loads(line) for line in
+                res.get_data(as_text=True).splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, "application/x-ndjson")
+        exported = [row for row in rows if row["id"] == movie_id][0]
+        self.assertEqual(exported["actors"], sorted(actor_ids))
+        self.assertEqual(exported["release_date"], "2020-07-20")
+
+    def test_export_actors_as_csv(self):
+        res = self.client().get("/export/actors?format=csv", headers={
+            "Authorization": "Bearer {}".format(self.casting_assistant_jwt)})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, "text/csv")
+        self.assertEqual(res.get_data(as_text=True).splitlines()[0],
+                         "id,name,age,gender,movies")
+
+    def test_database_health(self):
+        res = self.client().get("/health/db")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertIn("class", data["pool"])
+
+    def test_search_actors_not_in_movie(self):
+        movie_id, actor_ids = self.add_cast(2)
+        other_movie_id, other_actor_ids = self.add_cast(0)
+        headers = {
+            "Authorization": "Bearer {}".format(self.casting_assistant_jwt)}
+        path = "/actors?gender=female&age_min=25&age_max=35" \
+            "&limit=1000&not_in_movie={}"
+        res = self.client().get(path.format(movie_id), headers=headers)
+        excluded = {actor["id"] for actor in json.loads(res.data)["actors"]}
+        res = self.client().get(path.format(other_movie_id), headers=headers)
+        included = {actor["id"] for actor in json.loads(res.data)["actors"]}
+
+        self.assertEqual(res.status_code, 200)
+        self.assertFalse(excluded & set(actor_ids))
+        self.assertTrue(set(actor_ids) <= included)
+
+    def test_search_movies_by_title_prefix_and_release_date(self):
+        movie_id, actor_ids = self.add_cast(0)
+        res = self.client().get(
+            "/movies?title_prefix=query%20co&released_after=2020-07-20"
+            "&released_before=2020-07-20&limit=1000",
+            headers={"Authorization": "Bearer {}".format(
+                self.casting_assistant_jwt)})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(movie_id, [movie["id"] for movie in data["movies"]])
+        self.assertTrue(all(movie["title"].lower().startswith("query co")
+                            for movie in data["movies"]))
+
+    def test_400_search_actors_with_invalid_gender(self):
+        res = self.client().get("/actors?gender=unknown", headers={
+            "Authorization": "Bearer {}".format(self.casting_assistant_jwt)})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data["success"], False)
+
     def test_add_movie(self):
         res = self.client().post("/movies", json={
             "title": "My Life",
@@ -117,8 +432,69 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(data["success"], False)
         self.assertEqual(data["error"], 400)
 
+    def test_add_movies_in_bulk(self):
+        res = self.client().post("/movies/bulk", json=[
+            {"title": "My Life", "release_date": "07.20.2020"},
+            {"title": "My Life 2", "release_date": "2021-07-20"}
+        ], headers={
+            "Authorization": "Bearer {}".format(self.executive_producer_jwt)
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(data["success"], True)
+        self.assertEqual([movie["title"] for movie in data["created"]],
+                         ["My Life", "My Life 2"])
+        self.assertEqual(data["errors"], [])
+
+    def test_400_add_movies_in_bulk_over_max_bulk_size(self):
+        self.app.config["MAX_BULK_SIZE"] = 1
+        try:
+            res = self.client().post("/movies/bulk", json=[
+                {"title": "My Life", "release_date": "07.20.2020"},
+                {"title": "My Life 2", "release_date": "2021-07-20"}
+            ], headers={
+                "Authorization": "Bearer {}".format(
+                    self.executive_producer_jwt)
+            })
+        finally:
+            self.app.config["MAX_BULK_SIZE"] = 500
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_422_add_actors_in_bulk_with_invalid_item(self):
+        res = self.client().post("/actors/bulk", json={"actors": [
+            {"name": "My Life", "age": 27, "gender": "male"},
+            {"name": "My Life", "age": 27, "gender": "unknown"}
+        ]}, headers={
+            "Authorization": "Bearer {}".format(self.casting_director_jwt)
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["errors"][0]["index"], 1)
+
+    def test_add_actors_in_bulk_partially(self):
+        res = self.client().post("/actors/bulk?partial=true", json=[
+            {"name": "My Life", "age": 27, "gender": "male"},
+            {"name": "My Life", "gender": "female"}
+        ], headers={
+            "Authorization": "Bearer {}".format(self.casting_director_jwt)
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(len(data["created"]), 1)
+        self.assertEqual(data["created"][0]["version"], 1)
+        self.assertEqual(data["created"][0]["movies"], [])
+        self.assertEqual(data["errors"][0]["index"], 1)
+        self.assertIn("age", data["errors"][0]["errors"])
+
     def test_update_movie(self):
-        res = self.client().patch("/movies/4", json={
+        path = "/movies/{}".format(self.movie_ids[0])
+        res = self.client().patch(path, json={
             "title": "My Life is Over",
         }, headers={
             "Authorization": "Bearer {}".format(self.casting_director_jwt)
@@ -129,8 +505,209 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(data["success"], True)
         self.assertTrue(data["updated"])
 
+    def test_update_movie_cast(self):
+        movie_id, actor_ids = self.add_cast(3)
+        res = self.client().patch("/movies/{}".format(movie_id), json={
+            "actors": actor_ids[:1],
+        }, headers={
+            "Authorization": "Bearer {}".format(self.casting_director_jwt)
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual([actor["id"] for actor in data["updated"]["actors"]],
+                         actor_ids[:1])
+
+    def test_404_update_movie_cast_with_missing_actors(self):
+        movie_id, actor_ids = self.add_cast(1)
+        res = self.client().patch("/movies/{}".format(movie_id), json={
+            "actors": actor_ids + [100000, 100001],
+        }, headers={
+            "Authorization": "Bearer {}".format(self.casting_director_jwt)
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["missing_actors"], [100000, 100001])
+
+    def test_link_and_unlink_movie_actors(self):
+        path = "/movies/{}/actors".format(self.movie_ids[1])
+        headers = {
+            "Authorization": "Bearer {}".format(self.casting_director_jwt)}
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute',
+                     before_cursor_execute)
+        try:
+            res = self.client().post(path, json={
+                "actors": self.actor_ids + self.actor_ids[:1]},
+                headers=headers)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute',
+                         before_cursor_execute)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual((data["linked"], data["cast_size"]), (2, 2))
+        self.assertEqual(len([statement for statement in statements
+                              if 'INSERT INTO "ActorsMovies"' in statement]),
+                         1)
+        version = data["version"]
+
+        # Relinking changes nothing, so the movie keeps its version.
+        res = self.client().post(path, json={
+            "actors": self.actor_ids[:1]}, headers=headers)
+        data = json.loads(res.data)
+        self.assertEqual((data["linked"], data["cast_size"]), (0, 2))
+        self.assertEqual(data["version"], version)
+
+        res = self.client().delete(path, json={
+            "actors": [self.actor_ids[1], MISSING_ID]}, headers=headers)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual((data["unlinked"], data["cast_size"]), (1, 1))
+
+    def test_412_stale_version_after_linking_actors(self):
+        path = "/movies/{}".format(self.movie_ids[1])
+        auth = "Bearer {}".format(self.casting_director_jwt)
+        linked = self.client().post(path + "/actors", json={
+            "actors": self.actor_ids}, headers={
+            "Authorization": auth, "If-Match": '"1"'})
+        stale_patch = self.client().patch(path, json={
+            "title": "Stale"}, headers={
+            "Authorization": auth, "If-Match": '"1"'})
+        stale_unlink = self.client().delete(path + "/actors", json={
+            "actors": self.actor_ids[:1]}, headers={
+            "Authorization": auth, "If-Match": '"1"'})
+        unlinked = self.client().delete(path + "/actors", json={
+            "actors": self.actor_ids[:1]}, headers={
+            "Authorization": auth, "If-Match": linked.headers["ETag"]})
+        stale_link = self.client().post(path + "/actors", json={
+            "actors": self.actor_ids[:1]}, headers={
+            "Authorization": auth, "If-Match": linked.headers["ETag"]})
+
+        self.assertEqual(linked.status_code, 200)
+        self.assertEqual(linked.headers["ETag"], '"2"')
+        self.assertEqual(json.loads(linked.data)["version"], 2)
+        self.assertEqual(stale_patch.status_code, 412)
+        self.assertEqual(stale_unlink.status_code, 412)
+        self.assertEqual(unlinked.status_code, 200)
+        self.assertEqual(unlinked.headers["ETag"], '"3"')
+        self.assertEqual(stale_link.status_code, 412)
+        self.assertEqual(json.loads(unlinked.data)["cast_size"], 1)
+
+    def test_404_link_missing_actors(self):
+        path = "/movies/{}/actors".format(self.movie_ids[1])
+        res = self.client().post(path, json={
+            "actors": [self.actor_ids[0], MISSING_ID],
+        }, headers={
+            "Authorization": "Bearer {}".format(self.casting_director_jwt)
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data["missing_actors"], [MISSING_ID])
+
+    def test_422_unlink_actors_with_invalid_ids(self):
+        path = "/movies/{}/actors".format(self.movie_ids[0])
+        res = self.client().delete(path, json={
+            "actors": ["one"],
+        }, headers={
+            "Authorization": "Bearer {}".format(self.casting_director_jwt)
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+        self.assertIn("actors", data["errors"])
+
+    def test_422_link_actors_without_actors(self):
+        path = "/movies/{}/actors".format(self.movie_ids[0])
+        res = self.client().post(path, json={}, headers={
+            "Authorization": "Bearer {}".format(self.casting_director_jwt)
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["errors"]["actors"], "Actors is required.")
+
+    def test_update_movie_with_matching_version(self):
+        movie_id, actor_ids = self.add_cast(0)
+        headers = {
+            "Authorization": "Bearer {}".format(self.casting_director_jwt),
+            "If-Match": '"1"'
+        }
+        res = self.client().patch("/movies/{}".format(movie_id), json={
+            "title": "My Life is Over",
+        }, headers=headers)
+        data = json.loads(res.data)
+        stale = self.client().patch("/movies/{}".format(movie_id), json={
+            "title": "My Life is Not Over",
+        }, headers=headers)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["updated"]["title"], "My Life is Over")
+        self.assertEqual(data["updated"]["version"], 2)
+        self.assertEqual(res.headers["ETag"], '"2"')
+        self.assertEqual(stale.status_code, 412)
+        self.assertEqual(json.loads(stale.data)["error"], 412)
+
+    def test_update_actor_with_etag_from_get(self):
+        path = "/actors/{}".format(self.actor_ids[0])
+        auth = "Bearer {}".format(self.casting_director_jwt)
+        res = self.client().get(path, headers={"Authorization": auth})
+        etag = res.headers["ETag"]
+        updated = self.client().patch(path, json={"age": 36}, headers={
+            "Authorization": auth, "If-Match": '"7", ' + etag})
+        stale = self.client().patch(path, json={"age": 37}, headers={
+            "Authorization": auth, "If-Match": "W/" + etag})
+        expanded = self.client().get(path + "?expand=movies",
+                                     headers={"Authorization": auth})
+
+        self.assertEqual(etag, '"1"')
+        self.assertEqual(updated.status_code, 200)
+        self.assertEqual(updated.headers["ETag"], '"2"')
+        self.assertEqual(stale.status_code, 412)
+        self.assertTrue(expanded.headers["ETag"].startswith('"2-'))
+
+    def test_update_actor_with_etag_from_compressed_get(self):
+        path = "/actors/{}".format(self.actor_ids[0])
+        auth = "Bearer {}".format(self.casting_director_jwt)
+        compressor = self.app.extensions["compressor"]
+        min_size, compressor.min_size = compressor.min_size, 0
+        try:
+            res = self.client().get(path + "?expand=movies", headers={
+                "Authorization": auth, "Accept-Encoding": "gzip"})
+        finally:
+            compressor.min_size = min_size
+        etag = res.headers["ETag"]
+        updated = self.client().patch(path, json={"age": 36}, headers={
+            "Authorization": auth, "If-Match": etag})
+
+        self.assertEqual(res.headers["Content-Encoding"], "gzip")
+        self.assertTrue(etag.startswith('W/"1-'))
+        self.assertEqual(updated.status_code, 200)
+
+    def test_422_update_actor_with_invalid_gender(self):
+        path = "/actors/{}".format(self.actor_ids[0])
+        res = self.client().patch(path, json={
+            "gender": "unknown",
+        }, headers={
+            "Authorization": "Bearer {}".format(self.casting_director_jwt)
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+        self.assertIn("gender", data["errors"])
+
     def test_404_update_movie_which_does_not_exist(self):
-        res = self.client().patch("/movies/1000", json={
+        res = self.client().patch("/movies/{}".format(MISSING_ID), json={
             "title": "My Life is Over",
         }, headers={
             "Authorization": "Bearer {}".format(self.casting_director_jwt)
@@ -142,7 +719,8 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(data["error"], 404)
 
     def test_update_actor(self):
-        res = self.client().patch("/actors/3", json={
+        path = "/actors/{}".format(self.actor_ids[0])
+        res = self.client().patch(path, json={
             "age": 35,
         }, headers={
             "Authorization": "Bearer {}".format(self.casting_director_jwt)
@@ -154,7 +732,7 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertTrue(data["updated"])
 
     def test_404_update_actor_which_does_not_exist(self):
-        res = self.client().patch("/actors/1000", json={
+        res = self.client().patch("/actors/{}".format(MISSING_ID), json={
             "age": 35,
         }, headers={
             "Authorization": "Bearer {}".format(self.casting_director_jwt)
@@ -166,7 +744,8 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(data["error"], 404)
 
     def test_401_unauthorized_delete_movie(self):
-        res = self.client().delete("/movies/1", headers={
+        path = "/movies/{}".format(self.movie_ids[0])
+        res = self.client().delete(path, headers={
             "Authorization": "Bearer {}".format(self.casting_director_jwt)
         })
         data = json.loads(res.data)
@@ -177,7 +756,8 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertTrue(data["message"])
 
     def test_delete_movie(self):
-        res = self.client().delete("/movies/2", headers={
+        path = "/movies/{}".format(self.movie_ids[1])
+        res = self.client().delete(path, headers={
             "Authorization": "Bearer {}".format(self.executive_producer_jwt)
         })
         data = json.loads(res.data)
@@ -187,7 +767,8 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertTrue(data["deleted"])
 
     def test_404_delete_movie_which_does_not_exist(self):
-        res = self.client().delete("/movies/1", headers={
+        path = "/movies/{}".format(MISSING_ID)
+        res = self.client().delete(path, headers={
             "Authorization": "Bearer {}".format(self.executive_producer_jwt)
         })
         data = json.loads(res.data)
@@ -197,7 +778,11 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(data["error"], 404)
 
     def test_delete_actor(self):
-        res = self.client().delete("/actors/2", headers={
+        path = "/actors/{}".format(self.actor_ids[1])
+        self.client().get(path, headers={
+            "Authorization": "Bearer {}".format(self.executive_producer_jwt)
+        })
+        res = self.client().delete(path, headers={
             "Authorization": "Bearer {}".format(self.executive_producer_jwt)
         })
         data = json.loads(res.data)
@@ -205,9 +790,12 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data["success"], True)
         self.assertTrue(data["deleted"])
+        # Nothing the GET left in g may reach the next request.
+        self.assertNotIn("ETag", res.headers)
 
     def test_404_delete_actor_which_does_not_exist(self):
-        res = self.client().delete("/actors/1", headers={
+        path = "/actors/{}".format(MISSING_ID)
+        res = self.client().delete(path, headers={
             "Authorization": "Bearer {}".format(self.executive_producer_jwt)
         })
         data = json.loads(res.data)
@@ -216,6 +804,491 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(data["success"], False)
         self.assertEqual(data["error"], 404)
 
+    def test_get_costars_follows_cast_changes(self):
+        path = "/actors/{}/costars".format(self.actor_ids[0])
+        headers = {
+            "Authorization": "Bearer {}".format(self.casting_assistant_jwt)}
+        data = json.loads(self.client().get(path, headers=headers).data)
+        self.assertEqual(
+            [(actor["id"], actor["shared_movies"])
+             for actor in data["costars"]], [(self.actor_ids[1], 1)])
+
+        movie_id, actor_ids = self.add_cast(1)
+        res = self.client().patch("/movies/{}".format(movie_id), json={
+            "actors": actor_ids + self.actor_ids,
+        }, headers={
+            "Authorization": "Bearer {}".format(self.casting_director_jwt)
+        })
+        self.assertEqual(res.status_code, 200)
+
+        data = json.loads(self.client().get(path, headers=headers).data)
+        self.assertEqual(
+            [(actor["id"], actor["shared_movies"])
+             for actor in data["costars"]],
+            [(self.actor_ids[1], 2), (actor_ids[0], 1)])
+        self.assertEqual(data["total"], 2)
+
+    def test_get_costars_rejects_cursor(self):
+        res = self.client().get(
+            "/actors/{}/costars?cursor=eyJpZCI6IDF9".format(
+                self.actor_ids[0]),
+            headers={"Authorization": "Bearer {}".format(
+                self.casting_assistant_jwt)})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data["success"], False)
+
+    def test_get_collaboration_path(self):
+        movie_id, actor_ids = self.add_cast(1)
+        res = self.client().patch("/movies/{}".format(movie_id), json={
+            "actors": actor_ids + self.actor_ids[1:],
+        }, headers={
+            "Authorization": "Bearer {}".format(self.casting_director_jwt)
+        })
+        self.assertEqual(res.status_code, 200)
+
+        path = "/actors/{}/path/{}".format(self.actor_ids[0], actor_ids[0])
+        res = self.client().get(path, headers={
+            "Authorization": "Bearer {}".format(self.casting_assistant_jwt)})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["degrees"], 2)
+        self.assertEqual([actor["id"] for actor in data["actors"]],
+                         [self.actor_ids[0], self.actor_ids[1], actor_ids[0]])
+        self.assertEqual([movie["id"] for movie in data["movies"]],
+                         [self.movie_ids[0], movie_id])
+
+    def test_404_collaboration_path_to_missing_actor(self):
+        path = "/actors/{}/path/{}".format(self.actor_ids[0], MISSING_ID)
+        res = self.client().get(path, headers={
+            "Authorization": "Bearer {}".format(self.casting_assistant_jwt)})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data["success"], False)
+
+    def get_stats(self):
+        res = self.client().get("/stats", headers={
+            "Authorization": "Bearer {}".format(self.casting_assistant_jwt)})
+        self.assertEqual(res.status_code, 200)
+        return json.loads(res.data)
+
+    @unittest.skipUnless("_private_pem" in globals(), "needs the local key")
+    def test_401_get_stats_without_every_permission(self):
+        token = mint_token(_private_pem, ("read:movies",))
+        res = self.client().get("/stats", headers={
+            "Authorization": "Bearer {}".format(token)})
+
+        self.assertEqual(res.status_code, 401)
+
+    @unittest.skipUnless("_private_pem" in globals(), "needs the local key")
+    def test_get_profiles_requires_read_metrics(self):
+        anonymous = self.client().get("/metrics/profiles")
+        assistant = self.client().get("/metrics/profiles", headers={
+            "Authorization": "Bearer {}".format(self.casting_assistant_jwt)})
+        token = mint_token(_private_pem, ("read:metrics",))
+        res = self.client().get("/metrics/profiles", headers={
+            "Authorization": "Bearer {}".format(token)})
+
+        self.assertEqual(anonymous.status_code, 401)
+        self.assertEqual(assistant.status_code, 401)
+        self.assertEqual(res.status_code, 200)
+        self.assertIn("profiles", json.loads(res.data))
+
+    @unittest.skipUnless("_private_pem" in globals(), "needs the local key")
+    def test_get_pool_metrics_requires_read_metrics(self):
+        anonymous = self.client().get("/metrics/pool")
+        token = mint_token(_private_pem, ("read:metrics",))
+        res = self.client().get("/metrics/pool", headers={
+            "Authorization": "Bearer {}".format(token)})
+
+        self.assertEqual(anonymous.status_code, 401)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data)["replicas"], [])
+
+    def test_get_stats_is_refreshed_after_write(self):
+        before = self.get_stats()
+        totals = before["totals"]
+        self.assertEqual(totals["links"], sum(
+            item["actors"] * item["movies"] for item in before["cast_sizes"]))
+        self.assertEqual(totals["actors"], sum(before["genders"].values()))
+
+        self.add_cast(3)
+        after = self.get_stats()
+        self.assertEqual(after["totals"], dict(
+            totals, movies=totals["movies"] + 1, actors=totals["actors"] + 3,
+            links=totals["links"] + 3))
+        self.assertEqual(after["genders"]["female"],
+                         before["genders"]["female"] + 3)
+
+    def test_stats_summary_matches_group_by_queries(self):
+        summary = MaterializedStats(refresh_seconds=0, settle_seconds=0)
+        self.assertFalse(summary.refresh())
+        self.assertEqual(summary.read(), compute_stats())
+        self.assertTrue(summary.refresh(fill=True))
+        self.assertEqual(summary.read(), compute_stats())
+
+        movie_id, actor_ids = self.add_cast(3)
+        res = self.client().patch("/movies/{}".format(movie_id), json={
+            "actors": actor_ids[:1] + self.actor_ids,
+        }, headers={
+            "Authorization": "Bearer {}".format(self.casting_director_jwt)
+        })
+        self.assertEqual(res.status_code, 200)
+        res = self.client().delete(
+            "/movies/{}".format(self.movie_ids[0]), headers={
+                "Authorization": "Bearer {}".format(
+                    self.executive_producer_jwt)})
+        self.assertEqual(res.status_code, 200)
+
+        stats = compute_stats()
+        self.assertEqual(summary.read(), stats)
+        self.assertIn({"actors": 3, "movies": 1}, stats["cast_sizes"])
+
+    def test_refresh_stats_command_fills_the_summary(self):
+        runner = self.app.test_cli_runner()
+        disabled = runner.invoke(args=["refresh-stats"])
+
+        summary = MaterializedStats(refresh_seconds=0, settle_seconds=0)
+        self.app.extensions["stats_summary"] = summary
+        try:
+            result = runner.invoke(args=["refresh-stats"])
+        finally:
+            del self.app.extensions["stats_summary"]
+
+        self.assertEqual(disabled.exit_code, 1)
+        self.assertIn("STATS_SUMMARY_ENABLED is off", disabled.output)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertTrue(summary.refresh())
+        self.assertEqual(summary.read(), compute_stats())
+
+    def get_changes(self, since=None):
+        path = "/changes" if since is None else \
+            "/changes?since={}".format(since)
+        res = self.client().get(path, headers={
+            "Authorization": "Bearer {}".format(self.casting_assistant_jwt)})
+        self.assertEqual(res.status_code, 200)
+        return json.loads(res.data)
+
+    def test_changes_since_token(self):
+        data = self.get_changes()
+        self.assertEqual({movie["id"] for movie in data["movies"]},
+                         set(self.movie_ids))
+        self.assertEqual(data["movies"][0]["actors"], self.actor_ids)
+
+        res = self.client().patch(
+            "/movies/{}".format(self.movie_ids[1]),
+            json={"title": "Changed"}, headers={
+                "Authorization": "Bearer {}".format(
+                    self.casting_director_jwt)})
+        self.assertEqual(res.status_code, 200)
+        res = self.client().delete(
+            "/actors/{}".format(self.actor_ids[1]), headers={
+                "Authorization": "Bearer {}".format(
+                    self.executive_producer_jwt)})
+        self.assertEqual(res.status_code, 200)
+
+        changes = self.get_changes(data["next"])
+        self.assertEqual(
+            [(movie["id"], movie["title"], movie["actors"])
+             for movie in changes["movies"]],
+            [(self.movie_ids[1], "Changed", []),
+             (self.movie_ids[0], "Fixture Movie 0", [self.actor_ids[0]])])
+        self.assertEqual(changes["actors"], [])
+        self.assertEqual(changes["deleted"],
+                         {"movies": [], "actors": [self.actor_ids[1]]})
+        self.assertFalse(changes["has_more"])
+
+        latest = self.get_changes(changes["next"])
+        self.assertEqual((latest["movies"], latest["actors"]), ([], []))
+        self.assertEqual(latest["next"], changes["next"])
+
+    def test_400_changes_with_invalid_token(self):
+        res = self.client().get("/changes?since=not-a-token", headers={
+            "Authorization": "Bearer {}".format(self.casting_assistant_jwt)})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data["success"], False)
+
+
+class AppProfileTestCase(unittest.TestCase):
+    """This class represents the app factory profiles test case"""
+
+    def test_profiles_control_debug_and_caching(self):
+        production = create_app("production", DATABASE_URL="sqlite://")
+        development = create_app("development", DATABASE_URL="sqlite://")
+
+        self.assertFalse(production.debug)
+        self.assertTrue(development.debug)
+        self.assertTrue(production.extensions["response_cache"].enabled)
+        self.assertFalse(development.extensions["response_cache"].enabled)
+
+    def test_unknown_profile(self):
+        with self.assertRaises(ValueError):
+            create_app("staging")
+
+
+class JWKSKeyStoreTestCase(unittest.TestCase):
+    """This class represents the JWKS key store test case"""
+
+    def setUp(self):
+        self.jwks_file = tempfile.NamedTemporaryFile(
+            'w', suffix='.json', delete=False)
+        self.write_keys('key-1')
+        self.store = JWKSKeyStore(self.jwks_file.name, ttl=600,
+                                  min_refetch_interval=0)
+
+    def tearDown(self):
+        os.unlink(self.jwks_file.name)
+
+    def write_keys(self, *kids):
+        with open(self.jwks_file.name, 'w') as jwks_file:
+            json.dump({'keys': [{
+                'kty': 'RSA', 'kid': kid, 'use': 'sig', 'n': 'n', 'e': 'AQAB'
+            } for kid in kids]}, jwks_file)
+
+    def test_get_key_is_served_from_memory(self):
+        self.assertEqual(self.store.get_key('key-1')['kid'], 'key-1')
+        os.unlink(self.jwks_file.name)
+        self.assertEqual(self.store.get_key('key-1')['kid'], 'key-1')
+        self.write_keys('key-1')
+
+    def test_unknown_kid_forces_refetch(self):
+        self.store.get_key('key-1')
+        self.write_keys('key-1', 'key-2')
+        self.assertEqual(self.store.get_key('key-2')['kid'], 'key-2')
+
+    def test_unknown_kid_refetch_is_rate_limited(self):
+        self.store.min_refetch_interval = 600
+        self.assertIsNone(self.store.get_key('key-2'))
+        self.write_keys('key-1', 'key-2')
+        self.assertIsNone(self.store.get_key('key-2'))
+
+
+class VerifiedTokenCacheTestCase(unittest.TestCase):
+    """This class represents the verified token cache test case"""
+
+    def setUp(self):
+        self.cache = VerifiedTokenCache(maxsize=2)
+        self.payload = {'exp': time.time() + 60, 'permissions': []}
+
+    def test_hit_after_set(self):
+        self.assertIsNone(self.cache.get('token'))
+        self.cache.set('token', self.payload)
+
+        self.assertEqual(self.cache.get('token'), self.payload)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_expired_token_is_evicted(self):
+        self.cache.set('token', {'exp': time.time() - 1})
+
+        self.assertIsNone(self.cache.get('token'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_least_recently_used_token_is_evicted(self):
+        self.cache.set('first', self.payload)
+        self.cache.set('second', self.payload)
+        self.cache.get('first')
+        self.cache.set('third', self.payload)
+
+        self.assertIsNone(self.cache.get('second'))
+        self.assertEqual(self.cache.get('first'), self.payload)
+
+
+class CacheBackendTestCase(unittest.TestCase):
+    """This class represents the response cache backends test case"""
+
+    def test_lru_backend_evicts_least_recently_used(self):
+        backend = LRUBackend(maxsize=1, ttl=60)
+        backend.set("first", 1)
+        backend.set("second", 2)
+
+        self.assertIsNone(backend.get("first"))
+        self.assertEqual(backend.get("second"), 2)
+
+    def test_local_redis_backend_round_trip(self):
+        backend = RedisBackend.from_url("local://", ttl=60)
+        backend.set("key", {"body": b"{}"})
+
+        self.assertEqual(backend.get("key"), {"body": b"{}"})
+        self.assertEqual(backend.counter("generation"), 0)
+        self.assertEqual(backend.incr("generation"), 1)
+        self.assertEqual(backend.counter("generation"), 1)
+
+    def test_response_flagged_skip_cache_store_is_not_cached(self):
+        app = Flask(__name__)
+        response_cache = ResponseCache()
+        calls = []
+
+        @app.route("/")
+        @response_cache.cached
+        def index():
+            calls.append(len(calls))
+            g.skip_cache_store = len(calls) == 1
+            return {"calls": len(calls)}
+
+        client = app.test_client()
+        results = [client.get("/").headers["X-Cache"] for _ in range(3)]
+
+        self.assertEqual(results, ["MISS", "MISS", "HIT"])
+        self.assertEqual(len(calls), 2)
+
+
+class JSONProviderTestCase(unittest.TestCase):
+    """This class represents the JSON providers test case"""
+
+    payload = {
+        "movies": [(1, "My Life", datetime.date(2020, 7, 20))],
+        "gender": GenderType.female
+    }
+
+    def test_providers_encode_dates_like_flask(self):
+        for provider in (StdlibJSONProvider(), OrjsonJSONProvider()):
+            data = json.loads(provider.dumps(self.payload))
+
+            self.assertEqual(data["movies"],
+                             [[1, "My Life", "Mon, 20 Jul 2020 00:00:00 GMT"]])
+            self.assertEqual(data["gender"], "female")
+
+    def test_providers_encode_iso_dates(self):
+        for provider in (StdlibJSONProvider(date_format="iso"),
+                         OrjsonJSONProvider(date_format="iso")):
+            data = json.loads(provider.dumps(self.payload))
+
+            self.assertEqual(data["movies"][0][2], "2020-07-20")
+
+
+class CastGraphTestCase(unittest.TestCase):
+    """Shortest paths and incremental updates of the co-star graph"""
+
+    def setUp(self):
+        # (movie, actor) links: actors 1-2-3-4 are chained through movies
+        # 10, 11 and 12, actor 5 only played in movie 20.
+        self.graph = CastGraph([(10, 1), (10, 2), (11, 2), (11, 3),
+                                (12, 3), (12, 4), (20, 5)])
+
+    def test_shortest_path(self):
+        self.assertEqual(self.graph.shortest_path(1, 4),
+                         ([1, 2, 3, 4], [10, 11, 12]))
+        self.assertEqual(self.graph.shortest_path(4, 1),
+                         ([4, 3, 2, 1], [12, 11, 10]))
+        self.assertEqual(self.graph.shortest_path(2, 2), ([2], []))
+        self.assertIsNone(self.graph.shortest_path(1, 5))
+        self.assertIsNone(self.graph.shortest_path(1, 99))
+
+    def test_set_cast_updates_paths_and_costars(self):
+        self.graph.set_cast(13, [1, 4])
+        self.assertEqual(self.graph.shortest_path(1, 4), ([1, 4], [13]))
+        self.assertEqual(self.graph.costars(1), [(2, 1), (4, 1)])
+
+        self.graph.set_cast(10, [2])
+        self.graph.remove_movie(13)
+        self.assertIsNone(self.graph.shortest_path(1, 4))
+        self.assertNotIn(1, self.graph.movies_of)
+        self.assertEqual(len(self.graph), 6)
+
+
+class StackSamplerTestCase(unittest.TestCase):
+    """This class represents the slow request profiler test case"""
+
+    def test_keeps_only_slow_request_profiles(self):
+        sampler = StackSampler(slow_seconds=0.05, interval=0.001)
+        sampler.begin()
+        time.sleep(0.1)
+        slow = sampler.end(0.1, "GET", "/movies")
+        sampler.begin()
+        fast = sampler.end(0.01, "GET", "/actors")
+
+        self.assertIsNone(fast)
+        self.assertGreater(slow["samples"], 0)
+        self.assertIn("test_keeps_only_slow_request_profiles",
+                      slow["stacks"][0]["stack"])
+        self.assertEqual(list(sampler.profiles), [slow])
+
+
+class PoolOptionsTestCase(unittest.TestCase):
+    """This class represents the connection pool options test case"""
+
+    def test_pool_options_from_config(self):
+        options = engine_options({
+            "DB_POOL_SIZE": "10",
+            "DB_MAX_OVERFLOW": "5",
+            "DB_POOL_PRE_PING": "false"
+        }, "postgresql://localhost/casting")
+
+        self.assertEqual(options["poolclass"], TimedQueuePool)
+        self.assertEqual(options["pool_size"], 10)
+        self.assertEqual(options["max_overflow"], 5)
+        self.assertEqual(options["pool_recycle"], 1800)
+        self.assertFalse(options["pool_pre_ping"])
+
+    def test_pool_sizing_is_skipped_for_sqlite(self):
+        path = os.path.join(tempfile.gettempdir(), "casting.sqlite")
+        options = engine_options({"DB_POOL_SIZE": 10}, "sqlite:///" + path)
+
+        self.assertNotIn("pool_size", options)
+        self.assertNotIn("poolclass", options)
+        self.assertTrue(options["pool_pre_ping"])
+
+    def test_in_memory_sqlite_shares_one_connection(self):
+        options = engine_options({}, "sqlite://")
+
+        self.assertIs(options["poolclass"], StaticPool)
+        self.assertNotIn("pool_recycle", options)
+
+
+class ReplicaRouterTestCase(unittest.TestCase):
+    """This class represents the read replica routing test case"""
+
+    def setUp(self):
+        self.router = ReplicaRouter(["sqlite://", "sqlite://"],
+                                    read_your_writes=60, retry_interval=60,
+                                    secret_key="test")
+
+    def test_replicas_are_chosen_round_robin(self):
+        first, second = self.router.engines
+
+        self.assertIs(self.router.choose(), first)
+        self.assertIs(self.router.choose(), second)
+        self.assertIs(self.router.choose(), first)
+
+    def test_replica_marked_down_is_skipped(self):
+        first, second = self.router.engines
+        self.router.mark_down(first)
+
+        self.assertIs(self.router.choose(), second)
+        self.assertIs(self.router.choose(), second)
+        self.router.mark_down(second)
+        self.assertIsNone(self.router.choose())
+
+    def test_recent_writer_reads_from_primary_on_any_worker(self):
+        token = self.router.write_token()
+        other_worker = ReplicaRouter(["sqlite://"], read_your_writes=60,
+                                     secret_key="test")
+        other_secret = ReplicaRouter(["sqlite://"], read_your_writes=60,
+                                     secret_key="other")
+        expired = ReplicaRouter(["sqlite://"], read_your_writes=-1,
+                                secret_key="test")
+
+        self.assertTrue(self.router.must_read_primary(token))
+        self.assertTrue(other_worker.must_read_primary(token))
+        self.assertFalse(other_secret.must_read_primary(token))
+        self.assertFalse(expired.must_read_primary(token))
+        self.assertFalse(self.router.must_read_primary(None))
+        self.assertFalse(self.router.must_read_primary(token + "x"))
+
+    def test_replicas_may_lag_after_any_write(self):
+        cache = ResponseCache(RedisBackend.from_url("local://"))
+        self.assertFalse(cache.invalidated_within(60))
+        cache.invalidate()
+
+        self.assertTrue(cache.invalidated_within(60))
+        self.assertFalse(cache.invalidated_within(0))
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":